@@ -14,23 +14,47 @@ import json
 import os
 import logging
 import math
-from typing import Dict, List, Any, Optional, Tuple
-from openai import OpenAI
+import re
+import unicodedata
+from array import array
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import AbstractSet, Dict, List, Any, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 
 class SulfurCapError(Exception):
-    """Raised when sulfur cannot be capped to the required threshold."""
-    pass
+    """
+    Raised when sulfur cannot be capped to the required threshold.
+    
+    coverage_pct is the final S coverage (None when the S deficit is 0) and
+    threshold_pct the max_coverage_pct that could not be met.
+    """
+    
+    def __init__(self, message: str, coverage_pct: Optional[float] = None, threshold_pct: float = 110):
+        super().__init__(message)
+        self.coverage_pct = coverage_pct
+        self.threshold_pct = threshold_pct
 
 AI_INTEGRATIONS_OPENAI_API_KEY = os.environ.get("AI_INTEGRATIONS_OPENAI_API_KEY")
 AI_INTEGRATIONS_OPENAI_BASE_URL = os.environ.get("AI_INTEGRATIONS_OPENAI_BASE_URL")
 
-openai_client = OpenAI(
-    api_key=AI_INTEGRATIONS_OPENAI_API_KEY,
-    base_url=AI_INTEGRATIONS_OPENAI_BASE_URL
-)
+# Created on first use so importing this module (e.g. during test collection)
+# does not pull in the OpenAI SDK; tests may patch openai_client directly.
+openai_client = None
+
+
+def get_openai_client():
+    """Return the shared OpenAI client, creating it on first call."""
+    global openai_client
+    if openai_client is None:
+        from openai import OpenAI
+        openai_client = OpenAI(
+            api_key=AI_INTEGRATIONS_OPENAI_API_KEY,
+            base_url=AI_INTEGRATIONS_OPENAI_BASE_URL
+        )
+    return openai_client
 
 # =============================================================================
 # CONSTANTS: Agronomic thresholds and fertilizer classifications
@@ -47,30 +71,30 @@ MAX_ALLOWED_WHEN_NO_DEFICIT = {
 }
 
 # Fertilizers that are "centered" on specific nutrients (primary purpose)
-K_CENTERED_FERTILIZERS = {
+K_CENTERED_FERTILIZERS = frozenset({
     'potassium_chloride', 'kcl', 'cloruro_de_potasio', 'cloruro_potasio',
     'potassium_nitrate', 'kno3', 'nitrato_de_potasio', 'nitrato_potasio',
     'potassium_sulfate', 'sop', 'k2so4', 'sulfato_de_potasio', 'sulfato_potasio',
     'monopotassium_phosphate', 'mkp', 'kh2po4', 'fosfato_monopotasico'
-}
+})
 
-MG_CENTERED_FERTILIZERS = {
+MG_CENTERED_FERTILIZERS = frozenset({
     'magnesium_sulfate', 'mgso4', 'sulfato_de_magnesio', 'sulfato_magnesio',
     'magnesium_nitrate', 'mg_no3_2', 'nitrato_de_magnesio', 'nitrato_magnesio'
-}
+})
 
-CA_CENTERED_FERTILIZERS = {
+CA_CENTERED_FERTILIZERS = frozenset({
     'calcium_nitrate', 'ca_no3_2', 'nitrato_de_calcio', 'nitrato_calcio'
-}
+})
 
 # Fertilizers containing chloride (problematic when Cl- in water is high)
-CHLORIDE_FERTILIZERS = {
+CHLORIDE_FERTILIZERS = frozenset({
     'potassium_chloride', 'kcl', 'cloruro_de_potasio', 'cloruro_potasio',
     'calcium_chloride', 'cacl2', 'cloruro_de_calcio'
-}
+})
 
 # Sulfur-containing fertilizers (sulfatos) - can cause S over-supply when S deficit is low
-SULFATE_FERTILIZERS = {
+SULFATE_FERTILIZERS = frozenset({
     'ammonium_sulfate', 'sulfato_de_amonio', 'sulfato_amonio', '(nh4)2so4',
     'magnesium_sulfate', 'mgso4', 'sulfato_de_magnesio', 'sulfato_magnesio',
     'potassium_sulfate', 'sop', 'k2so4', 'sulfato_de_potasio', 'sulfato_potasio',
@@ -78,7 +102,7 @@ SULFATE_FERTILIZERS = {
     'iron_sulfate', 'feso4', 'sulfato_de_hierro', 'sulfato_hierro',
     'copper_sulfate', 'cuso4', 'sulfato_de_cobre', 'sulfato_cobre',
     'manganese_sulfate', 'mnso4', 'sulfato_de_manganeso', 'sulfato_manganeso'
-}
+})
 
 # Threshold below which S deficit is considered "low" - sulfates should be restricted
 LOW_S_DEFICIT_THRESHOLD = 5.0  # kg/ha
@@ -99,34 +123,34 @@ STAGE_MAPPING = {
 # ION CONSTRAINTS ENGINE - Fertilizer classification for N form analysis
 # =============================================================================
 
-NH4_FERTILIZERS = {
+NH4_FERTILIZERS = frozenset({
     'ammonium_sulfate', 'sulfato_de_amonio', 'sulfato_amonio', '(nh4)2so4',
     'ammonium_nitrate', 'nitrato_amonico', 'nh4no3',
     'urea', 'carbamida', 'ch4n2o',
     'map', 'fosfato_monoamonico', 'monoammonium_phosphate', 'nh4h2po4',
     'dap', 'fosfato_diamonico', 'diammonium_phosphate', '(nh4)2hpo4'
-}
+})
 
-NO3_FERTILIZERS = {
+NO3_FERTILIZERS = frozenset({
     'calcium_nitrate', 'nitrato_de_calcio', 'nitrato_calcio', 'ca(no3)2',
     'potassium_nitrate', 'nitrato_de_potasio', 'nitrato_potasio', 'kno3',
     'magnesium_nitrate', 'nitrato_de_magnesio', 'nitrato_magnesio', 'mg(no3)2',
     'sodium_nitrate', 'nitrato_de_sodio', 'nitrato_sodio', 'nano3'
-}
+})
 
-PHOSPHATE_FERTILIZERS = {
+PHOSPHATE_FERTILIZERS = frozenset({
     'map', 'fosfato_monoamonico', 'monoammonium_phosphate',
     'dap', 'fosfato_diamonico', 'diammonium_phosphate',
     'mkp', 'fosfato_monopotasico', 'monopotassium_phosphate',
     'triple_superphosphate', 'superfosfato_triple', 'tsp',
     'phosphoric_acid', 'acido_fosforico', 'h3po4'
-}
+})
 
-CA_FERTILIZERS = {
+CA_FERTILIZERS = frozenset({
     'calcium_nitrate', 'nitrato_de_calcio', 'nitrato_calcio',
     'calcium_chloride', 'cloruro_de_calcio', 'cacl2',
     'gypsum', 'yeso', 'caso4'
-}
+})
 
 # =============================================================================
 # ACID RECOMMENDATION SYSTEM FOR FERTIIRRIGATION
@@ -302,12 +326,74 @@ def recommend_acids_for_fertiirrigation(
     2. Use multiple acids (up to 3) if needed to complete neutralization
     3. Prioritize acids by nutrient utility (deficit / projected contribution)
     4. Track cumulative contributions and update deficits after each selection
+    
+    Results are memoized on the inputs that affect them (HCO3-, deficits,
+    volumes and acid prices); callers receive a private copy.
     """
     hco3_meq = (
         water_analysis.get('hco3_meq_l', 0) or 
         water_analysis.get('hco3_meqL', 0) or 
         water_analysis.get('bicarbonates_meq', 0) or 0
     )
+    prices = user_prices or {}
+    acid_prices = tuple((acid_id, prices[acid_id]) for acid_id in ACID_CATALOG if acid_id in prices)
+    cache_key = (hco3_meq, tuple(sorted(deficits.items())), water_volume_m3_ha, num_applications, area_ha, acid_prices)
+    
+    try:
+        hash(cache_key)
+    except TypeError:
+        result = _recommend_acids(*cache_key)
+    else:
+        result = _copy_acid_recommendation(_recommend_acids_cached(*cache_key))
+    
+    # Keep the caller's key order in adjusted_deficits despite the sorted key
+    adjusted_deficits = {k: result['adjusted_deficits'][k] for k in deficits}
+    adjusted_deficits.update(result['adjusted_deficits'])
+    result['adjusted_deficits'] = adjusted_deficits
+    
+    if hco3_meq >= MIN_HCO3_FOR_ACID:
+        _log_acid_recommendation(result, deficits)
+    return result
+
+
+def _log_acid_recommendation(rec: Dict[str, Any], deficits: Dict[str, float]) -> None:
+    """Log the [AcidExpert] summary; runs on every call, cached or not."""
+    hco3_meq = rec['hco3_meq_l']
+    target_neutralization_meq = hco3_meq * TARGET_NEUTRALIZATION_PCT
+    
+    # Re-sum from the per-acid entries, which keep full precision
+    total_contributions = {'N': 0.0, 'P': 0.0, 'S': 0.0}
+    for acid in rec['acids']:
+        for nutrient, value in acid['nutrient_contribution'].items():
+            total_contributions[nutrient] += value
+    total_neutralization = sum(a['meq_neutralized'] for a in rec['acids'])
+    neutralization_achieved_pct = (total_neutralization / hco3_meq * 100) if hco3_meq > 0 else 0
+    
+    logger.info(f"[AcidExpert] HCO3-: {hco3_meq:.2f} meq/L, Selected {len(rec['acids'])} acids")
+    logger.info(f"[AcidExpert] Neutralization: {total_neutralization:.2f}/{target_neutralization_meq:.2f} meq/L ({neutralization_achieved_pct:.0f}%)")
+    logger.info(f"[AcidExpert] Contributions: N={total_contributions['N']:.2f}, P={total_contributions['P']:.2f}, S={total_contributions['S']:.2f} kg/ha")
+    
+    for nutrient in ['N', 'P', 'S']:
+        orig = deficits.get(nutrient if nutrient != 'P' else 'P2O5', 0)
+        if nutrient == 'P':
+            orig = orig / 2.29 if orig > 0 else 0
+        contrib = total_contributions.get(nutrient, 0)
+        if orig > 0:
+            coverage_pct = (contrib / orig) * 100
+            logger.info(f"[AcidExpert] {nutrient} coverage from acids: {coverage_pct:.1f}% (max 115%)")
+
+
+def _recommend_acids(
+    hco3_meq: float,
+    deficit_items: Tuple[Tuple[str, float], ...],
+    water_volume_m3_ha: float,
+    num_applications: int,
+    area_ha: float,
+    acid_prices: Tuple[Tuple[str, float], ...]
+) -> Dict[str, Any]:
+    """Acid selection for recommend_acids_for_fertiirrigation() on pre-extracted inputs."""
+    deficits = dict(deficit_items)
+    user_prices = dict(acid_prices)
     
     if hco3_meq < MIN_HCO3_FOR_ACID:
         return {
@@ -470,19 +556,6 @@ def recommend_acids_for_fertiirrigation(
     total_neutralization = sum(a['meq_neutralized'] for a in selected_acids)
     neutralization_achieved_pct = (total_neutralization / hco3_meq * 100) if hco3_meq > 0 else 0
     
-    logger.info(f"[AcidExpert] HCO3-: {hco3_meq:.2f} meq/L, Selected {len(selected_acids)} acids")
-    logger.info(f"[AcidExpert] Neutralization: {total_neutralization:.2f}/{target_neutralization_meq:.2f} meq/L ({neutralization_achieved_pct:.0f}%)")
-    logger.info(f"[AcidExpert] Contributions: N={total_contributions['N']:.2f}, P={total_contributions['P']:.2f}, S={total_contributions['S']:.2f} kg/ha")
-    
-    for nutrient in ['N', 'P', 'S']:
-        orig = original_deficits.get(nutrient if nutrient != 'P' else 'P2O5', 0)
-        if nutrient == 'P':
-            orig = orig / 2.29 if orig > 0 else 0
-        contrib = total_contributions.get(nutrient, 0)
-        if orig > 0:
-            coverage_pct = (contrib / orig) * 100
-            logger.info(f"[AcidExpert] {nutrient} coverage from acids: {coverage_pct:.1f}% (max 115%)")
-    
     return {
         'recommended': len(selected_acids) > 0,
         'reason': f'HCO3- = {hco3_meq:.2f} meq/L, neutralización {neutralization_achieved_pct:.0f}% lograda',
@@ -497,10 +570,41 @@ def recommend_acids_for_fertiirrigation(
     }
 
 
+_recommend_acids_cached = lru_cache(maxsize=512)(_recommend_acids)
+
+
+def _copy_acid_recommendation(rec: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy every container of an acid recommendation; the leaves are immutable."""
+    return {
+        **rec,
+        'acids': [
+            {**acid, 'nutrient_contribution': dict(acid['nutrient_contribution'])}
+            for acid in rec['acids']
+        ],
+        'total_contributions': dict(rec['total_contributions']),
+        'adjusted_deficits': dict(rec['adjusted_deficits']),
+        'warnings': list(rec['warnings']),
+    }
+
+
+def _fold_stage_name(stage: str) -> str:
+    """Lowercase, trimmed, accent-free form of a stage name."""
+    decomposed = unicodedata.normalize('NFKD', stage.lower().strip())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+# Every STAGE_MAPPING key folded once at import, so one probe resolves any accent spelling
+_STAGE_LOOKUP = {_fold_stage_name(key): stage for key, stage in STAGE_MAPPING.items()}
+
+
+@lru_cache(maxsize=64)
+def _stage_lookup_key(stage: str) -> str:
+    return _fold_stage_name(stage)
+
+
 def normalize_stage(stage: str) -> str:
     """Normalize growth stage name to standard key."""
-    stage_lower = stage.lower().strip() if stage else ''
-    return STAGE_MAPPING.get(stage_lower, 'default')
+    return _STAGE_LOOKUP.get(_stage_lookup_key(stage) if stage else '', 'default')
 
 
 # =============================================================================
@@ -510,14 +614,14 @@ def normalize_stage(stage: str) -> str:
 ACID_NUTRIENT_COVERAGE_THRESHOLD = 0.80  # 80% coverage triggers preference for alternatives
 ACID_HARD_EXCLUDE_THRESHOLD = 1.00  # 100% coverage = hard exclude fertilizers with that nutrient
 
-SULFATE_FERTILIZERS = [
+SULFATE_FERTILIZERS = frozenset({
     'sulfato_de_magnesio', 'magnesium_sulfate', 'epsom_salt', 'sal_de_epsom',
     'sulfato_de_potasio', 'potassium_sulfate', 'sop',
     'sulfato_de_amonio', 'ammonium_sulfate',
     'sulfato_de_zinc', 'zinc_sulfate',
     'sulfato_de_manganeso', 'manganese_sulfate',
     'sulfato_de_cobre', 'copper_sulfate',
-]
+})
 
 NITRATE_ALTERNATIVES = {
     'sulfato_de_magnesio': 'nitrato_de_magnesio',
@@ -939,6 +1043,105 @@ def enforce_nutrient_caps(
 # ION CONSTRAINTS ENGINE
 # =============================================================================
 
+# Fixed parts of every constraints object, built once; build_ion_constraints
+# copies them into fresh lists so callers may still mutate their result
+ION_KCL_BAN_IDS = ('potassium_chloride', 'kcl', 'cloruro_de_potasio', 'cloruro_potasio')
+ION_TANK_A_GROUPS = ('sulfates', 'phosphates', 'micros')
+ION_TANK_B_GROUPS = ('calcium_nitrates', 'magnesium_nitrates')
+ION_AB_COMPATIBILITY_NOTES = (
+    "Tank A: sulfatos, fosfatos, micros",
+    "Tank B: nitratos de Ca/Mg",
+    "No mezclar Ca con fosfatos/sulfatos (precipitación)",
+)
+
+
+# =============================================================================
+# ION CONSTRAINT RULES
+# Each rule takes (ctx, crop, stage, deficits, out): ctx carries the water/soil
+# dicts plus the normalized stage and coverage limit, crop is the lowercased
+# crop name, stage the raw growth stage and out the constraints being built.
+# =============================================================================
+
+def _ion_rule_chloride(ctx, crop, stage, deficits, out):
+    """RULE 1: Chloride in water - ban KCl if Cl- > 2.0 meq/L."""
+    water = ctx['water']
+    cl_meq = water.get('cl_meq_l', 0) or water.get('cl_meqL', 0) or 0
+    if cl_meq > 2.0:
+        out['hard_bans'].update(ION_KCL_BAN_IDS)
+        out['warnings'].append(f"Cl- alto en agua ({cl_meq:.1f} meq/L > 2.0): KCl prohibido")
+        out['rules_applied'].append('RULE_1_CL_HIGH')
+        logger.info(f"[Ion Constraints] RULE 1: Cl- = {cl_meq:.1f} meq/L > 2.0 -> KCl banned")
+
+
+def _ion_rule_bicarbonate(ctx, crop, stage, deficits, out):
+    """RULE 2: Bicarbonates in water - acidification warning."""
+    water = ctx['water']
+    hco3_meq = water.get('hco3_meq_l', 0) or water.get('hco3_meqL', 0) or water.get('bicarbonates_meq', 0) or 0
+    if hco3_meq > 2.0:
+        out['warnings'].append(f"HCO3- alto ({hco3_meq:.1f} meq/L > 2.0): Acidificación obligatoria")
+        out['rules_applied'].append('RULE_2_HCO3_HIGH')
+        logger.info(f"[Ion Constraints] RULE 2: HCO3- = {hco3_meq:.1f} meq/L > 2.0 -> Acidification required")
+
+
+def _ion_rule_tomato_n_form(ctx, crop, stage, deficits, out):
+    """RULE 3: N Form for Tomato in seedling/transplant stages."""
+    if 'tomate' not in crop and 'tomato' not in crop:
+        return
+    stage_lower = stage.lower()
+    if not (ctx['normalized_stage'] == 'seedling' or 'plántula' in stage_lower or 'trasplante' in stage_lower):
+        return
+    out['nutrient_shares'] = {
+        'NH4_share_max': 0.30,
+        'NO3_share_min': 0.70,
+        'prefer_nitrates': True,
+        'limit_ammonium': True
+    }
+    out['warnings'].append("Tomate en etapa temprana: NH4+ máx 30%, NO3- mín 70%")
+    out['rules_applied'].append('RULE_3_TOMATO_N_FORM')
+    logger.info(f"[Ion Constraints] RULE 3: Tomato seedling -> NH4 max 30%, NO3 min 70%")
+
+
+def _ion_rule_deficit_caps(ctx, crop, stage, deficits, out):
+    """RULE 4: Caps for low deficits (especially S)."""
+    caps = out['caps_kg_ha']
+    coverage_factor = ctx['max_coverage_pct'] / 100
+    for nutrient, deficit in deficits.items():
+        if deficit > 0:
+            caps[nutrient] = deficit * coverage_factor
+    
+    s_deficit = deficits.get('S', 0) or 0
+    if 0 < s_deficit < LOW_S_DEFICIT_THRESHOLD:
+        caps['S'] = s_deficit * 1.10
+        out['warnings'].append(f"Déficit S bajo ({s_deficit:.1f} kg/ha): Cap estricto a {s_deficit * 1.10:.2f} kg/ha")
+        out['rules_applied'].append('RULE_4_LOW_S_CAP')
+        logger.info(f"[Ion Constraints] RULE 4: Low S deficit ({s_deficit:.1f}) -> strict cap at {s_deficit * 1.10:.2f} kg/ha")
+
+
+def _ion_rule_k_restriction(ctx, crop, stage, deficits, out):
+    """RULE 5: Avoid K when no deficit or soil K is high."""
+    soil = ctx['soil']
+    k2o_deficit = deficits.get('K2O', 0) or 0
+    soil_k_ppm = soil.get('k_ppm', 0) or soil.get('potassium_ppm', 0) or 0
+    
+    if k2o_deficit == 0 or soil_k_ppm > 400:
+        k_cap = 2.0 if ctx['normalized_stage'] == 'seedling' else 5.0
+        out['caps_kg_ha']['K2O'] = k_cap
+        out['warnings'].append(f"K2O déficit=0 o K suelo alto ({soil_k_ppm} ppm): Cap K2O a {k_cap} kg/ha")
+        out['rules_applied'].append('RULE_5_K_RESTRICTION')
+        logger.info(f"[Ion Constraints] RULE 5: K2O deficit=0 or soil K high -> K2O cap at {k_cap} kg/ha")
+
+
+def _ion_rule_ab_compatibility(ctx, crop, stage, deficits, out):
+    """RULE 6: A/B Tank Compatibility (notes are part of the initial object)."""
+    out['rules_applied'].append('RULE_6_AB_COMPATIBILITY')
+
+
+# Rules that only read the water analysis; skipped en bloc when it is empty.
+_ION_WATER_RULES = (_ion_rule_chloride, _ion_rule_bicarbonate)
+_ION_RULES = (_ion_rule_tomato_n_form, _ion_rule_deficit_caps,
+              _ion_rule_k_restriction, _ion_rule_ab_compatibility)
+
+
 def build_ion_constraints(
     agronomic_context: Optional[Dict[str, Any]],
     crop_name: str,
@@ -950,7 +1153,7 @@ def build_ion_constraints(
     Build ionic constraints object from agronomic context.
     
     Analyzes water/soil/crop/stage to generate:
-    - hard_bans: List of fertilizer IDs/patterns to prohibit
+    - hard_bans: Frozenset of fertilizer IDs/patterns to prohibit
     - caps_kg_ha: Dict of max nutrient application limits
     - nutrient_shares: Dict with NO3/NH4 share targets
     - compatibility: Tank A/B assignment rules
@@ -967,13 +1170,13 @@ def build_ion_constraints(
         Dict with ionic constraints
     """
     constraints = {
-        'hard_bans': [],
+        'hard_bans': set(),
         'caps_kg_ha': {},
         'nutrient_shares': {},
         'compatibility': {
-            'tank_a': ['sulfates', 'phosphates', 'micros'],
-            'tank_b': ['calcium_nitrates', 'magnesium_nitrates'],
-            'notes': []
+            'tank_a': list(ION_TANK_A_GROUPS),
+            'tank_b': list(ION_TANK_B_GROUPS),
+            'notes': list(ION_AB_COMPATIBILITY_NOTES)
         },
         'warnings': [],
         'rules_applied': []
@@ -985,85 +1188,19 @@ def build_ion_constraints(
         water = agronomic_context.get('water', {}) or {}
         soil = agronomic_context.get('soil', {}) or {}
     
-    normalized_stage = normalize_stage(growth_stage)
+    ctx = {
+        'water': water,
+        'soil': soil,
+        'normalized_stage': normalize_stage(growth_stage),
+        'max_coverage_pct': max_coverage_pct,
+    }
     crop_lower = (crop_name or '').lower().strip()
     
-    # =========================================================================
-    # RULE 1: Chloride in water - ban KCl if Cl- > 2.0 meq/L
-    # =========================================================================
-    cl_meq = water.get('cl_meq_l', 0) or water.get('cl_meqL', 0) or 0
-    if cl_meq > 2.0:
-        constraints['hard_bans'].extend(['potassium_chloride', 'kcl', 'cloruro_de_potasio', 'cloruro_potasio'])
-        constraints['warnings'].append(f"Cl- alto en agua ({cl_meq:.1f} meq/L > 2.0): KCl prohibido")
-        constraints['rules_applied'].append('RULE_1_CL_HIGH')
-        logger.info(f"[Ion Constraints] RULE 1: Cl- = {cl_meq:.1f} meq/L > 2.0 -> KCl banned")
-    
-    # =========================================================================
-    # RULE 2: Bicarbonates in water - acidification warning
-    # =========================================================================
-    hco3_meq = water.get('hco3_meq_l', 0) or water.get('hco3_meqL', 0) or water.get('bicarbonates_meq', 0) or 0
-    if hco3_meq > 2.0:
-        constraints['warnings'].append(f"HCO3- alto ({hco3_meq:.1f} meq/L > 2.0): Acidificación obligatoria")
-        constraints['rules_applied'].append('RULE_2_HCO3_HIGH')
-        logger.info(f"[Ion Constraints] RULE 2: HCO3- = {hco3_meq:.1f} meq/L > 2.0 -> Acidification required")
-    
-    # =========================================================================
-    # RULE 3: N Form for Tomato in seedling/transplant stages
-    # =========================================================================
-    is_tomato = 'tomate' in crop_lower or 'tomato' in crop_lower
-    is_early_stage = normalized_stage == 'seedling' or 'plántula' in growth_stage.lower() or 'trasplante' in growth_stage.lower()
-    
-    if is_tomato and is_early_stage:
-        constraints['nutrient_shares'] = {
-            'NH4_share_max': 0.30,
-            'NO3_share_min': 0.70,
-            'prefer_nitrates': True,
-            'limit_ammonium': True
-        }
-        constraints['warnings'].append("Tomate en etapa temprana: NH4+ máx 30%, NO3- mín 70%")
-        constraints['rules_applied'].append('RULE_3_TOMATO_N_FORM')
-        logger.info(f"[Ion Constraints] RULE 3: Tomato seedling -> NH4 max 30%, NO3 min 70%")
-    
-    # =========================================================================
-    # RULE 4: Caps for low deficits (especially S)
-    # =========================================================================
-    for nutrient, deficit in deficits.items():
-        if deficit > 0:
-            max_allowed = deficit * (max_coverage_pct / 100)
-            constraints['caps_kg_ha'][nutrient] = max_allowed
-    
-    s_deficit = deficits.get('S', 0) or 0
-    if 0 < s_deficit < LOW_S_DEFICIT_THRESHOLD:
-        constraints['caps_kg_ha']['S'] = s_deficit * 1.10
-        constraints['warnings'].append(f"Déficit S bajo ({s_deficit:.1f} kg/ha): Cap estricto a {s_deficit * 1.10:.2f} kg/ha")
-        constraints['rules_applied'].append('RULE_4_LOW_S_CAP')
-        logger.info(f"[Ion Constraints] RULE 4: Low S deficit ({s_deficit:.1f}) -> strict cap at {s_deficit * 1.10:.2f} kg/ha")
+    rules = _ION_WATER_RULES + _ION_RULES if water else _ION_RULES
+    for rule in rules:
+        rule(ctx, crop_lower, growth_stage, deficits, constraints)
     
-    # =========================================================================
-    # RULE 5: Avoid K when no deficit or soil K is high
-    # =========================================================================
-    k2o_deficit = deficits.get('K2O', 0) or 0
-    soil_k_ppm = soil.get('k_ppm', 0) or soil.get('potassium_ppm', 0) or 0
-    
-    if k2o_deficit == 0 or soil_k_ppm > 400:
-        if normalized_stage == 'seedling':
-            k_cap = 2.0
-        else:
-            k_cap = 5.0
-        constraints['caps_kg_ha']['K2O'] = k_cap
-        constraints['warnings'].append(f"K2O déficit=0 o K suelo alto ({soil_k_ppm} ppm): Cap K2O a {k_cap} kg/ha")
-        constraints['rules_applied'].append('RULE_5_K_RESTRICTION')
-        logger.info(f"[Ion Constraints] RULE 5: K2O deficit=0 or soil K high -> K2O cap at {k_cap} kg/ha")
-    
-    # =========================================================================
-    # RULE 6: A/B Tank Compatibility
-    # =========================================================================
-    constraints['compatibility']['notes'] = [
-        "Tank A: sulfatos, fosfatos, micros",
-        "Tank B: nitratos de Ca/Mg",
-        "No mezclar Ca con fosfatos/sulfatos (precipitación)"
-    ]
-    constraints['rules_applied'].append('RULE_6_AB_COMPATIBILITY')
+    constraints['hard_bans'] = frozenset(constraints['hard_bans'])
     
     logger.info(f"[Ion Constraints] Built constraints: {len(constraints['hard_bans'])} bans, "
                 f"{len(constraints['caps_kg_ha'])} caps, {len(constraints['warnings'])} warnings")
@@ -1071,6 +1208,20 @@ def build_ion_constraints(
     return constraints
 
 
+@lru_cache(maxsize=1024)
+def _ion_tank_for(fert_id: str, fert_name: str) -> Optional[str]:
+    """
+    Stock tank for a fertilizer given its lowercased id and name.
+    
+    Calcium nitrate goes to B and everything else (sulfates, phosphates and
+    the rest) to A. Other calcium sources return None, which leaves the
+    fertilizer's current tank untouched.
+    """
+    if is_fertilizer_in_set(fert_id, fert_name, CA_FERTILIZERS):
+        return 'B' if 'nitrato' in fert_name or 'nitrate' in fert_id else None
+    return 'A'
+
+
 def apply_ion_constraints(
     profile: Dict,
     constraints: Dict[str, Any],
@@ -1105,69 +1256,82 @@ def apply_ion_constraints(
         return profile
     
     audit_log = []
-    hard_bans = set(constraints.get('hard_bans', []))
+    # Lowercased once; a ban matches as a substring of the id or name
+    hard_bans = frozenset(ban.lower() for ban in constraints.get('hard_bans', ()))
     caps_kg_ha = constraints.get('caps_kg_ha', {})
     nutrient_shares = constraints.get('nutrient_shares', {})
     
+    # Normalized id/name -> first catalog position, so lookups don't rescan
+    # (and re-normalize) the whole catalog per fertilizer
+    catalog_by_id = {}
+    catalog_by_name = {}
+    for idx, f in enumerate(available_fertilizers):
+        catalog_by_id.setdefault((f.get('id', '') or '').lower().replace('-', '_'), idx)
+        catalog_by_name.setdefault((f.get('name', '') or '').lower(), idx)
+    
     def get_fert_data(fert):
-        fert_id = (fert.get('id', '') or '').lower().replace('-', '_')
-        fert_name = (fert.get('name', '') or '').lower()
-        for f in available_fertilizers:
-            f_id = (f.get('id', '') or '').lower().replace('-', '_')
-            f_name = (f.get('name', '') or '').lower()
-            if f_id == fert_id or f_name == fert_name:
-                return f
-        return None
+        id_idx = catalog_by_id.get((fert.get('id', '') or '').lower().replace('-', '_'))
+        name_idx = catalog_by_name.get((fert.get('name', '') or '').lower())
+        if id_idx is None:
+            return available_fertilizers[name_idx] if name_idx is not None else None
+        if name_idx is None:
+            return available_fertilizers[id_idx]
+        return available_fertilizers[min(id_idx, name_idx)]
     
     # =========================================================================
     # STEP 1: Apply hard bans
     # =========================================================================
     removed_ferts = []
     kept_ferts = []
-    for fert in fertilizers:
-        fert_id = (fert.get('id', '') or '').lower().replace('-', '_')
-        fert_name = (fert.get('name', '') or '').lower()
-        
-        is_banned = False
-        for ban in hard_bans:
-            ban_lower = ban.lower()
-            if ban_lower in fert_id or ban_lower in fert_name or 'cloruro' in fert_name and 'potasio' in fert_name:
-                is_banned = True
-                break
-        
-        if is_banned:
-            removed_ferts.append(fert.get('name', fert.get('id', 'unknown')))
-            audit_log.append(f"BANNED: {fert.get('name')} (matches hard_bans)")
-            logger.info(f"[Ion Constraints] Removed banned fertilizer: {fert.get('name')}")
-        else:
-            kept_ferts.append(fert)
+    if hard_bans:
+        # One regex scan per string covers every ban substring
+        ban_pattern = _fertilizer_set_pattern(hard_bans)
+        for fert in fertilizers:
+            fert_id = (fert.get('id', '') or '').lower().replace('-', '_')
+            fert_name = (fert.get('name', '') or '').lower()
+            
+            # Any active ban also catches KCl listed under its Spanish name
+            is_banned = (
+                'cloruro' in fert_name and 'potasio' in fert_name
+                or bool(ban_pattern.search(fert_id) or ban_pattern.search(fert_name))
+            )
+            
+            if is_banned:
+                removed_ferts.append(fert.get('name', fert.get('id', 'unknown')))
+                audit_log.append(f"BANNED: {fert.get('name')} (matches hard_bans)")
+                logger.info(f"[Ion Constraints] Removed banned fertilizer: {fert.get('name')}")
+            else:
+                kept_ferts.append(fert)
+    else:
+        # No bans: nothing to normalize or match
+        kept_ferts = list(fertilizers)
     
     fertilizers = kept_ferts
+    # Catalog percentages of each kept fertilizer (SUPPLY_NUTRIENTS order,
+    # None if unmatched); steps 2-3 only change doses, so rows stay valid
+    pct_rows = [
+        _pct_row(fert_data) if fert_data else None
+        for fert_data in map(get_fert_data, fertilizers)
+    ]
+    n_col = SUPPLY_COLUMN['N']
     
     # =========================================================================
     # STEP 2: Apply nutrient caps
     # =========================================================================
-    def calculate_nutrient_total(nutrient_key, pct_key):
+    def calculate_nutrient_total(col):
         total = 0
-        for fert in fertilizers:
-            fert_data = get_fert_data(fert)
-            if fert_data:
+        for fert, row in zip(fertilizers, pct_rows):
+            if row:
                 dose = fert.get('dose_kg_ha', 0) or 0
-                pct = fert_data.get(pct_key, 0) or 0
-                total += dose * pct / 100
+                total += dose * row[col] / 100
         return total
     
-    NUTRIENT_PCT_MAP = {
-        'N': 'n_pct', 'P2O5': 'p2o5_pct', 'K2O': 'k2o_pct',
-        'Ca': 'ca_pct', 'Mg': 'mg_pct', 'S': 's_pct'
-    }
-    
     for nutrient, max_kg in caps_kg_ha.items():
-        if nutrient not in NUTRIENT_PCT_MAP:
+        col = SUPPLY_COLUMN.get(nutrient)
+        if col is None:
             continue
         
-        pct_key = NUTRIENT_PCT_MAP[nutrient]
-        current_total = calculate_nutrient_total(nutrient, pct_key)
+        current_total = calculate_nutrient_total(col)
         
         if current_total <= max_kg:
             continue
@@ -1175,15 +1339,14 @@ def apply_ion_constraints(
         excess = current_total - max_kg
         audit_log.append(f"CAP {nutrient}: {current_total:.2f} kg -> max {max_kg:.2f} kg (excess {excess:.2f})")
         
-        for i, fert in enumerate(fertilizers):
+        for i, (fert, row) in enumerate(zip(fertilizers, pct_rows)):
             if excess <= 0.01:
                 break
-            fert_data = get_fert_data(fert)
-            if not fert_data:
+            if not row:
                 continue
             
             dose = fert.get('dose_kg_ha', 0) or 0
-            pct = fert_data.get(pct_key, 0) or 0
+            pct = row[col]
             if pct <= 0 or dose <= 0:
                 continue
             
@@ -1209,15 +1372,14 @@ def apply_ion_constraints(
         
         nh4_total = 0
         no3_total = 0
-        for fert in fertilizers:
+        for fert, row in zip(fertilizers, pct_rows):
+            if not row:
+                continue
             fert_id = (fert.get('id', '') or '').lower()
             fert_name = (fert.get('name', '') or '').lower()
-            fert_data = get_fert_data(fert)
-            if not fert_data:
-                continue
             
             dose = fert.get('dose_kg_ha', 0) or 0
-            n_pct = fert_data.get('n_pct', 0) or 0
+            n_pct = row[n_col]
             n_kg = dose * n_pct / 100
             
             if is_fertilizer_in_set(fert_id, fert_name, NH4_FERTILIZERS):
@@ -1236,7 +1398,7 @@ def apply_ion_constraints(
                 
                 excess_nh4 = (nh4_share - nh4_max) * total_n
                 
-                for i, fert in enumerate(fertilizers):
+                for i, (fert, row) in enumerate(zip(fertilizers, pct_rows)):
                     if excess_nh4 <= 0.1:
                         break
                     fert_id = (fert.get('id', '') or '').lower()
@@ -1247,12 +1409,11 @@ def apply_ion_constraints(
                     if 'sulfato' not in fert_name and 'ammonium_sulfate' not in fert_id:
                         continue
                     
-                    fert_data = get_fert_data(fert)
-                    if not fert_data:
+                    if not row:
                         continue
                     
                     dose = fert.get('dose_kg_ha', 0) or 0
-                    n_pct = fert_data.get('n_pct', 0) or 0
+                    n_pct = row[n_col]
                     if n_pct <= 0:
                         continue
                     
@@ -1270,19 +1431,13 @@ def apply_ion_constraints(
     # =========================================================================
     # STEP 4: Assign tanks A/B for compatibility
     # =========================================================================
-    for i, fert in enumerate(fertilizers):
-        fert_id = (fert.get('id', '') or '').lower()
-        fert_name = (fert.get('name', '') or '').lower()
-        
-        if is_fertilizer_in_set(fert_id, fert_name, CA_FERTILIZERS):
-            if 'nitrato' in fert_name or 'nitrate' in fert_id:
-                fertilizers[i]['tank'] = 'B'
-        elif is_fertilizer_in_set(fert_id, fert_name, SULFATE_FERTILIZERS):
-            fertilizers[i]['tank'] = 'A'
-        elif is_fertilizer_in_set(fert_id, fert_name, PHOSPHATE_FERTILIZERS):
-            fertilizers[i]['tank'] = 'A'
-        else:
-            fertilizers[i]['tank'] = 'A'
+    for fert in fertilizers:
+        tank = _ion_tank_for(
+            (fert.get('id', '') or '').lower(),
+            (fert.get('name', '') or '').lower()
+        )
+        if tank is not None:
+            fert['tank'] = tank
     
     fertilizers = [f for f in fertilizers if (f.get('dose_kg_ha', 0) or 0) > 0.1]
     
@@ -1304,40 +1459,160 @@ def apply_ion_constraints(
     return profile
 
 
-def format_constraints_for_prompt(constraints: Dict[str, Any]) -> str:
-    """
-    Format ion constraints for inclusion in GPT prompt.
-    
-    Returns a string to append to the system prompt.
-    """
-    lines = ["IONIC CONSTRAINTS (MANDATORY):"]
-    
-    if constraints.get('hard_bans'):
-        lines.append(f"- PROHIBITED fertilizers: {', '.join(constraints['hard_bans'])}")
+_PROMPT_CONSTRAINTS_HEADER = "IONIC CONSTRAINTS (MANDATORY):"
+_PROMPT_N_FORM_PREFERENCE = "  Prefer calcium nitrate and magnesium nitrate over ammonium sulfate"
+_PROMPT_TANK_ASSIGNMENT = "- Tank assignment: Ca nitrates in Tank B, sulfates/phosphates in Tank A"
+
+
+@lru_cache(maxsize=256)
+def _format_constraints_cached(
+    hard_bans: Tuple[str, ...],
+    caps: Tuple[Tuple[str, float], ...],
+    n_form: Optional[Tuple[float, float]],
+    warnings: Tuple[str, ...]
+) -> str:
+    lines = [_PROMPT_CONSTRAINTS_HEADER]
     
-    if constraints.get('caps_kg_ha'):
-        caps = [f"{k}: max {v:.1f} kg/ha" for k, v in constraints['caps_kg_ha'].items()]
-        lines.append(f"- Nutrient caps: {', '.join(caps)}")
+    if hard_bans:
+        lines.append(f"- PROHIBITED fertilizers: {', '.join(hard_bans)}")
     
-    if constraints.get('nutrient_shares'):
-        shares = constraints['nutrient_shares']
-        if shares.get('limit_ammonium'):
-            lines.append(f"- N form: NH4+ max {shares.get('NH4_share_max', 0.30):.0%}, NO3- min {shares.get('NO3_share_min', 0.70):.0%}")
-            lines.append("  Prefer calcium nitrate and magnesium nitrate over ammonium sulfate")
+    if caps:
+        caps_text = [f"{k}: max {v:.1f} kg/ha" for k, v in caps]
+        lines.append(f"- Nutrient caps: {', '.join(caps_text)}")
     
-    if constraints.get('warnings'):
-        for w in constraints['warnings']:
-            lines.append(f"- Warning: {w}")
+    if n_form:
+        nh4_max, no3_min = n_form
+        lines.append(f"- N form: NH4+ max {nh4_max:.0%}, NO3- min {no3_min:.0%}")
+        lines.append(_PROMPT_N_FORM_PREFERENCE)
     
-    lines.append("- Tank assignment: Ca nitrates in Tank B, sulfates/phosphates in Tank A")
+    lines.extend(f"- Warning: {w}" for w in warnings)
+    lines.append(_PROMPT_TANK_ASSIGNMENT)
     
     return "\n".join(lines)
 
 
+def format_constraints_for_prompt(constraints: Dict[str, Any]) -> str:
+    """
+    Format ion constraints for inclusion in GPT prompt.
+    
+    Returns a string to append to the system prompt. The text depends only
+    on the sorted bans, the caps (in order), the N-form shares and the
+    warnings, so identical constraints reuse the cached string.
+    """
+    shares = constraints.get('nutrient_shares') or {}
+    n_form = None
+    if shares.get('limit_ammonium'):
+        n_form = (shares.get('NH4_share_max', 0.30), shares.get('NO3_share_min', 0.70))
+    
+    key = (
+        tuple(sorted(constraints.get('hard_bans') or ())),
+        tuple((constraints.get('caps_kg_ha') or {}).items()),
+        n_form,
+        tuple(constraints.get('warnings') or ())
+    )
+    try:
+        return _format_constraints_cached(*key)
+    except TypeError:
+        # Unhashable cap/share values: format without the cache
+        return _format_constraints_cached.__wrapped__(*key)
+
+
 # =============================================================================
 # EXPLAINABILITY ENGINE
 # =============================================================================
 
+@dataclass(slots=True, frozen=True)
+class AgronomicContextView:
+    """
+    Alias-resolved view of the agronomic_context fields used by the
+    explainability, target and hard-constraint helpers.
+    
+    Water/soil payloads arrive with several spellings for the same field
+    (cl_meq_l / cl_meqL, k_ppm / potassium_ppm, ...); every helper reads
+    the canonical attribute instead of repeating the alias chain.
+    """
+    cl_meq_l: float = 0
+    hco3_meq_l: float = 0
+    no3n_ppm: float = 0
+    k_ppm: float = 0
+    k_exchange_high: bool = False
+    
+    @classmethod
+    def from_context(cls, agronomic_context: Optional[Dict[str, Any]]) -> 'AgronomicContextView':
+        if not agronomic_context:
+            return cls()
+        water = agronomic_context.get('water', {}) or {}
+        soil = agronomic_context.get('soil', {}) or {}
+        return cls(
+            cl_meq_l=water.get('cl_meq_l', 0) or water.get('cl_meqL', 0) or 0,
+            hco3_meq_l=water.get('hco3_meq_l', 0) or water.get('hco3_meqL', 0) or water.get('bicarbonates_meq', 0) or 0,
+            no3n_ppm=soil.get('no3n_ppm', 0) or soil.get('no3_n_ppm', 0) or soil.get('nitrogen_ppm', 0) or 0,
+            k_ppm=soil.get('k_ppm', 0) or soil.get('potassium_ppm', 0) or 0,
+            k_exchange_high=soil.get('k_exchange_high', False),
+        )
+
+
+def is_early_growth_stage(growth_stage: str) -> bool:
+    """Seedling/transplant stage, by normalized key or raw Spanish name."""
+    stage_lower = (growth_stage or '').lower()
+    return normalize_stage(growth_stage) == 'seedling' or 'plántula' in stage_lower or 'trasplante' in stage_lower
+
+
+# Note/log templates, filled with str.format_map(facts) only when their rule applies
+NOTE_N_REDUCED = "Cobertura de N reducida intencionalmente por NO3-N alto en suelo ({no3n_ppm:.1f} ppm)."
+NOTE_N_STAGE_PRIORITY = "En esta etapa se prioriza NO3- y se limita NH4+."
+NOTE_K_AVOIDED_SOIL = "Fuentes de K evitadas por K alto en suelo ({k_ppm:.0f} ppm)."
+NOTE_K_AVOIDED_NO_DEFICIT = "Fuentes de K evitadas por déficit K2O = 0."
+NOTE_KCL_BANNED = "KCl prohibido por Cl- alto en agua ({cl_meq:.1f} meq/L > 2.0)."
+NOTE_S_CAPPED = "S limitado por cap de seguridad (≤110% del déficit) para evitar sobre-fertilización."
+NOTE_ACID_N = "Ácido nítrico aporta ~{acid_n:.2f} kg/ha de N (descontado del déficit)."
+NOTE_ACID_N_UNCOUNTED = "Ácido nítrico recomendado puede aportar N; no contabilizado aquí por falta de volumen total. (TODO: integrar volumen de riego)."
+
+# (applies, note templates, log template) per explainability rule, evaluated in order
+EXPLAINABILITY_RULES = (
+    # 1) NO3-N high in soil + early stage -> N reduced intentionally
+    (
+        lambda f: f['no3n_ppm'] >= 40 and f['is_early_stage'],
+        (NOTE_N_REDUCED, NOTE_N_STAGE_PRIORITY),
+        "High soil NO3-N ({no3n_ppm} ppm) in early stage - N coverage reduced intentionally",
+    ),
+    # 2) K2O deficit=0 or soil K high -> K sources avoided
+    (
+        lambda f: f['k_ppm'] >= 400,
+        (NOTE_K_AVOIDED_SOIL,),
+        "K sources avoided: K alto en suelo ({k_ppm:.0f} ppm)",
+    ),
+    (
+        lambda f: f['k2o_deficit'] == 0 and f['k_ppm'] < 400,
+        (NOTE_K_AVOIDED_NO_DEFICIT,),
+        "K sources avoided: déficit K2O = 0",
+    ),
+    # 3) Cl- high in water -> KCl banned
+    (
+        lambda f: f['cl_meq'] > 2.0,
+        (NOTE_KCL_BANNED,),
+        "KCl banned due to high Cl- ({cl_meq} meq/L)",
+    ),
+    # 4) S deficit small -> cap applied
+    (
+        lambda f: 0 < f['s_deficit'] < LOW_S_DEFICIT_THRESHOLD,
+        (NOTE_S_CAPPED,),
+        "S capped due to low deficit ({s_deficit} kg/ha)",
+    ),
+    # 5) Acid N contribution note (if applicable)
+    (
+        lambda f: f['acid_n'] > 0,
+        (NOTE_ACID_N,),
+        None,
+    ),
+    (
+        lambda f: f['acid_n'] <= 0 and f['acid_recommended'],
+        (NOTE_ACID_N_UNCOUNTED,),
+        None,
+    ),
+)
+
+
 def build_explainability_notes(
     deficits: Dict[str, float],
     agronomic_context: Optional[Dict[str, Any]],
@@ -1353,53 +1628,126 @@ def build_explainability_notes(
     
     Returns concatenated notes string to append to profile['notes'].
     """
+    ctx = AgronomicContextView.from_context(agronomic_context)
+    k2o_deficit = deficits.get('K2O', 0) or 0
+    s_deficit = deficits.get('S', 0) or 0
+    acid_n = profile.get('acid_n_contribution_kg_ha', 0) or 0
+    acid_recommended = profile.get('acid_recommended')
+    
+    # Common case: no rule can fire, skip stage normalization and formatting
+    if not (
+        ctx.no3n_ppm >= 40 or k2o_deficit == 0 or ctx.k_ppm >= 400 or ctx.cl_meq_l > 2.0
+        or 0 < s_deficit < LOW_S_DEFICIT_THRESHOLD or acid_n > 0 or acid_recommended
+    ):
+        return ""
+    
+    # Every input the rules read, resolved once
+    facts = {
+        'is_early_stage': ctx.no3n_ppm >= 40 and is_early_growth_stage(growth_stage),
+        'no3n_ppm': ctx.no3n_ppm,
+        'k2o_deficit': k2o_deficit,
+        'k_ppm': ctx.k_ppm,
+        'cl_meq': ctx.cl_meq_l,
+        's_deficit': s_deficit,
+        'acid_n': acid_n,
+        'acid_recommended': acid_recommended,
+    }
+    
     notes = []
+    for applies, note_templates, log_template in EXPLAINABILITY_RULES:
+        if applies(facts):
+            notes.extend(template.format_map(facts) for template in note_templates)
+            if log_template:
+                logger.info("[Explainability] " + log_template.format_map(facts))
     
-    water = {}
-    soil = {}
-    if agronomic_context:
-        water = agronomic_context.get('water', {}) or {}
-        soil = agronomic_context.get('soil', {}) or {}
+    return " ".join(notes)
+
+
+# Base minimum coverage (%) per profile type, before soil/deficit adjustments
+PROFILE_MIN_COVERAGE = {
+    'balanced': {'N': 90, 'P2O5': 90, 'K2O': 90, 'Ca': 70, 'Mg': 70, 'S': 70},
+    'economic': {'N': 85, 'P2O5': 85, 'K2O': 85, 'Ca': 50, 'Mg': 50, 'S': 50},
+    'complete': {'N': 95, 'P2O5': 95, 'K2O': 95, 'Ca': 80, 'Mg': 80, 'S': 80},
+}
+
+
+def _profile_target_adjustments(
+    growth_stage: str,
+    agronomic_context: Optional[Dict[str, Any]],
+    deficits: Dict[str, float]
+) -> tuple:
+    """
+    Profile-independent min_coverage overrides for get_profile_targets.
     
-    normalized_stage = normalize_stage(growth_stage)
-    stage_lower = (growth_stage or '').lower()
-    is_early_stage = normalized_stage == 'seedling' or 'plántula' in stage_lower or 'trasplante' in stage_lower
+    Soil status, stage and deficits adjust every profile the same way, so
+    they are resolved once and overlaid on each profile template.
     
-    # 1) NO3-N high in soil + early stage -> N reduced intentionally
-    no3n_ppm = soil.get('no3n_ppm', 0) or soil.get('no3_n_ppm', 0) or soil.get('nitrogen_ppm', 0) or 0
+    Returns: (min_coverage_overrides, coverage_explained)
+    """
+    ctx = AgronomicContextView.from_context(agronomic_context)
+    is_early_stage = is_early_growth_stage(growth_stage)
+    
+    overrides = {}
+    explained = {}
+    
+    # === NUTRIENT-SPECIFIC ADJUSTMENTS ===
+    
+    # N: Reduce requirement if soil NO3-N is high + early stage
+    no3n_ppm = ctx.no3n_ppm
     if no3n_ppm >= 40 and is_early_stage:
-        notes.append(f"Cobertura de N reducida intencionalmente por NO3-N alto en suelo ({no3n_ppm:.1f} ppm).")
-        notes.append("En esta etapa se prioriza NO3- y se limita NH4+.")
-        logger.info(f"[Explainability] High soil NO3-N ({no3n_ppm} ppm) in early stage - N coverage reduced intentionally")
+        overrides['N'] = 0 if no3n_ppm >= 60 else 30
+        explained['N'] = f"soil_sufficient (NO3-N {no3n_ppm:.0f} ppm)"
+        logger.info(f"[Profile Targets] N min reduced to {overrides['N']}% due to high soil NO3-N")
     
-    # 2) K2O deficit=0 or soil K high -> K sources avoided
+    # K2O: No requirement if deficit=0 or soil K high
     k2o_deficit = deficits.get('K2O', 0) or 0
-    k_ppm = soil.get('k_ppm', 0) or soil.get('potassium_ppm', 0) or 0
-    if k2o_deficit == 0 or k_ppm >= 400:
-        reason = f"K alto en suelo ({k_ppm:.0f} ppm)" if k_ppm >= 400 else "déficit K2O = 0"
-        notes.append(f"Fuentes de K evitadas por {reason}.")
-        logger.info(f"[Explainability] K sources avoided: {reason}")
+    k_ppm = ctx.k_ppm
+    if k2o_deficit == 0:
+        overrides['K2O'] = 0
+        explained['K2O'] = "no_deficit"
+    elif k_ppm >= 400:
+        overrides['K2O'] = 0
+        explained['K2O'] = f"soil_sufficient ({k_ppm:.0f} ppm)"
     
-    # 3) Cl- high in water -> KCl banned
-    cl_meq = water.get('cl_meq_l', 0) or water.get('cl_meqL', 0) or 0
-    if cl_meq > 2.0:
-        notes.append(f"KCl prohibido por Cl- alto en agua ({cl_meq:.1f} meq/L > 2.0).")
-        logger.info(f"[Explainability] KCl banned due to high Cl- ({cl_meq} meq/L)")
+    # Ca/Mg: Physiological minimums when deficit=0
+    for nutrient in ['Ca', 'Mg']:
+        if deficits.get(nutrient, 0) == 0:
+            overrides[nutrient] = 0
+            explained[nutrient] = "no_deficit"
     
-    # 4) S deficit small -> cap applied
+    # S: Lower minimum when deficit is small (cap will handle max)
     s_deficit = deficits.get('S', 0) or 0
-    if 0 < s_deficit < LOW_S_DEFICIT_THRESHOLD:
-        notes.append(f"S limitado por cap de seguridad (≤110% del déficit) para evitar sobre-fertilización.")
-        logger.info(f"[Explainability] S capped due to low deficit ({s_deficit} kg/ha)")
+    if s_deficit == 0:
+        overrides['S'] = 0
+        explained['S'] = "no_deficit"
+    elif s_deficit < LOW_S_DEFICIT_THRESHOLD:
+        overrides['S'] = 50
+        explained['S'] = "low_deficit_capped"
     
-    # 5) Acid N contribution note (if applicable)
-    acid_n = profile.get('acid_n_contribution_kg_ha', 0) or 0
-    if acid_n > 0:
-        notes.append(f"Ácido nítrico aporta ~{acid_n:.2f} kg/ha de N (descontado del déficit).")
-    elif profile.get('acid_recommended'):
-        notes.append("Ácido nítrico recomendado puede aportar N; no contabilizado aquí por falta de volumen total. (TODO: integrar volumen de riego).")
+    # P2O5: No requirement if deficit=0
+    if deficits.get('P2O5', 0) == 0:
+        overrides['P2O5'] = 0
+        explained['P2O5'] = "no_deficit"
     
-    return " ".join(notes)
+    return overrides, explained
+
+
+def _build_profile_targets(
+    profile_key: str,
+    overrides: Dict[str, float],
+    explained: Dict[str, str]
+) -> Dict[str, Any]:
+    """Overlay the shared adjustments on a fresh copy of the profile template."""
+    base_min_coverage = PROFILE_MIN_COVERAGE.get(profile_key, PROFILE_MIN_COVERAGE['balanced'])
+    min_coverage = dict(base_min_coverage)
+    min_coverage.update(overrides)
+    targets = {
+        'min_coverage': min_coverage,
+        'max_coverage_pct': 110,
+        'coverage_explained': dict(explained)
+    }
+    logger.info(f"[Profile Targets] {profile_key}: min_coverage={min_coverage}")
+    return targets
 
 
 def get_profile_targets(
@@ -1425,77 +1773,31 @@ def get_profile_targets(
             "coverage_explained": {"N": "no_required", "K2O": "soil_sufficient", ...}
         }
     """
-    water = {}
-    soil = {}
-    if agronomic_context:
-        water = agronomic_context.get('water', {}) or {}
-        soil = agronomic_context.get('soil', {}) or {}
+    overrides, explained = _profile_target_adjustments(growth_stage, agronomic_context, deficits)
+    return _build_profile_targets(profile_key, overrides, explained)
+
+
+def get_profile_targets_batch(
+    profile_keys: List[str],
+    crop_name: str,
+    growth_stage: str,
+    agronomic_context: Optional[Dict[str, Any]],
+    deficits: Dict[str, float]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Get coverage targets for several profiles sharing one context.
     
-    normalized_stage = normalize_stage(growth_stage)
-    stage_lower = (growth_stage or '').lower()
-    is_early_stage = normalized_stage == 'seedling' or 'plántula' in stage_lower or 'trasplante' in stage_lower
+    Equivalent to calling get_profile_targets() per profile, but the
+    soil/stage/deficit adjustments are resolved only once.
     
-    # Default targets
-    targets = {
-        'min_coverage': {
-            'N': 90, 'P2O5': 90, 'K2O': 90, 'Ca': 70, 'Mg': 70, 'S': 70
-        },
-        'max_coverage_pct': 110,
-        'coverage_explained': {}
+    Returns:
+        {profile_key: targets} with the same shape as get_profile_targets()
+    """
+    overrides, explained = _profile_target_adjustments(growth_stage, agronomic_context, deficits)
+    return {
+        profile_key: _build_profile_targets(profile_key, overrides, explained)
+        for profile_key in profile_keys
     }
-    
-    # Adjust by profile type
-    if profile_key == 'economic':
-        targets['min_coverage'] = {
-            'N': 85, 'P2O5': 85, 'K2O': 85, 'Ca': 50, 'Mg': 50, 'S': 50
-        }
-    elif profile_key == 'complete':
-        targets['min_coverage'] = {
-            'N': 95, 'P2O5': 95, 'K2O': 95, 'Ca': 80, 'Mg': 80, 'S': 80
-        }
-    
-    # === NUTRIENT-SPECIFIC ADJUSTMENTS ===
-    
-    # N: Reduce requirement if soil NO3-N is high + early stage
-    no3n_ppm = soil.get('no3n_ppm', 0) or soil.get('no3_n_ppm', 0) or 0
-    if no3n_ppm >= 40 and is_early_stage:
-        targets['min_coverage']['N'] = 0 if no3n_ppm >= 60 else 30
-        targets['coverage_explained']['N'] = f"soil_sufficient (NO3-N {no3n_ppm:.0f} ppm)"
-        logger.info(f"[Profile Targets] N min reduced to {targets['min_coverage']['N']}% due to high soil NO3-N")
-    
-    # K2O: No requirement if deficit=0 or soil K high
-    k2o_deficit = deficits.get('K2O', 0) or 0
-    k_ppm = soil.get('k_ppm', 0) or soil.get('potassium_ppm', 0) or 0
-    if k2o_deficit == 0:
-        targets['min_coverage']['K2O'] = 0
-        targets['coverage_explained']['K2O'] = "no_deficit"
-    elif k_ppm >= 400:
-        targets['min_coverage']['K2O'] = 0
-        targets['coverage_explained']['K2O'] = f"soil_sufficient ({k_ppm:.0f} ppm)"
-    
-    # Ca/Mg: Physiological minimums when deficit=0
-    for nutrient in ['Ca', 'Mg']:
-        if deficits.get(nutrient, 0) == 0:
-            targets['min_coverage'][nutrient] = 0
-            targets['coverage_explained'][nutrient] = "no_deficit"
-    
-    # S: Lower minimum when deficit is small (cap will handle max)
-    s_deficit = deficits.get('S', 0) or 0
-    if s_deficit == 0:
-        targets['min_coverage']['S'] = 0
-        targets['coverage_explained']['S'] = "no_deficit"
-    elif s_deficit < LOW_S_DEFICIT_THRESHOLD:
-        targets['min_coverage']['S'] = 50
-        targets['coverage_explained']['S'] = "low_deficit_capped"
-    
-    # P2O5: No requirement if deficit=0
-    if deficits.get('P2O5', 0) == 0:
-        targets['min_coverage']['P2O5'] = 0
-        targets['coverage_explained']['P2O5'] = "no_deficit"
-    
-    logger.info(f"[Profile Targets] {profile_key}: min_coverage={targets['min_coverage']}")
-    
-    return targets
 
 
 def build_coverage_explained(
@@ -1517,49 +1819,29 @@ def build_coverage_explained(
     explained = {}
     coverage = profile.get('coverage', {})
     
-    water = {}
-    soil = {}
-    if agronomic_context:
-        water = agronomic_context.get('water', {}) or {}
-        soil = agronomic_context.get('soil', {}) or {}
+    ctx = AgronomicContextView.from_context(agronomic_context)
     
-    normalized_stage = normalize_stage(growth_stage)
-    stage_lower = (growth_stage or '').lower()
-    is_early_stage = normalized_stage == 'seedling' or 'plántula' in stage_lower or 'trasplante' in stage_lower
+    # Nutrient-specific reasons, resolved once; they win over the coverage status
+    context_reasons = {}
+    no3n_ppm = ctx.no3n_ppm
+    if no3n_ppm >= 40 and is_early_growth_stage(growth_stage):
+        context_reasons['N'] = f"reducido (NO3-N suelo {no3n_ppm:.0f} ppm)"
+    k_ppm = ctx.k_ppm
+    if k_ppm >= 400:
+        context_reasons['K2O'] = f"evitado (K suelo {k_ppm:.0f} ppm)"
+    if (deficits.get('S', 0) or 0) < LOW_S_DEFICIT_THRESHOLD:
+        context_reasons['S'] = "limitado (cap seguridad)"
     
-    for nutrient in ['N', 'P2O5', 'K2O', 'Ca', 'Mg', 'S']:
+    for nutrient in SUPPLY_NUTRIENTS:
         deficit = deficits.get(nutrient, 0) or 0
-        cov = coverage.get(nutrient, 0) or 0
         
         if deficit == 0:
             explained[nutrient] = "no_required (déficit=0)"
-        elif nutrient == 'N':
-            no3n_ppm = soil.get('no3n_ppm', 0) or soil.get('no3_n_ppm', 0) or 0
-            if no3n_ppm >= 40 and is_early_stage:
-                explained[nutrient] = f"reducido (NO3-N suelo {no3n_ppm:.0f} ppm)"
-            elif cov >= 85:
-                explained[nutrient] = "cubierto"
-            else:
-                explained[nutrient] = f"parcial ({cov:.0f}%)"
-        elif nutrient == 'K2O':
-            k_ppm = soil.get('k_ppm', 0) or 0
-            if k_ppm >= 400:
-                explained[nutrient] = f"evitado (K suelo {k_ppm:.0f} ppm)"
-            elif cov >= 85:
-                explained[nutrient] = "cubierto"
-            else:
-                explained[nutrient] = f"parcial ({cov:.0f}%)"
-        elif nutrient == 'S':
-            if deficit < LOW_S_DEFICIT_THRESHOLD:
-                explained[nutrient] = "limitado (cap seguridad)"
-            elif cov >= 85:
-                explained[nutrient] = "cubierto"
-            else:
-                explained[nutrient] = f"parcial ({cov:.0f}%)"
-        elif cov >= 85:
-            explained[nutrient] = "cubierto"
+        elif nutrient in context_reasons:
+            explained[nutrient] = context_reasons[nutrient]
         else:
-            explained[nutrient] = f"parcial ({cov:.0f}%)"
+            cov = coverage.get(nutrient, 0) or 0
+            explained[nutrient] = "cubierto" if cov >= 85 else f"parcial ({cov:.0f}%)"
     
     return explained
 
@@ -1657,7 +1939,15 @@ def analyze_carrier_conflicts(
     return messages
 
 
-def is_fertilizer_in_set(fert_id: str, fert_name: str, fert_set: set) -> bool:
+@lru_cache(maxsize=64)
+def _fertilizer_set_pattern(fert_set: frozenset) -> Optional[re.Pattern]:
+    """One compiled alternation of a set's aliases (None for an empty set)."""
+    if not fert_set:
+        return None
+    return re.compile('|'.join(re.escape(key) for key in sorted(fert_set, key=len, reverse=True)))
+
+
+def is_fertilizer_in_set(fert_id: str, fert_name: str, fert_set: frozenset) -> bool:
     """Check if a fertilizer belongs to a set (by id or name)."""
     fert_id_lower = fert_id.lower().replace('-', '_') if fert_id else ''
     fert_name_lower = fert_name.lower() if fert_name else ''
@@ -1666,11 +1956,187 @@ def is_fertilizer_in_set(fert_id: str, fert_name: str, fert_set: set) -> bool:
     if fert_id_lower in fert_set:
         return True
     
-    # Check name contains
-    for key in fert_set:
-        if key in fert_id_lower or key in fert_name_lower:
-            return True
-    return False
+    # Check name contains: a single regex scan per string instead of a Python
+    # loop over every alias (plain sets are unhashable and keep the loop)
+    try:
+        pattern = _fertilizer_set_pattern(fert_set)
+    except TypeError:
+        return any(key in fert_id_lower or key in fert_name_lower for key in fert_set)
+    if pattern is None:
+        return False
+    return bool(pattern.search(fert_id_lower) or pattern.search(fert_name_lower))
+
+
+# Category bits returned by fertilizer_category_mask()
+K_CENTERED_BIT = 1 << 0
+MG_CENTERED_BIT = 1 << 1
+CA_CENTERED_BIT = 1 << 2
+CHLORIDE_BIT = 1 << 3
+SULFATE_BIT = 1 << 4
+
+_CATEGORY_SETS = (
+    (K_CENTERED_BIT, K_CENTERED_FERTILIZERS),
+    (MG_CENTERED_BIT, MG_CENTERED_FERTILIZERS),
+    (CA_CENTERED_BIT, CA_CENTERED_FERTILIZERS),
+    (CHLORIDE_BIT, CHLORIDE_FERTILIZERS),
+    (SULFATE_BIT, SULFATE_FERTILIZERS),
+)
+
+
+@lru_cache(maxsize=1024)
+def fertilizer_category_mask(fert_id: str, fert_name: str) -> int:
+    """
+    Bitmask of the constraint sets a fertilizer belongs to.
+    
+    Runs the is_fertilizer_in_set() substring checks once per (id, name)
+    pair; later membership tests are a single `mask & BIT`.
+    """
+    mask = 0
+    for bit, fert_set in _CATEGORY_SETS:
+        if is_fertilizer_in_set(fert_id, fert_name, fert_set):
+            mask |= bit
+    return mask
+
+
+# =============================================================================
+# NUTRIENT SUPPLY KERNEL - shared dose x composition reduction
+# =============================================================================
+
+# Column order of every supply vector produced below
+SUPPLY_NUTRIENTS = ('N', 'P2O5', 'K2O', 'Ca', 'Mg', 'S')
+SUPPLY_PCT_KEYS = ('n_pct', 'p2o5_pct', 'k2o_pct', 'ca_pct', 'mg_pct', 's_pct')
+SUPPLY_COLUMN = {nut: col for col, nut in enumerate(SUPPLY_NUTRIENTS)}
+
+# MAX_ALLOWED_WHEN_NO_DEFICIT flattened to SUPPLY_NUTRIENTS-ordered tuples (5 kg/ha if unset)
+STAGE_EXCESS_CAPS = {
+    stage: tuple(caps.get(nut, 5) for nut in SUPPLY_NUTRIENTS)
+    for stage, caps in MAX_ALLOWED_WHEN_NO_DEFICIT.items()
+}
+
+
+def _pct_row(fert_data: Dict) -> Tuple[float, ...]:
+    """Macro-nutrient percentages of a catalog entry in SUPPLY_NUTRIENTS order."""
+    return tuple(fert_data.get(key, 0) or 0 for key in SUPPLY_PCT_KEYS)
+
+
+def deficit_vector(deficits: Dict[str, float]) -> Tuple[float, ...]:
+    """Deficits in SUPPLY_NUTRIENTS order (missing nutrients as 0)."""
+    return tuple(deficits.get(nut, 0) for nut in SUPPLY_NUTRIENTS)
+
+
+def _compute_nutrient_supply(doses: List[float], pct_rows: List[Tuple[float, ...]]) -> List[float]:
+    """
+    Sum dose * pct / 100 per nutrient over all fertilizers in one pass.
+    
+    Args:
+        doses: dose_kg_ha per fertilizer
+        pct_rows: matching _pct_row() tuples
+    
+    Returns:
+        kg/ha supplied, in SUPPLY_NUTRIENTS order
+    """
+    n = p2o5 = k2o = ca = mg = s = 0.0
+    for dose, (n_pct, p2o5_pct, k2o_pct, ca_pct, mg_pct, s_pct) in zip(doses, pct_rows):
+        n += dose * (n_pct / 100)
+        p2o5 += dose * (p2o5_pct / 100)
+        k2o += dose * (k2o_pct / 100)
+        ca += dose * (ca_pct / 100)
+        mg += dose * (mg_pct / 100)
+        s += dose * (s_pct / 100)
+    return [n, p2o5, k2o, ca, mg, s]
+
+
+class FertilizerCatalog:
+    """
+    Column-oriented view of an available_fertilizers list.
+    
+    Built once per call so repeated lookups and nutrient sums avoid scanning
+    the list of dicts: ids/names resolve through dicts, percentages are
+    read from pre-extracted SUPPLY_NUTRIENTS-ordered rows and constraint
+    categories from category_bits.
+    """
+    
+    __slots__ = ('entries', 'ids', 'names', 'pct', 'category_bits', 's_free_n_sources', '_by_id', '_by_name')
+    
+    def __init__(self, entries: List[Dict]):
+        self.entries = entries
+        self.ids = tuple(f.get('id') for f in entries)
+        self.names = tuple(f.get('name') for f in entries)
+        self.pct = tuple(_pct_row(f) for f in entries)
+        # Constraint-set membership of each entry, tagged once per catalog
+        self.category_bits = tuple(
+            fertilizer_category_mask(f.get('id', ''), f.get('name', f.get('id', '')))
+            for f in entries
+        )
+        # Entries supplying N (> 5%) without S, in catalog order
+        n_col, s_col = SUPPLY_COLUMN['N'], SUPPLY_COLUMN['S']
+        self.s_free_n_sources = tuple(
+            f for f, row in zip(entries, self.pct)
+            if row[n_col] > 5 and row[s_col] == 0
+        )
+        self._by_id = {}
+        self._by_name = {}
+        for i, (fid, fname) in enumerate(zip(self.ids, self.names)):
+            self._by_id.setdefault(fid, i)
+            self._by_name.setdefault(fname, i)
+    
+    @classmethod
+    def from_list(cls, available_fertilizers: List[Dict]) -> 'FertilizerCatalog':
+        return cls(available_fertilizers)
+    
+    def index_of(self, fert_entry: Dict) -> Optional[int]:
+        """First catalog position whose id or name matches fert_entry."""
+        id_idx = self._by_id.get(fert_entry.get('id', ''))
+        name_idx = self._by_name.get(fert_entry.get('name', ''))
+        if id_idx is None:
+            return name_idx
+        if name_idx is None:
+            return id_idx
+        return min(id_idx, name_idx)
+    
+    def get(self, fert_entry: Dict) -> Optional[Dict]:
+        idx = self.index_of(fert_entry)
+        return self.entries[idx] if idx is not None else None
+    
+    def supply(self, fert_entries: List[Dict]) -> List[float]:
+        """kg/ha supplied per nutrient (SUPPLY_NUTRIENTS order) by fert_entries."""
+        doses = []
+        pct_rows = []
+        for fert in fert_entries:
+            idx = self.index_of(fert)
+            if idx is not None and self.entries[idx]:
+                doses.append(fert.get('dose_kg_ha', 0) or 0)
+                pct_rows.append(self.pct[idx])
+        return _compute_nutrient_supply(doses, pct_rows)
+    
+    def nutrient_total(self, fert_entries: List[Dict], nutrient: str) -> float:
+        """kg/ha of a single nutrient supplied by fert_entries."""
+        col = SUPPLY_COLUMN.get(nutrient, SUPPLY_COLUMN['S'])
+        total = 0.0
+        for fert in fert_entries:
+            idx = self.index_of(fert)
+            if idx is not None and self.entries[idx]:
+                dose = fert.get('dose_kg_ha', 0) or 0
+                total += dose * (self.pct[idx][col] / 100)
+        return total
+    
+    def nutrient_totals(self, fert_entries: List[Dict], nutrients: Tuple[str, ...]) -> Tuple[float, ...]:
+        """
+        kg/ha of each of `nutrients` supplied by fert_entries, in one pass.
+        
+        Same per-nutrient sums as nutrient_total, but each entry is resolved
+        against the catalog once instead of once per nutrient.
+        """
+        cols = [SUPPLY_COLUMN.get(nut, SUPPLY_COLUMN['S']) for nut in nutrients]
+        totals = [0.0] * len(cols)
+        for fert in fert_entries:
+            idx = self.index_of(fert)
+            if idx is not None and self.entries[idx]:
+                dose = fert.get('dose_kg_ha', 0) or 0
+                row = self.pct[idx]
+                for k, col in enumerate(cols):
+                    totals[k] += dose * (row[col] / 100)
+        return tuple(totals)
 
 
 def cap_fertilizers_by_nutrient(
@@ -1712,6 +2178,8 @@ def cap_fertilizers_by_nutrient(
         return profile
     
     original_deficit = deficits.get(nutrient, 0)
+    catalog = FertilizerCatalog.from_list(available_fertilizers)
+    get_fert_data = catalog.get
     
     # When deficit is 0 or negative, no nutrient is needed
     # Force all sulfate doses to 0 immediately
@@ -1722,15 +2190,11 @@ def cap_fertilizers_by_nutrient(
         for i, fert in enumerate(fertilizers):
             fert_id = fert.get('id', '')
             fert_name = fert.get('name', '')
-            if is_fertilizer_in_set(fert_id, fert_name, SULFATE_FERTILIZERS):
+            if fertilizer_category_mask(fert_id, fert_name) & SULFATE_BIT:
                 dose = fert.get('dose_kg_ha', 0) or 0
                 if dose > 0:
                     # Get N content to track what we're losing
-                    fert_data = None
-                    for f in available_fertilizers:
-                        if f.get('id') == fert_id or f.get('name') == fert_name:
-                            fert_data = f
-                            break
+                    fert_data = get_fert_data(fert)
                     if fert_data:
                         n_pct = fert_data.get('n_pct', 0) or 0
                         n_lost = dose * n_pct / 100
@@ -1751,42 +2215,34 @@ def cap_fertilizers_by_nutrient(
             # Calculate current N after removal
             current_n = 0
             for fert in fertilizers:
-                fert_data = None
-                for f in available_fertilizers:
-                    if f.get('id') == fert.get('id') or f.get('name') == fert.get('name'):
-                        fert_data = f
-                        break
+                fert_data = get_fert_data(fert)
                 if fert_data:
                     n_pct = fert_data.get('n_pct', 0) or 0
                     current_n += fert.get('dose_kg_ha', 0) * n_pct / 100
             
             if current_n < min_n_needed:
-                # Try to add S-free N sources
+                # Add the first S-free N source of the catalog
                 n_shortfall = min_n_needed - current_n
-                added_n = False
-                for f in available_fertilizers:
+                s_free_n = catalog.s_free_n_sources
+                if s_free_n:
+                    f = s_free_n[0]
                     n_pct = f.get('n_pct', 0) or 0
-                    s_pct = f.get('s_pct', 0) or 0
-                    if n_pct > 5 and s_pct == 0:
-                        dose_needed = n_shortfall / (n_pct / 100)
-                        new_fert = {
-                            'id': f.get('id'),
-                            'name': f.get('name'),
-                            'dose_kg_ha': round(dose_needed, 2),
-                            'dose_per_application': round(dose_needed / num_applications, 3),
-                            'added_by_s_cap': True
-                        }
-                        fertilizers.append(new_fert)
-                        profile['fertilizers'] = fertilizers
-                        added_n = True
-                        logger.info(f"[Cap {nutrient}] Added {f.get('name')} {dose_needed:.2f} kg/ha to replace N from removed sulfates")
-                        break
-                
-                if not added_n:
+                    dose_needed = n_shortfall / (n_pct / 100)
+                    new_fert = {
+                        'id': f.get('id'),
+                        'name': f.get('name'),
+                        'dose_kg_ha': round(dose_needed, 2),
+                        'dose_per_application': round(dose_needed / num_applications, 3),
+                        'added_by_s_cap': True
+                    }
+                    fertilizers.append(new_fert)
+                    profile['fertilizers'] = fertilizers
+                    logger.info(f"[Cap {nutrient}] Added {f.get('name')} {dose_needed:.2f} kg/ha to replace N from removed sulfates")
+                else:
                     error_msg = f"S deficit is 0 but sulfates were providing N. No S-free N alternatives available."
                     profile['cap_error'] = error_msg
                     logger.error(f"[Cap {nutrient}] HARD ERROR: {error_msg}")
-                    raise SulfurCapError(error_msg)
+                    raise SulfurCapError(error_msg, threshold_pct=max_coverage_pct)
         
         if sulfates_removed:
             profile['cap_applied'] = {
@@ -1803,60 +2259,22 @@ def cap_fertilizers_by_nutrient(
     n_deficit = deficits.get('N', 0)
     min_n_needed = n_deficit * (min_coverage_for_critical / 100) if n_deficit > 0 else 0
     
-    # Map nutrient name to percentage key
-    nutrient_to_pct_key = {
-        'N': 'n_pct', 'P2O5': 'p2o5_pct', 'K2O': 'k2o_pct',
-        'Ca': 'ca_pct', 'Mg': 'mg_pct', 'S': 's_pct'
-    }
-    pct_key = nutrient_to_pct_key.get(nutrient, 's_pct')
-    
-    def get_fert_data(fert_entry):
-        fert_id = fert_entry.get('id', '')
-        fert_name = fert_entry.get('name', '')
-        for f in available_fertilizers:
-            if f.get('id') == fert_id or f.get('name') == fert_name:
-                return f
-        return None
-    
     def calculate_total_nutrient():
         """Calculate total kg/ha of the nutrient provided."""
-        total = 0.0
-        for fert in fertilizers:
-            fert_data = get_fert_data(fert)
-            if fert_data:
-                dose = fert.get('dose_kg_ha', 0) or 0
-                nutrient_pct = fert_data.get(pct_key, 0) or 0
-                total += dose * (nutrient_pct / 100)
-        return total
+        return catalog.nutrient_total(fertilizers, nutrient)
     
     def calculate_total_n():
         """Calculate total N provided by all fertilizers."""
-        total = 0.0
-        for fert in fertilizers:
-            fert_data = get_fert_data(fert)
-            if fert_data:
-                dose = fert.get('dose_kg_ha', 0) or 0
-                n_pct = fert_data.get('n_pct', 0) or 0
-                total += dose * (n_pct / 100)
-        return total
+        return catalog.nutrient_total(fertilizers, 'N')
     
     def find_s_free_n_sources():
         """Find N sources that don't contain S (urea, calcium nitrate, etc.)."""
-        s_free = []
-        for f in available_fertilizers:
-            n_pct = f.get('n_pct', 0) or 0
-            s_pct = f.get('s_pct', 0) or 0
-            fert_id = f.get('id', '')
-            fert_name = f.get('name', '')
-            # N source without S
-            if n_pct > 5 and s_pct == 0:
-                already_in_profile = any(
-                    pf.get('id') == fert_id or pf.get('name') == fert_name 
-                    for pf in fertilizers
-                )
-                if not already_in_profile:
-                    s_free.append(f)
-        return s_free
+        profile_ids = {pf.get('id') for pf in fertilizers}
+        profile_names = {pf.get('name') for pf in fertilizers}
+        return [
+            f for f in catalog.s_free_n_sources
+            if f.get('id', '') not in profile_ids and f.get('name', '') not in profile_names
+        ]
     
     def find_existing_s_free_n_sources():
         """Find S-free N sources already in the profile that can be increased."""
@@ -1905,7 +2323,7 @@ def cap_fertilizers_by_nutrient(
         if fert_data:
             fert_id = fert.get('id', '')
             fert_name = fert.get('name', '')
-            if is_fertilizer_in_set(fert_id, fert_name, SULFATE_FERTILIZERS):
+            if fertilizer_category_mask(fert_id, fert_name) & SULFATE_BIT:
                 dose = fert.get('dose_kg_ha', 0) or 0
                 n_pct = fert_data.get('n_pct', 0) or 0
                 s_pct = fert_data.get('s_pct', 0) or 0
@@ -1938,7 +2356,9 @@ def cap_fertilizers_by_nutrient(
     current_n = calculate_total_n()
     projected_n_after_cap = current_n - n_from_sulfates
     
-    if projected_n_after_cap < min_n_needed and n_deficit > 0:
+    # Without any S-free N source in the catalog there is nothing to increase
+    # or add, so the search below is skipped outright
+    if projected_n_after_cap < min_n_needed and n_deficit > 0 and catalog.s_free_n_sources:
         n_shortfall = min_n_needed - projected_n_after_cap
         logger.info(f"[Cap {nutrient}] PRE-CAP: Will need {n_shortfall:.2f} kg N from S-free sources")
         
@@ -2001,8 +2421,7 @@ def cap_fertilizers_by_nutrient(
     
     while iteration < MAX_ITERATIONS:
         iteration += 1
-        current_s_total = calculate_total_nutrient()
-        current_n_total = calculate_total_n()
+        current_s_total, current_n_total = catalog.nutrient_totals(fertilizers, (nutrient, 'N'))
         
         # Check if S is already within limits
         if current_s_total <= max_allowed_kg:
@@ -2027,7 +2446,7 @@ def cap_fertilizers_by_nutrient(
             
             fert_id = fert.get('id', '')
             fert_name = fert.get('name', '')
-            if not is_fertilizer_in_set(fert_id, fert_name, SULFATE_FERTILIZERS):
+            if not fertilizer_category_mask(fert_id, fert_name) & SULFATE_BIT:
                 continue
             
             dose = fert.get('dose_kg_ha', 0) or 0
@@ -2089,9 +2508,8 @@ def cap_fertilizers_by_nutrient(
     # =========================================================================
     # FINAL VALIDATION: Hard error if S STILL over max_coverage_pct
     # =========================================================================
-    final_s_total = calculate_total_nutrient()
+    final_s_total, final_n_total = catalog.nutrient_totals(fertilizers, (nutrient, 'N'))
     final_s_coverage = (final_s_total / nutrient_deficit * 100) if nutrient_deficit > 0 else 0
-    final_n_total = calculate_total_n()
     final_n_coverage = (final_n_total / n_deficit * 100) if n_deficit > 0 else 100
     
     logger.info(f"[Cap {nutrient}] Final: S={final_s_total:.2f} kg ({final_s_coverage:.0f}%), N={final_n_total:.2f} kg ({final_n_coverage:.0f}%)")
@@ -2121,7 +2539,7 @@ def cap_fertilizers_by_nutrient(
         profile['cap_error'] = error_msg
         logger.error(f"[Cap {nutrient}] HARD ERROR: {error_msg}")
         # Raise exception to halt processing - caller must handle this
-        raise SulfurCapError(error_msg)
+        raise SulfurCapError(error_msg, coverage_pct=final_s_coverage, threshold_pct=max_coverage_pct)
     
     # Warn if N is low
     if final_n_coverage < min_coverage_for_critical:
@@ -2185,16 +2603,12 @@ def build_deficit_aware_fertilizer_list(
     lines = []
     
     # Extract constraints from agronomic context
-    water_cl = 0
-    soil_k_high = False
-    if agronomic_context:
-        water = agronomic_context.get('water', {})
-        soil = agronomic_context.get('soil', {})
-        water_cl = water.get('cl_meqL', 0) or 0
-        soil_k_ppm = soil.get('k_ppm', 0) or 0
-        soil_k_high = soil_k_ppm > 400 or soil.get('k_exchange_high', False)
+    ctx = AgronomicContextView.from_context(agronomic_context)
+    water_cl = ctx.cl_meq_l
+    soil_k_high = ctx.k_ppm > 400 or ctx.k_exchange_high
     
-    for f in fertilizers:
+    catalog = FertilizerCatalog.from_list(fertilizers)
+    for f, category in zip(fertilizers, catalog.category_bits):
         name = f.get('name', f.get('id', 'Unknown'))
         fert_id = f.get('id', '')
         n = f.get('n_pct', 0) or 0
@@ -2220,19 +2634,19 @@ def build_deficit_aware_fertilizer_list(
         restrictions = []
         
         # K-centered fertilizers when K2O deficit = 0
-        if deficits.get('K2O', 0) <= 0 and is_fertilizer_in_set(fert_id, name, K_CENTERED_FERTILIZERS):
+        if deficits.get('K2O', 0) <= 0 and category & K_CENTERED_BIT:
             restrictions.append("⛔ NO USAR: Déficit K2O=0")
         
         # Mg-centered fertilizers when Mg deficit = 0
-        if deficits.get('Mg', 0) <= 0 and is_fertilizer_in_set(fert_id, name, MG_CENTERED_FERTILIZERS):
+        if deficits.get('Mg', 0) <= 0 and category & MG_CENTERED_BIT:
             restrictions.append("⛔ NO USAR: Déficit Mg=0")
         
         # Ca-centered fertilizers when Ca deficit = 0
-        if deficits.get('Ca', 0) <= 0 and is_fertilizer_in_set(fert_id, name, CA_CENTERED_FERTILIZERS):
+        if deficits.get('Ca', 0) <= 0 and category & CA_CENTERED_BIT:
             restrictions.append("⛔ NO USAR: Déficit Ca=0")
         
         # Chloride fertilizers when water Cl- > 2 meq/L
-        if water_cl > 2.0 and is_fertilizer_in_set(fert_id, name, CHLORIDE_FERTILIZERS):
+        if water_cl > 2.0 and category & CHLORIDE_BIT:
             restrictions.append(f"⛔ PROHIBIDO: Cl⁻ en agua={water_cl:.1f} meq/L > 2")
         
         # K fertilizers when soil K is high (early stages)
@@ -2245,6 +2659,15 @@ def build_deficit_aware_fertilizer_list(
     return "\n".join(lines)
 
 
+# constraints_applied reason per hard-constraint bit (formatted with water_cl)
+HARD_CONSTRAINT_REASONS = {
+    K_CENTERED_BIT: "K-centered fertilizer PROHIBITED: K2O deficit=0",
+    MG_CENTERED_BIT: "Mg-centered fertilizer PROHIBITED: Mg deficit=0",
+    CA_CENTERED_BIT: "Ca-centered fertilizer PROHIBITED: Ca deficit=0",
+    CHLORIDE_BIT: "Cl⁻ in water ({water_cl:.1f} meq/L) > 2 meq/L",
+}
+
+
 def enforce_hard_constraints(
     profile: Dict,
     deficits: Dict[str, float],
@@ -2273,72 +2696,68 @@ def enforce_hard_constraints(
         return profile
     
     # Extract constraints
-    water_cl = 0
-    soil_k_high = False
-    if agronomic_context:
-        water = agronomic_context.get('water', {})
-        soil = agronomic_context.get('soil', {})
-        water_cl = water.get('cl_meqL', 0) or 0
-        soil_k_ppm = soil.get('k_ppm', 0) or 0
-        soil_k_high = soil_k_ppm > 400 or soil.get('k_exchange_high', False)
+    ctx = AgronomicContextView.from_context(agronomic_context)
+    water_cl = ctx.cl_meq_l
+    soil_k_high = ctx.k_ppm > 400 or ctx.k_exchange_high
     
     stage_key = normalize_stage(growth_stage)
     is_early_stage = stage_key in ['seedling', 'vegetative']
     
+    # Rules 1-4 as one mask of the categories that are prohibited for this call
+    active_bans = 0
+    # Rule 1: K-centered when K2O deficit = 0 -> ALWAYS REMOVE
+    # Even if KNO3 provides N, we must use alternative N sources to avoid K over-supply
+    if deficits.get('K2O', 0) <= 0:
+        active_bans |= K_CENTERED_BIT
+    # Rule 2: Mg-centered when Mg deficit = 0 -> ALWAYS REMOVE
+    # Use alternative sources for other nutrients (e.g., S from ammonium sulfate)
+    if deficits.get('Mg', 0) <= 0:
+        active_bans |= MG_CENTERED_BIT
+    # Rule 3: Ca-centered when Ca deficit = 0 -> ALWAYS REMOVE
+    # Use alternative N sources (e.g., urea, ammonium sulfate) instead of calcium nitrate
+    if deficits.get('Ca', 0) <= 0:
+        active_bans |= CA_CENTERED_BIT
+    # Rule 4: Chloride fertilizers when water Cl- > 2 meq/L (HARD PROHIBITION)
+    if water_cl > 2.0:
+        active_bans |= CHLORIDE_BIT
+    
+    reduce_high_k = soil_k_high and is_early_stage
+    if reduce_high_k:
+        catalog = FertilizerCatalog.from_list(available_fertilizers)
+    
     removed_fertilizers = []
     kept_fertilizers = []
     
     for fert in fertilizers:
         fert_id = fert.get('id', '')
         fert_name = fert.get('name', '')
-        should_remove = False
-        removal_reason = None
-        
-        # Rule 1: K-centered when K2O deficit = 0 -> ALWAYS REMOVE
-        # Even if KNO3 provides N, we must use alternative N sources to avoid K over-supply
-        if deficits.get('K2O', 0) <= 0 and is_fertilizer_in_set(fert_id, fert_name, K_CENTERED_FERTILIZERS):
-            should_remove = True
-            removal_reason = "K-centered fertilizer PROHIBITED: K2O deficit=0"
-        
-        # Rule 2: Mg-centered when Mg deficit = 0 -> ALWAYS REMOVE
-        # Use alternative sources for other nutrients (e.g., S from ammonium sulfate)
-        if deficits.get('Mg', 0) <= 0 and is_fertilizer_in_set(fert_id, fert_name, MG_CENTERED_FERTILIZERS):
-            should_remove = True
-            removal_reason = "Mg-centered fertilizer PROHIBITED: Mg deficit=0"
-        
-        # Rule 3: Ca-centered when Ca deficit = 0 -> ALWAYS REMOVE
-        # Use alternative N sources (e.g., urea, ammonium sulfate) instead of calcium nitrate
-        if deficits.get('Ca', 0) <= 0 and is_fertilizer_in_set(fert_id, fert_name, CA_CENTERED_FERTILIZERS):
-            should_remove = True
-            removal_reason = "Ca-centered fertilizer PROHIBITED: Ca deficit=0"
-        
-        # Rule 4: Chloride fertilizers when water Cl- > 2 meq/L (HARD PROHIBITION)
-        if water_cl > 2.0 and is_fertilizer_in_set(fert_id, fert_name, CHLORIDE_FERTILIZERS):
-            should_remove = True
-            removal_reason = f"Cl⁻ in water ({water_cl:.1f} meq/L) > 2 meq/L"
+        banned = fertilizer_category_mask(fert_id, fert_name) & active_bans if active_bans else 0
         
         # Rule 5: K fertilizers in early stages when soil K is high
-        if soil_k_high and is_early_stage:
-            fert_data = next((f for f in available_fertilizers if f.get('id') == fert_id or f.get('name') == fert_name), None)
+        if reduce_high_k:
+            fert_data = catalog.get(fert)
             if fert_data and (fert_data.get('k2o_pct', 0) or 0) > 30:
                 # High K fertilizer in early stage with high soil K - reduce dose significantly
                 fert['dose_kg_ha'] = fert.get('dose_kg_ha', 0) * 0.3
                 fert['dose_per_application'] = fert.get('dose_per_application', 0) * 0.3
                 fert['constraint_applied'] = "Reduced 70% due to high soil K"
         
-        if should_remove:
-            removed_fertilizers.append({'fert': fert, 'reason': removal_reason})
-            logger.info(f"[HardConstraints] Removed {fert_name} ({fert_id}): {removal_reason}")
+        if banned:
+            removed_fertilizers.append((fert, banned))
         else:
             kept_fertilizers.append(fert)
     
     profile['fertilizers'] = kept_fertilizers
     
     if removed_fertilizers:
-        profile['constraints_applied'] = [
-            f"{r['fert'].get('name', r['fert'].get('id'))}: {r['reason']}" 
-            for r in removed_fertilizers
-        ]
+        # Reason strings are only built for fertilizers actually removed; a
+        # fertilizer matching several rules reports the last one (highest bit)
+        constraints_applied = []
+        for fert, banned in removed_fertilizers:
+            removal_reason = HARD_CONSTRAINT_REASONS[1 << (banned.bit_length() - 1)].format(water_cl=water_cl)
+            logger.info(f"[HardConstraints] Removed {fert.get('name', '')} ({fert.get('id', '')}): {removal_reason}")
+            constraints_applied.append(f"{fert.get('name', fert.get('id'))}: {removal_reason}")
+        profile['constraints_applied'] = constraints_applied
         logger.info(f"[HardConstraints] Applied constraints: {profile['constraints_applied']}")
     
     return profile
@@ -2399,69 +2818,55 @@ def normalize_coverage(
             return profile  # Halt processing - do not continue with failed profile
     
     stage_key = normalize_stage(growth_stage)
-    max_allowed = MAX_ALLOWED_WHEN_NO_DEFICIT.get(stage_key, MAX_ALLOWED_WHEN_NO_DEFICIT['default'])
+    excess_caps = STAGE_EXCESS_CAPS.get(stage_key, STAGE_EXCESS_CAPS['default'])
     
-    nutrient_keys = {
-        'N': 'n_pct', 'P2O5': 'p2o5_pct', 'K2O': 'k2o_pct',
-        'Ca': 'ca_pct', 'Mg': 'mg_pct', 'S': 's_pct'
-    }
+    catalog = FertilizerCatalog.from_list(available_fertilizers)
+    supply_for = catalog.supply
     
-    def get_fert_data(fert_entry):
-        fert_id = fert_entry.get('id', '')
-        fert_name = fert_entry.get('name', '')
-        for f in available_fertilizers:
-            if f.get('id') == fert_id or f.get('name') == fert_name:
-                return f
-        return None
+    # Deficits read once; the helpers below index this instead of the dict
+    deficit_vec = deficit_vector(deficits)
+    positive_deficit = {nut for nut, deficit in zip(SUPPLY_NUTRIENTS, deficit_vec) if deficit > 0}
     
-    def calculate_provided_kg() -> Dict[str, float]:
-        """Calculate total kg/ha provided for each nutrient."""
-        provided = {nut: 0.0 for nut in nutrient_keys}
-        for fert in fertilizers:
-            fert_data = get_fert_data(fert)
-            if fert_data:
-                dose = fert.get('dose_kg_ha', 0) or 0
-                for nut, pct_key in nutrient_keys.items():
-                    nutrient_pct = fert_data.get(pct_key, 0) or 0
-                    provided[nut] += dose * (nutrient_pct / 100)
-        return provided
+    # Profile membership is fixed until the final zero-dose filter: resolve catalog
+    # rows once and read doses into a flat float array whenever supply is needed
+    fert_rows = [catalog.index_of(fert) for fert in fertilizers]
+    supplied_idx = [i for i, row in enumerate(fert_rows) if row is not None and catalog.entries[row]]
+    supplied_pct = [catalog.pct[fert_rows[i]] for i in supplied_idx]
+    supplied_pos = {i: pos for pos, i in enumerate(supplied_idx)}
     
-    def calculate_coverage() -> Dict[str, float]:
+    def dose_vector() -> array:
+        """Current doses of the catalog-matched profile entries."""
+        return array('d', [fertilizers[i].get('dose_kg_ha', 0) or 0 for i in supplied_idx])
+    
+    def current_supply() -> List[float]:
+        return _compute_nutrient_supply(dose_vector(), supplied_pct)
+    
+    def calculate_coverage(supply: List[float]) -> Dict[str, float]:
         """Calculate coverage percentage for nutrients with deficit > 0."""
         coverage = {}
-        provided = calculate_provided_kg()
-        for nut in nutrient_keys:
-            deficit = deficits.get(nut, 0)
+        for nut, deficit, threshold, provided in zip(SUPPLY_NUTRIENTS, deficit_vec, excess_caps, supply):
             if deficit <= 0:
                 # For deficit=0, coverage is based on max_allowed threshold
-                threshold = max_allowed.get(nut, 5)
                 if threshold > 0:
-                    coverage[nut] = round((provided[nut] / threshold) * 100, 1)
+                    coverage[nut] = round((provided / threshold) * 100, 1)
                 else:
-                    coverage[nut] = 100 if provided[nut] == 0 else 999
+                    coverage[nut] = 100 if provided == 0 else 999
             else:
-                coverage[nut] = round((provided[nut] / deficit) * 100, 1)
+                coverage[nut] = round((provided / deficit) * 100, 1)
         return coverage
     
     def would_drop_below_minimum(fert_idx, reduction_factor):
         """Check if reducing a fertilizer would drop any nutrient below min_coverage."""
-        test_fertilizers = [f.copy() for f in fertilizers]
-        current_dose = test_fertilizers[fert_idx].get('dose_kg_ha', 0)
-        test_fertilizers[fert_idx]['dose_kg_ha'] = current_dose * reduction_factor
+        doses = dose_vector()
+        pos = supplied_pos.get(fert_idx)
+        if pos is not None:
+            doses[pos] *= reduction_factor
         
-        for nut, pct_key in nutrient_keys.items():
-            deficit = deficits.get(nut, 0)
+        supply = _compute_nutrient_supply(doses, supplied_pct)
+        for nut, deficit, total_provided in zip(SUPPLY_NUTRIENTS, deficit_vec, supply):
             if deficit <= 0:
                 continue
             
-            total_provided = 0
-            for fert in test_fertilizers:
-                fert_data = get_fert_data(fert)
-                if fert_data:
-                    nutrient_pct = fert_data.get(pct_key, 0) or 0
-                    dose = fert.get('dose_kg_ha', 0) or 0
-                    total_provided += dose * (nutrient_pct / 100)
-            
             new_coverage = (total_provided / deficit) * 100 if deficit > 0 else 100
             if new_coverage < min_coverage:
                 return True, nut
@@ -2469,11 +2874,11 @@ def normalize_coverage(
     
     # Phase 1: Handle nutrients with deficit > 0 exceeding max_coverage_pct
     for iteration in range(10):
-        coverage = calculate_coverage()
+        coverage = calculate_coverage(current_supply())
         
         over_nutrients = {
             nut: cov for nut, cov in coverage.items() 
-            if cov > max_coverage_pct and deficits.get(nut, 0) > 0
+            if cov > max_coverage_pct and nut in positive_deficit
         }
         
         if not over_nutrients:
@@ -2481,17 +2886,15 @@ def normalize_coverage(
         
         worst_nutrient = max(over_nutrients.items(), key=lambda x: x[1])
         nut_name, nut_coverage = worst_nutrient
-        pct_key = nutrient_keys[nut_name]
+        col = SUPPLY_COLUMN[nut_name]
         
         contributors = []
-        for i, fert in enumerate(fertilizers):
-            fert_data = get_fert_data(fert)
-            if fert_data:
-                nutrient_pct = fert_data.get(pct_key, 0) or 0
-                dose = fert.get('dose_kg_ha', 0) or 0
-                contribution = dose * (nutrient_pct / 100)
-                if contribution > 0:
-                    contributors.append((i, contribution, nutrient_pct))
+        for i, pct_row in zip(supplied_idx, supplied_pct):
+            nutrient_pct = pct_row[col]
+            dose = fertilizers[i].get('dose_kg_ha', 0) or 0
+            contribution = dose * (nutrient_pct / 100)
+            if contribution > 0:
+                contributors.append((i, contribution, nutrient_pct))
         
         if not contributors:
             break
@@ -2531,89 +2934,85 @@ def normalize_coverage(
     
     # Phase 2: Handle nutrients with deficit = 0 exceeding max_allowed thresholds
     excess_when_no_deficit = []
-    provided_kg = calculate_provided_kg()
+    supply = current_supply()
     
-    for nut in nutrient_keys:
-        deficit = deficits.get(nut, 0)
-        if deficit > 0:
-            continue  # Already handled in Phase 1
+    # One pass over the supply vector picks every over-threshold nutrient
+    excess_cols = [
+        col for col, (deficit, provided, cap) in enumerate(zip(deficit_vec, supply, excess_caps))
+        if deficit <= 0 and provided > cap
+    ]
+    if excess_cols:
+        needed_cols = [col for col, deficit in enumerate(deficit_vec) if deficit > 0]
+    
+    for col in excess_cols:
+        nut = SUPPLY_NUTRIENTS[col]
+        threshold = excess_caps[col]
+        excess = supply[col] - threshold
+        
+        # Try to reduce fertilizers contributing to this nutrient
+        contributors = []
+        for i, (fert, row) in enumerate(zip(fertilizers, fert_rows)):
+            if row is not None:
+                nutrient_pct = catalog.pct[row][col]
+                dose = fert.get('dose_kg_ha', 0) or 0
+                contribution = dose * (nutrient_pct / 100)
+                if contribution > 0:
+                    contributors.append((i, contribution, nutrient_pct, catalog.pct[row]))
         
-        threshold = max_allowed.get(nut, 5)
-        provided = provided_kg.get(nut, 0)
+        contributors.sort(key=lambda x: x[1], reverse=True)
         
-        if provided > threshold:
-            # Try to reduce fertilizers contributing to this nutrient
-            pct_key = nutrient_keys[nut]
-            excess = provided - threshold
+        reduced_excess = 0
+        for fert_idx, contribution, nutrient_pct, pct_row in contributors:
+            if reduced_excess >= excess:
+                break
             
-            contributors = []
-            for i, fert in enumerate(fertilizers):
-                fert_data = get_fert_data(fert)
-                if fert_data:
-                    nutrient_pct = fert_data.get(pct_key, 0) or 0
-                    dose = fert.get('dose_kg_ha', 0) or 0
-                    contribution = dose * (nutrient_pct / 100)
-                    if contribution > 0:
-                        contributors.append((i, contribution, nutrient_pct, fert_data))
+            current_dose = fertilizers[fert_idx].get('dose_kg_ha', 0)
             
-            contributors.sort(key=lambda x: x[1], reverse=True)
+            # Check if this fertilizer provides other nutrients we need
+            provides_needed_deficit = any(pct_row[other] > 3 for other in needed_cols)
             
-            reduced_excess = 0
-            for fert_idx, contribution, nutrient_pct, fert_data in contributors:
-                if reduced_excess >= excess:
-                    break
-                
-                current_dose = fertilizers[fert_idx].get('dose_kg_ha', 0)
-                
-                # Check if this fertilizer provides other nutrients we need
-                provides_needed_deficit = False
-                for other_nut, other_pct_key in nutrient_keys.items():
-                    if deficits.get(other_nut, 0) > 0 and (fert_data.get(other_pct_key, 0) or 0) > 3:
-                        provides_needed_deficit = True
-                        break
-                
-                if provides_needed_deficit:
-                    # Can't remove, but try gentle reduction
-                    max_reduction = 0.2  # Max 20% reduction
-                    reduction_needed = min(max_reduction, excess / contribution if contribution > 0 else 0)
-                    new_dose = current_dose * (1 - reduction_needed)
-                    reduced_excess += contribution * reduction_needed
-                else:
-                    # Can fully reduce/remove
-                    reduction_needed = min(1.0, excess / contribution if contribution > 0 else 1.0)
-                    new_dose = current_dose * (1 - reduction_needed)
-                    reduced_excess += contribution * reduction_needed
-                
-                fertilizers[fert_idx]['dose_kg_ha'] = round(new_dose, 2)
-                if 'dose_per_application' in fertilizers[fert_idx]:
-                    fertilizers[fert_idx]['dose_per_application'] = round(new_dose / num_applications, 3)
-                if 'subtotal' in fertilizers[fert_idx]:
-                    price = fertilizers[fert_idx].get('price_per_kg', 0)
-                    fertilizers[fert_idx]['subtotal'] = round(new_dose * price, 2)
-                
-                logger.info(f"[Normalize] Reduced {fertilizers[fert_idx].get('name')} for {nut} (deficit=0): {current_dose:.1f} -> {new_dose:.1f} kg/ha")
+            if provides_needed_deficit:
+                # Can't remove, but try gentle reduction
+                max_reduction = 0.2  # Max 20% reduction
+                reduction_needed = min(max_reduction, excess / contribution if contribution > 0 else 0)
+                new_dose = current_dose * (1 - reduction_needed)
+                reduced_excess += contribution * reduction_needed
+            else:
+                # Can fully reduce/remove
+                reduction_needed = min(1.0, excess / contribution if contribution > 0 else 1.0)
+                new_dose = current_dose * (1 - reduction_needed)
+                reduced_excess += contribution * reduction_needed
             
-            # Check if still exceeding after reductions
-            new_provided = sum(
-                (fert.get('dose_kg_ha', 0) * (get_fert_data(fert).get(pct_key, 0) if get_fert_data(fert) else 0) / 100)
-                for fert in fertilizers
-            )
-            if new_provided > threshold:
-                excess_when_no_deficit.append({
-                    'nutrient': nut,
-                    'provided_kg_ha': round(new_provided, 2),
-                    'max_allowed_kg_ha': threshold,
-                    'excess_kg_ha': round(new_provided - threshold, 2)
-                })
+            fertilizers[fert_idx]['dose_kg_ha'] = round(new_dose, 2)
+            if 'dose_per_application' in fertilizers[fert_idx]:
+                fertilizers[fert_idx]['dose_per_application'] = round(new_dose / num_applications, 3)
+            if 'subtotal' in fertilizers[fert_idx]:
+                price = fertilizers[fert_idx].get('price_per_kg', 0)
+                fertilizers[fert_idx]['subtotal'] = round(new_dose * price, 2)
+            
+            logger.info(f"[Normalize] Reduced {fertilizers[fert_idx].get('name')} for {nut} (deficit=0): {current_dose:.1f} -> {new_dose:.1f} kg/ha")
+        
+        # Check if still exceeding after reductions
+        new_provided = sum(
+            fert.get('dose_kg_ha', 0) * (catalog.pct[row][col] if row is not None else 0) / 100
+            for fert, row in zip(fertilizers, fert_rows)
+        )
+        if new_provided > threshold:
+            excess_when_no_deficit.append({
+                'nutrient': nut,
+                'provided_kg_ha': round(new_provided, 2),
+                'max_allowed_kg_ha': threshold,
+                'excess_kg_ha': round(new_provided - threshold, 2)
+            })
     
     # Remove zero-dose fertilizers
     fertilizers = [f for f in fertilizers if (f.get('dose_kg_ha', 0) or 0) > 0.1]
     
     # Recalculate final coverage
     profile['fertilizers'] = fertilizers
-    final_coverage = calculate_coverage()
+    final_coverage = calculate_coverage(supply_for(fertilizers))
     profile['coverage'] = {
-        nut: min(100, cov) if deficits.get(nut, 0) <= 0 else cov 
+        nut: min(100, cov) if nut not in positive_deficit else cov 
         for nut, cov in final_coverage.items()
     }
     profile['coverage_normalized'] = True
@@ -2621,7 +3020,7 @@ def normalize_coverage(
     # Track nutrients still exceeding max_coverage despite normalization
     exceeding_nutrients = []
     for nut, cov in final_coverage.items():
-        if cov > max_coverage_pct and deficits.get(nut, 0) > 0:
+        if cov > max_coverage_pct and nut in positive_deficit:
             exceeding_nutrients.append(f"{nut}:{round(cov)}%")
     
     if exceeding_nutrients:
@@ -2712,13 +3111,14 @@ def adjust_deficits_for_acid_nitrogen(
     Returns:
         tuple: (adjusted_deficits, acid_n_kg_ha)
     """
-    adjusted = deficits.copy()
     n_from_acid_kg = calculate_acid_n_contribution(acid_data)
+    if n_from_acid_kg <= 0:
+        return dict(deficits), n_from_acid_kg
     
-    if n_from_acid_kg > 0:
-        original_n = adjusted.get('N', 0)
-        adjusted['N'] = max(0, original_n - n_from_acid_kg)
-        logger.info(f"[AcidN] HNO3 contributes {n_from_acid_kg:.2f} kg N/ha. Deficit N: {original_n:.1f} -> {adjusted['N']:.1f} kg/ha")
+    adjusted = deficits.copy()
+    original_n = adjusted.get('N', 0)
+    adjusted['N'] = max(0, original_n - n_from_acid_kg)
+    logger.info(f"[AcidN] HNO3 contributes {n_from_acid_kg:.2f} kg N/ha. Deficit N: {original_n:.1f} -> {adjusted['N']:.1f} kg/ha")
     
     return adjusted, n_from_acid_kg
 
@@ -2830,7 +3230,7 @@ IMPORTANTE:
 """
 
     try:
-        response = openai_client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "Eres un experto agrónomo. SOLO cubre nutrientes con déficit > 0. Responde SOLO en JSON válido."},
@@ -3146,7 +3546,7 @@ def optimize_with_ai(
 """
 
     try:
-        response = openai_client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "Eres un experto agrónomo. SOLO cubre nutrientes con déficit > 0. Si déficit = 0, la cobertura debe ser 0. Responde SOLO en JSON válido."},
@@ -3162,6 +3562,12 @@ def optimize_with_ai(
         
         profiles_with_exceeding = []
         
+        # Profile targets share one context; resolve them together
+        profile_targets_by_key = get_profile_targets_batch(
+            [k for k in ['economic', 'balanced', 'complete'] if result.get(k)],
+            crop_name, growth_stage, agronomic_context, adjusted_deficits
+        )
+        
         for profile_key in ['economic', 'balanced', 'complete']:
             if profile_key in result and result[profile_key]:
                 # Apply hard constraints FIRST
@@ -3225,10 +3631,7 @@ def optimize_with_ai(
                 )
                 
                 # Add profile targets for validation reference
-                profile_targets = get_profile_targets(
-                    crop_name, growth_stage, agronomic_context, adjusted_deficits, profile_key
-                )
-                result[profile_key]['coverage_targets'] = profile_targets
+                result[profile_key]['coverage_targets'] = profile_targets_by_key[profile_key]
                 
                 logger.info(f"[optimize_with_ai] Added explainability to {profile_key} profile")
                 
@@ -3724,9 +4127,7 @@ def _filter_fertilizers(
     """Filter fertilizers based on agronomic constraints."""
     filtered = []
     
-    water_cl = 0
-    if agronomic_context and agronomic_context.get('water'):
-        water_cl = agronomic_context['water'].get('cl_meqL', 0) or 0
+    water_cl = AgronomicContextView.from_context(agronomic_context).cl_meq_l
     
     for fert in fertilizers:
         if not allow_chloride and _is_chloride_fertilizer(fert):
@@ -3746,13 +4147,30 @@ def _filter_fertilizers(
     return filtered
 
 
+def _priority_nutrients(
+    remaining_deficits: Dict[str, float],
+    original_deficits: Dict[str, float]
+) -> List[str]:
+    """Nutrients with a deficit that are still below 95% coverage."""
+    priority_nutrients = []
+    for n in NUTRIENT_PRIORITY:
+        original = original_deficits.get(n, 0)
+        remaining = remaining_deficits.get(n, 0)
+        if original > 0:
+            current_cov = ((original - remaining) / original) * 100
+            if current_cov < 95:
+                priority_nutrients.append(n)
+    return priority_nutrients
+
+
 def _score_fertilizer_v2(
     fert: Dict,
     remaining_deficits: Dict[str, float],
     original_deficits: Dict[str, float],
     current_contributions: Dict[str, float],
     profile_config: Dict,
-    max_coverage_pct: float = MAX_COVERAGE_LIMIT
+    max_coverage_pct: float = MAX_COVERAGE_LIMIT,
+    priority_nutrients: Optional[List[str]] = None
 ) -> tuple:
     """
     Score a fertilizer based on ACTUAL coverage delta after applying caps.
@@ -3764,15 +4182,13 @@ def _score_fertilizer_v2(
     
     Key insight: A fertilizer is only valuable if it can still contribute
     meaningful coverage to nutrients that need it, AFTER respecting all caps.
+    
+    priority_nutrients depends only on the deficits, so callers scoring many
+    fertilizers against the same state can compute it once with
+    _priority_nutrients() and pass it in.
     """
-    priority_nutrients = []
-    for n in NUTRIENT_PRIORITY:
-        original = original_deficits.get(n, 0)
-        remaining = remaining_deficits.get(n, 0)
-        if original > 0:
-            current_cov = ((original - remaining) / original) * 100
-            if current_cov < 95:
-                priority_nutrients.append(n)
+    if priority_nutrients is None:
+        priority_nutrients = _priority_nutrients(remaining_deficits, original_deficits)
     
     dose, coverage_deltas = _calculate_constrained_dose(
         fert, remaining_deficits, original_deficits, 
@@ -3870,11 +4286,14 @@ def _score_fertilizer_with_diversity(
     fert: Dict,
     remaining_deficits: Dict[str, float],
     profile_config: Dict,
-    selected_ids: List[str]
+    selected_ids: AbstractSet[str]
 ) -> float:
     """
     Score fertilizer with diversity penalty for already-selected fertilizers.
     Lower score = better.
+    
+    selected_ids is the set of fertilizer ids already in the profile, as
+    kept by _optimize_profile; membership is tested once per call.
     """
     base_score = _score_fertilizer(fert, remaining_deficits, profile_config)
     
@@ -4043,6 +4462,102 @@ def _count_carriers_per_nutrient(fertilizers: List[Dict], deficits: Dict[str, fl
     return carrier_count
 
 
+def _deterministic_step(
+    available: List[Dict],
+    selected_ids: set,
+    remaining_deficits: Dict[str, float],
+    original_deficits: Dict[str, float],
+    current_contributions: Dict[str, float],
+    profile_config: Dict,
+    max_coverage_pct: float = MAX_COVERAGE_LIMIT
+) -> tuple:
+    """
+    One iteration of the greedy loop: pick the best-scoring candidate.
+    
+    Returns: (index, dose) of the chosen fertilizer in ``available``, or
+    (-1, 0) when no candidate improves coverage. Policy decisions (stop
+    conditions, slot limits) stay in _optimize_profile.
+    """
+    priority_nutrients = _priority_nutrients(remaining_deficits, original_deficits)
+    
+    best_index = -1
+    best_score = float('inf')
+    best_dose = 0
+    
+    for index, fert in enumerate(available):
+        fert_id = fert.get('id') or fert.get('slug') or ''
+        if fert_id in selected_ids:
+            continue
+        
+        score, dose, deltas = _score_fertilizer_v2(
+            fert, remaining_deficits, original_deficits,
+            current_contributions, profile_config, max_coverage_pct,
+            priority_nutrients
+        )
+        
+        acid_penalty = fert.get('acid_penalty', 1.0)
+        acid_boost = fert.get('acid_boost', 1.0)
+        if acid_penalty < 1:
+            score = score / acid_penalty
+        if acid_boost > 1:
+            score = score / acid_boost
+        
+        if score < best_score and dose >= 0.1:
+            best_score = score
+            best_index = index
+            best_dose = dose
+    
+    if best_index < 0 or best_score == float('inf') or best_dose < 0.1:
+        return -1, 0
+    return best_index, best_dose
+
+
+def _commit_selection(
+    fert: Dict,
+    dose: float,
+    remaining_deficits: Dict[str, float],
+    micro_remaining: Dict[str, float],
+    current_contributions: Dict[str, float],
+    selected_ids: set,
+    flag: Optional[str] = None
+) -> tuple:
+    """
+    Apply a selected fertilizer dose and build its result entry.
+    
+    Updates remaining deficits and contributions in place and records the
+    fertilizer id. Returns: (entry, subtotal).
+    """
+    contributions = _apply_dose(fert, dose, remaining_deficits, micro_remaining)
+    
+    for n, contrib in contributions.items():
+        if n in current_contributions:
+            current_contributions[n] += contrib
+    
+    price = fert.get('price_per_kg', 25.0) or 25.0
+    subtotal = dose * price
+    
+    tank = fert.get('stock_tank', 'A')
+    if _get_nutrient_content(fert, 'Ca') > 0:
+        tank = 'B'
+    
+    fert_id = fert.get('id') or fert.get('slug')
+    selected_ids.add(fert_id)
+    
+    entry = {
+        'id': fert_id,
+        'name': fert.get('name'),
+        'dose_kg_ha': round(dose, 2),
+        'dose_per_application': round(dose, 2),
+        'price_per_kg': price,
+        'subtotal': round(subtotal, 2),
+        'tank': tank,
+        'contributions': {k: round(v, 2) for k, v in contributions.items() if v > 0}
+    }
+    if flag:
+        entry[flag] = True
+    return entry, subtotal
+
+
 def _optimize_profile(
     deficits: Dict[str, float],
     micro_deficits: Dict[str, float],
@@ -4086,7 +4601,7 @@ def _optimize_profile(
     micro_remaining = {k: v for k, v in micro_deficits.items()}
     current_contributions = {n: 0.0 for n in NUTRIENT_PRIORITY}
     selected_fertilizers = []
-    selected_ids = []
+    selected_ids = set()
     total_cost = 0
     
     max_iterations = config['max_fertilizers']
@@ -4159,34 +4674,12 @@ def _optimize_profile(
                 best_dose = dose
         
         if best_carrier and best_dose >= 0.1:
-            contributions = _apply_dose(best_carrier, best_dose, remaining_deficits, micro_remaining)
-            
-            for n, contrib in contributions.items():
-                if n in current_contributions:
-                    current_contributions[n] += contrib
-            
-            price = best_carrier.get('price_per_kg', 25.0) or 25.0
-            subtotal = best_dose * price
+            entry, subtotal = _commit_selection(
+                best_carrier, best_dose, remaining_deficits, micro_remaining,
+                current_contributions, selected_ids, 'reserved_secondary'
+            )
             total_cost += subtotal
-            
-            tank = best_carrier.get('stock_tank', 'A')
-            if _get_nutrient_content(best_carrier, 'Ca') > 0:
-                tank = 'B'
-            
-            fert_id = best_carrier.get('id') or best_carrier.get('slug')
-            selected_ids.append(fert_id)
-            
-            selected_fertilizers.append({
-                'id': fert_id,
-                'name': best_carrier.get('name'),
-                'dose_kg_ha': round(best_dose, 2),
-                'dose_per_application': round(best_dose, 2),
-                'price_per_kg': price,
-                'subtotal': round(subtotal, 2),
-                'tank': tank,
-                'contributions': {k: round(v, 2) for k, v in contributions.items() if v > 0},
-                'reserved_secondary': True
-            })
+            selected_fertilizers.append(entry)
     
     scarce_nutrients = [
         n for n in NUTRIENT_PRIORITY 
@@ -4236,34 +4729,12 @@ def _optimize_profile(
                 best_dose = dose
         
         if best_carrier and best_dose >= 0.1:
-            contributions = _apply_dose(best_carrier, best_dose, remaining_deficits, micro_remaining)
-            
-            for n, contrib in contributions.items():
-                if n in current_contributions:
-                    current_contributions[n] += contrib
-            
-            price = best_carrier.get('price_per_kg', 25.0) or 25.0
-            subtotal = best_dose * price
+            entry, subtotal = _commit_selection(
+                best_carrier, best_dose, remaining_deficits, micro_remaining,
+                current_contributions, selected_ids, 'scarce_carrier'
+            )
             total_cost += subtotal
-            
-            tank = best_carrier.get('stock_tank', 'A')
-            if _get_nutrient_content(best_carrier, 'Ca') > 0:
-                tank = 'B'
-            
-            fert_id = best_carrier.get('id') or best_carrier.get('slug')
-            selected_ids.append(fert_id)
-            
-            selected_fertilizers.append({
-                'id': fert_id,
-                'name': best_carrier.get('name'),
-                'dose_kg_ha': round(best_dose, 2),
-                'dose_per_application': round(best_dose, 2),
-                'price_per_kg': price,
-                'subtotal': round(subtotal, 2),
-                'tank': tank,
-                'contributions': {k: round(v, 2) for k, v in contributions.items() if v > 0},
-                'scarce_carrier': True
-            })
+            selected_fertilizers.append(entry)
     
     maximize_coverage = config.get('maximize_coverage', False)
     target_avg_coverage = config.get('target_avg_coverage', 1.0)
@@ -4300,62 +4771,20 @@ def _optimize_profile(
         if all_covered and maximize_coverage:
             pass
         
-        best_fert = None
-        best_score = float('inf')
-        best_dose = 0
-        
-        for fert in available:
-            fert_id = fert.get('id') or fert.get('slug') or ''
-            if fert_id in selected_ids:
-                continue
-            
-            score, dose, deltas = _score_fertilizer_v2(
-                fert, remaining_deficits, deficits, 
-                current_contributions, config, max_coverage
-            )
-            
-            acid_penalty = fert.get('acid_penalty', 1.0)
-            acid_boost = fert.get('acid_boost', 1.0)
-            if acid_penalty < 1:
-                score = score / acid_penalty
-            if acid_boost > 1:
-                score = score / acid_boost
-            
-            if score < best_score and dose >= 0.1:
-                best_score = score
-                best_fert = fert
-                best_dose = dose
-        
-        if not best_fert or best_score == float('inf') or best_dose < 0.1:
+        best_index, best_dose = _deterministic_step(
+            available, selected_ids, remaining_deficits, deficits,
+            current_contributions, config, max_coverage
+        )
+        if best_index < 0:
             break
+        best_fert = available[best_index]
         
-        contributions = _apply_dose(best_fert, best_dose, remaining_deficits, micro_remaining)
-        
-        for n, contrib in contributions.items():
-            if n in current_contributions:
-                current_contributions[n] += contrib
-        
-        price = best_fert.get('price_per_kg', 25.0) or 25.0
-        subtotal = best_dose * price
+        entry, subtotal = _commit_selection(
+            best_fert, best_dose, remaining_deficits, micro_remaining,
+            current_contributions, selected_ids
+        )
         total_cost += subtotal
-        
-        tank = best_fert.get('stock_tank', 'A')
-        if _get_nutrient_content(best_fert, 'Ca') > 0:
-            tank = 'B'
-        
-        fert_id = best_fert.get('id') or best_fert.get('slug')
-        selected_ids.append(fert_id)
-        
-        selected_fertilizers.append({
-            'id': fert_id,
-            'name': best_fert.get('name'),
-            'dose_kg_ha': round(best_dose, 2),
-            'dose_per_application': round(best_dose, 2),
-            'price_per_kg': price,
-            'subtotal': round(subtotal, 2),
-            'tank': tank,
-            'contributions': {k: round(v, 2) for k, v in contributions.items() if v > 0}
-        })
+        selected_fertilizers.append(entry)
     
     current_coverage = _calculate_coverage(deficits, remaining_deficits)
     min_cov_pct = min_coverage * 100
@@ -4429,34 +4858,12 @@ def _optimize_profile(
         
         dose = best_dose_for_gap
         
-        contributions = _apply_dose(best_fert_for_gap, dose, remaining_deficits, micro_remaining)
-        
-        for n, contrib in contributions.items():
-            if n in current_contributions:
-                current_contributions[n] += contrib
-        
-        price = best_fert_for_gap.get('price_per_kg', 25.0) or 25.0
-        subtotal = dose * price
+        entry, subtotal = _commit_selection(
+            best_fert_for_gap, dose, remaining_deficits, micro_remaining,
+            current_contributions, selected_ids, 'gap_fill'
+        )
         total_cost += subtotal
-        
-        tank = best_fert_for_gap.get('stock_tank', 'A')
-        if _get_nutrient_content(best_fert_for_gap, 'Ca') > 0:
-            tank = 'B'
-        
-        fert_id = best_fert_for_gap.get('id') or best_fert_for_gap.get('slug')
-        selected_ids.append(fert_id)
-        
-        selected_fertilizers.append({
-            'id': fert_id,
-            'name': best_fert_for_gap.get('name'),
-            'dose_kg_ha': round(dose, 2),
-            'dose_per_application': round(dose, 2),
-            'price_per_kg': price,
-            'subtotal': round(subtotal, 2),
-            'tank': tank,
-            'contributions': {k: round(v, 2) for k, v in contributions.items() if v > 0},
-            'gap_fill': True
-        })
+        selected_fertilizers.append(entry)
         
         gap_fill_count += 1
         current_coverage = _calculate_coverage(deficits, remaining_deficits)
@@ -4532,34 +4939,12 @@ def _optimize_profile(
             rescue_nutrients.remove(target_nutrient)
             continue
         
-        contributions = _apply_dose(best_rescue_fert, best_rescue_dose, remaining_deficits, micro_remaining)
-        
-        for n, contrib in contributions.items():
-            if n in current_contributions:
-                current_contributions[n] += contrib
-        
-        price = best_rescue_fert.get('price_per_kg', 25.0) or 25.0
-        subtotal = best_rescue_dose * price
+        entry, subtotal = _commit_selection(
+            best_rescue_fert, best_rescue_dose, remaining_deficits, micro_remaining,
+            current_contributions, selected_ids, 'liebig_rescue'
+        )
         total_cost += subtotal
-        
-        tank = best_rescue_fert.get('stock_tank', 'A')
-        if _get_nutrient_content(best_rescue_fert, 'Ca') > 0:
-            tank = 'B'
-        
-        fert_id = best_rescue_fert.get('id') or best_rescue_fert.get('slug')
-        selected_ids.append(fert_id)
-        
-        selected_fertilizers.append({
-            'id': fert_id,
-            'name': best_rescue_fert.get('name'),
-            'dose_kg_ha': round(best_rescue_dose, 2),
-            'dose_per_application': round(best_rescue_dose, 2),
-            'price_per_kg': price,
-            'subtotal': round(subtotal, 2),
-            'tank': tank,
-            'contributions': {k: round(v, 2) for k, v in contributions.items() if v > 0},
-            'liebig_rescue': True
-        })
+        selected_fertilizers.append(entry)
         
         rescue_count += 1
         current_coverage = _calculate_coverage(deficits, remaining_deficits)
@@ -13,10 +13,11 @@ Calculates fertigation requirements based on:
 All calculations are independent from the hydroponics module.
 """
 from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 import math
 import json
 import os
+import sys
 import logging
 
 from app.routers.fertilizer_prices import DEFAULT_PRICES_BY_CURRENCY
@@ -33,6 +34,13 @@ SOIL_AVAILABILITY_FACTORS_PATH = os.path.join(
 
 _agronomic_minimums_cache = None
 _soil_availability_factors_cache = None
+# Bumped on every soil-factor reload so memoized availability results keyed on
+# an older generation are never served
+_soil_availability_factors_generation = 0
+
+def _interned_object(pairs) -> Dict:
+    """json object_pairs_hook that interns keys so lookups by literal hit on identity."""
+    return {sys.intern(k): v for k, v in pairs}
 
 def clear_agronomic_minimums_cache():
     """Clear the cache to reload agronomic minimums on next call."""
@@ -41,8 +49,9 @@ def clear_agronomic_minimums_cache():
 
 def clear_soil_availability_factors_cache():
     """Clear the cache to reload soil availability factors on next call."""
-    global _soil_availability_factors_cache
+    global _soil_availability_factors_cache, _soil_availability_factors_generation
     _soil_availability_factors_cache = None
+    _soil_availability_factors_generation += 1
 
 def load_soil_availability_factors() -> Dict:
     """Load soil availability factors from JSON file."""
@@ -52,7 +61,7 @@ def load_soil_availability_factors() -> Dict:
     
     try:
         with open(SOIL_AVAILABILITY_FACTORS_PATH, "r", encoding="utf-8") as f:
-            _soil_availability_factors_cache = json.load(f)
+            _soil_availability_factors_cache = json.load(f, object_pairs_hook=_interned_object)
             return _soil_availability_factors_cache
     except Exception as e:
         logger.error(f"Error loading soil availability factors: {e}")
@@ -113,7 +122,7 @@ def load_agronomic_minimums() -> Dict:
     
     try:
         with open(AGRONOMIC_MINIMUMS_PATH, "r", encoding="utf-8") as f:
-            _agronomic_minimums_cache = json.load(f)
+            _agronomic_minimums_cache = json.load(f, object_pairs_hook=_interned_object)
             return _agronomic_minimums_cache
     except Exception as e:
         logger.error(f"Error loading agronomic minimums: {e}")
@@ -245,7 +254,7 @@ def get_crop_minimums(crop_id: Optional[str], stage: Optional[str] = None) -> Di
     return universal_defaults
 
 
-@dataclass
+@dataclass(slots=True)
 class AcidData:
     """Acid treatment data for calculations."""
     acid_type: str = ""  # phosphoric_acid, nitric_acid, sulfuric_acid
@@ -257,7 +266,7 @@ class AcidData:
     s_g_per_1000L: float = 0.0
 
 
-@dataclass
+@dataclass(slots=True)
 class SoilData:
     """Soil analysis data for calculations."""
     texture: str = "franco"
@@ -277,7 +286,11 @@ class SoilData:
     cic_cmol_kg: float = 20.0
 
 
-@dataclass
+# SoilData fields in declaration order (memo keys for soil availability)
+SOIL_FIELD_NAMES = tuple(f.name for f in fields(SoilData))
+
+
+@dataclass(slots=True)
 class WaterData:
     """Water analysis data for calculations."""
     ec: float = 0.5  # dS/m
@@ -299,7 +312,7 @@ class WaterData:
     b_ppm: float = 0.0
 
 
-@dataclass
+@dataclass(slots=True)
 class CropData:
     """Crop nutrient requirements."""
     name: str
@@ -320,7 +333,7 @@ class CropData:
     custom_extraction_percent: Optional[Dict[str, float]] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class IrrigationData:
     """Irrigation parameters."""
     system: str = "goteo"
@@ -388,9 +401,13 @@ class FertiIrrigationCalculator:
         "Na": 1,
     }
     
+    # Bound on memoized calculate_adjusted_soil_availability results
+    ADJUSTED_SOIL_MEMO_SIZE = 256
+    
     def __init__(self):
         """Initialize calculator and load extraction curves data."""
         self.extraction_curves = self._load_extraction_curves()
+        self._adjusted_soil_memo: Dict[tuple, Dict[str, float]] = {}
     
     def _load_extraction_curves(self) -> Dict:
         """Load crop extraction curves from JSON file."""
@@ -400,7 +417,7 @@ class FertiIrrigationCalculator:
                 "..", "data", "fertiirrigation_extraction_curves.json"
             )
             with open(data_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                return json.load(f, object_pairs_hook=_interned_object)
         except Exception as e:
             print(f"Warning: Could not load extraction curves: {e}")
             return {}
@@ -634,29 +651,90 @@ class FertiIrrigationCalculator:
                                   E.g., if stage uses 20% of crop's nutrients, only 20% of 
                                   soil availability is credited to this stage.
             crop_name: Optional crop name for crop-specific availability factors
+        
+        Results are memoized per calculator on the soil's field values, the stage
+        factor and the crop name; callers receive a private copy.
         """
-        base_availability = self.calculate_soil_availability(soil)
+        stage_factor = self._soil_stage_factor(stage_extraction_pct)
+        key = (
+            tuple(getattr(soil, name) for name in SOIL_FIELD_NAMES),
+            stage_factor,
+            crop_name,
+            _soil_availability_factors_generation,
+        )
+        adjusted = self._adjusted_soil_memo.get(key)
+        if adjusted is None:
+            adjusted = self._adjust_soil_availability(
+                soil,
+                self.get_base_extraction_factors(crop_name),
+                self.get_ph_availability_factors(soil.ph),
+                self.get_cic_availability_factors(soil.cic_cmol_kg),
+                stage_factor,
+            )
+            if len(self._adjusted_soil_memo) >= self.ADJUSTED_SOIL_MEMO_SIZE:
+                self._adjusted_soil_memo.clear()
+            self._adjusted_soil_memo[key] = adjusted
+        return dict(adjusted)
+    
+    def calculate_adjusted_soil_availability_batch(
+        self,
+        soils: List[SoilData],
+        stage_extraction_pct: Optional[float] = None,
+        crop_name: Optional[str] = None
+    ) -> List[Dict[str, float]]:
+        """
+        Batch form of calculate_adjusted_soil_availability for many soils.
         
+        Base extraction factors and the stage factor are resolved once, and the
+        pH/CIC range lookups once per distinct value, so scanning a list of
+        soils does not repeat the factor-table walks per soil.
+        """
         base_factors = self.get_base_extraction_factors(crop_name)
-        ph_factors = self.get_ph_availability_factors(soil.ph)
-        cic_factors = self.get_cic_availability_factors(soil.cic_cmol_kg)
-        
+        stage_factor = self._soil_stage_factor(stage_extraction_pct)
+        ph_cache: Dict[float, Dict[str, float]] = {}
+        cic_cache: Dict[float, Dict[str, float]] = {}
+        
+        results = []
+        for soil in soils:
+            ph_factors = ph_cache.get(soil.ph)
+            if ph_factors is None:
+                ph_factors = ph_cache[soil.ph] = self.get_ph_availability_factors(soil.ph)
+            cic_factors = cic_cache.get(soil.cic_cmol_kg)
+            if cic_factors is None:
+                cic_factors = cic_cache[soil.cic_cmol_kg] = self.get_cic_availability_factors(soil.cic_cmol_kg)
+            results.append(self._adjust_soil_availability(
+                soil, base_factors, ph_factors, cic_factors, stage_factor
+            ))
+        return results
+    
+    @staticmethod
+    def _soil_stage_factor(stage_extraction_pct: Optional[float]) -> float:
+        """Fraction of soil availability credited to the current stage."""
+        if stage_extraction_pct is not None and stage_extraction_pct > 0:
+            return min(1.0, stage_extraction_pct / 100.0)
+        return 1.0
+    
+    def _adjust_soil_availability(
+        self,
+        soil: SoilData,
+        base_factors: Dict[str, float],
+        ph_factors: Dict[str, float],
+        cic_factors: Dict[str, float],
+        stage_factor: float
+    ) -> Dict[str, float]:
+        """Apply pre-resolved extraction, pH, CIC and stage factors to one soil."""
+        base_availability = self.calculate_soil_availability(soil)
         om_n_release = self.get_om_nitrogen_release(soil.organic_matter_pct)
         
-        stage_factor = 1.0
-        if stage_extraction_pct is not None and stage_extraction_pct > 0:
-            stage_factor = min(1.0, stage_extraction_pct / 100.0)
-        
-        adjusted = {
-            "N": (base_availability["N"] * base_factors.get("N", 0.5) * ph_factors.get("N", 1.0) + om_n_release) * stage_factor,
-            "P2O5": base_availability["P2O5"] * base_factors.get("P", 0.2) * ph_factors.get("P", 1.0) * stage_factor,
-            "K2O": base_availability["K2O"] * base_factors.get("K", 0.4) * ph_factors.get("K", 1.0) * cic_factors.get("K", 1.0) * stage_factor,
-            "Ca": base_availability["Ca"] * base_factors.get("Ca", 0.15) * ph_factors.get("Ca", 1.0) * cic_factors.get("Ca", 1.0) * stage_factor,
-            "Mg": base_availability["Mg"] * base_factors.get("Mg", 0.25) * ph_factors.get("Mg", 1.0) * cic_factors.get("Mg", 1.0) * stage_factor,
-            "S": base_availability["S"] * base_factors.get("S", 0.4) * ph_factors.get("S", 1.0) * stage_factor,
+        # Clamped at 0 as each value is built, no intermediate dict
+        return {
+            "N": max(0, (base_availability["N"] * base_factors.get("N", 0.5) * ph_factors.get("N", 1.0) + om_n_release) * stage_factor),
+            "P2O5": max(0, base_availability["P2O5"] * base_factors.get("P", 0.2) * ph_factors.get("P", 1.0) * stage_factor),
+            "K2O": max(0, base_availability["K2O"] * base_factors.get("K", 0.4) * ph_factors.get("K", 1.0) * cic_factors.get("K", 1.0) * stage_factor),
+            "Ca": max(0, base_availability["Ca"] * base_factors.get("Ca", 0.15) * ph_factors.get("Ca", 1.0) * cic_factors.get("Ca", 1.0) * stage_factor),
+            "Mg": max(0, base_availability["Mg"] * base_factors.get("Mg", 0.25) * ph_factors.get("Mg", 1.0) * cic_factors.get("Mg", 1.0) * stage_factor),
+            "S": max(0, base_availability["S"] * base_factors.get("S", 0.4) * ph_factors.get("S", 1.0) * stage_factor),
         }
-        
-        return {k: max(0, v) for k, v in adjusted.items()}
     
     def ppm_to_kg_ha(self, ppm: float, bulk_density: float, depth_cm: float) -> float:
         """
@@ -702,31 +780,24 @@ class FertiIrrigationCalculator:
         depth = soil.depth_cm
         bd = soil.bulk_density
         
+        # ppm_to_kg_ha inlined (same operand order) to skip per-nutrient method calls
         # N from nitrates and ammonium
-        n_available = self.ppm_to_kg_ha(
-            (soil.n_no3_ppm or 0) + (soil.n_nh4_ppm or 0), bd, depth
-        )
+        n_available = ((soil.n_no3_ppm or 0) + (soil.n_nh4_ppm or 0)) * bd * depth * 0.1
         
         # P (convert to P2O5)
-        p_available = self.ppm_to_kg_ha(soil.p_ppm or 0, bd, depth)
-        p2o5_available = p_available * self.P_TO_P2O5
+        p2o5_available = (soil.p_ppm or 0) * bd * depth * 0.1 * self.P_TO_P2O5
         
         # K (convert to K2O)
-        k_available = self.ppm_to_kg_ha(soil.k_ppm or 0, bd, depth)
-        k2o_available = k_available * self.K_TO_K2O
-        
-        # Secondary nutrients
-        ca_available = self.ppm_to_kg_ha(soil.ca_ppm or 0, bd, depth)
-        mg_available = self.ppm_to_kg_ha(soil.mg_ppm or 0, bd, depth)
-        s_available = self.ppm_to_kg_ha(soil.s_ppm or 0, bd, depth)
+        k2o_available = (soil.k_ppm or 0) * bd * depth * 0.1 * self.K_TO_K2O
         
         return {
             "N": n_available,
             "P2O5": p2o5_available,
             "K2O": k2o_available,
-            "Ca": ca_available,
-            "Mg": mg_available,
-            "S": s_available,
+            # Secondary nutrients
+            "Ca": (soil.ca_ppm or 0) * bd * depth * 0.1,
+            "Mg": (soil.mg_ppm or 0) * bd * depth * 0.1,
+            "S": (soil.s_ppm or 0) * bd * depth * 0.1,
         }
     
     def calculate_water_contribution(
@@ -895,6 +966,19 @@ class FertiIrrigationCalculator:
                 "S": crop.s_kg_ha or 0,
             }
         
+        # Loop-invariant inputs: crop minimums and the stage's cumulative extraction
+        crop_id = crop.extraction_crop_id
+        if not crop_id:
+            crop_id = infer_crop_id_from_name(crop.name)
+        stage_id = getattr(crop, 'extraction_stage_id', None)
+        crop_minimums = get_crop_minimums(crop_id, stage_id)
+        
+        prev_cumulative = previous_cumulative_pct or 0.0
+        current_delta = stage_extraction_pct or 100.0
+        current_cumulative = prev_cumulative + current_delta
+        consumed_before_fraction = prev_cumulative / 100.0
+        consumed_through_fraction = min(100.0, current_cumulative) / 100.0
+        
         balance = []
         for nutrient, requirement in requirements.items():
             soil_val = soil_avail.get(nutrient, 0)
@@ -907,12 +991,6 @@ class FertiIrrigationCalculator:
             minimum_applied = False
             minimum_reason = None
             
-            crop_id = crop.extraction_crop_id
-            if not crop_id:
-                crop_id = infer_crop_id_from_name(crop.name)
-            stage_id = getattr(crop, 'extraction_stage_id', None)
-            crop_minimums = get_crop_minimums(crop_id, stage_id)
-            
             if requirement > 0:
                 min_pct = crop_minimums.get(nutrient)
                 
@@ -933,16 +1011,13 @@ class FertiIrrigationCalculator:
             
             # Calculate soil depletion metrics for this nutrient
             full_soil = full_soil_avail.get(nutrient, 0)
-            prev_cumulative = previous_cumulative_pct or 0.0
-            current_delta = stage_extraction_pct or 100.0
-            current_cumulative = prev_cumulative + current_delta
             
             # Soil consumed before this stage (kg/ha)
-            soil_consumed_before = full_soil * (prev_cumulative / 100.0)
+            soil_consumed_before = full_soil * consumed_before_fraction
             # Soil consumed in this stage (kg/ha)
             soil_consumed_this_stage = soil_val
             # Soil remaining after this stage (kg/ha)
-            soil_remaining_after = full_soil - (full_soil * (min(100.0, current_cumulative) / 100.0))
+            soil_remaining_after = full_soil - (full_soil * consumed_through_fraction)
             
             balance.append({
                 "nutrient": nutrient,
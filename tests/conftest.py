@@ -0,0 +1,15 @@
+"""
+Shared pytest configuration for the backend test suite.
+
+Markers:
+- regression: slower S-cap/optimizer regression coverage. Run the core
+  contract only with ``pytest -m "not regression"``; CI runs everything.
+- xdist_group: keeps a module on one pytest-xdist worker under
+  ``pytest -n auto --dist loadgroup`` (registered here so runs without
+  xdist don't warn).
+"""
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "regression: slow regression coverage")
+    config.addinivalue_line("markers", "xdist_group(name): pin tests to one xdist worker")
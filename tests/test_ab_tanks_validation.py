@@ -2,11 +2,18 @@
 Comprehensive A/B Tank Separation System Validation
 1000 Scenarios with Expert Agronomic Criteria
 """
+import io
+import logging
+import logging.handlers
+import queue
 import random
+import re
 import json
 import time
+import multiprocessing
+from collections import Counter
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, TextIO
 from dataclasses import dataclass, field, asdict
 import sys
 import os
@@ -17,7 +24,7 @@ from app.services.fertiirrigation_ab_tanks_service import calculate_ab_tanks_com
 
 random.seed(42)
 
-FERTILIZER_CATALOG = [
+FERTILIZER_CATALOG = (
     {"name": "Nitrato de Calcio", "dose_kg_ha": 150, "category": "calcium", "contains": ["Ca", "N"]},
     {"name": "Nitrato de Potasio", "dose_kg_ha": 100, "category": "nitrate", "contains": ["K", "N"]},
     {"name": "Sulfato de Potasio", "dose_kg_ha": 80, "category": "sulfate", "contains": ["K", "S"]},
@@ -38,7 +45,19 @@ FERTILIZER_CATALOG = [
     {"name": "Sulfato de Zinc", "dose_kg_ha": 10, "category": "sulfate", "contains": ["Zn", "S"]},
     {"name": "Nitrato de Amonio", "dose_kg_ha": 90, "category": "nitrate", "contains": ["N"]},
     {"name": "Superfosfato Triple", "dose_kg_ha": 60, "category": "phosphate", "contains": ["P", "Ca"]},
-]
+)
+CATALOG_INDICES = range(len(FERTILIZER_CATALOG))
+
+CALCIUM_FERTS = [f for f in FERTILIZER_CATALOG if "Ca" in f["contains"]]
+NON_CALCIUM_FERTS = [f for f in FERTILIZER_CATALOG if "Ca" not in f["contains"]]
+FERTS_BY_CATEGORY = {
+    cat: [f for f in FERTILIZER_CATALOG if f["category"] == cat]
+    for cat in ("phosphate", "sulfate", "micronutrient")
+}
+FERTS_NOT_IN_CATEGORY = {
+    cat: [f for f in FERTILIZER_CATALOG if f["category"] != cat]
+    for cat in FERTS_BY_CATEGORY
+}
 
 ACID_CATALOG = [
     {"name": "Ácido Fosfórico", "dose_ml_per_1000l": 500},
@@ -51,9 +70,27 @@ TANK_VOLUMES = [100, 200, 500, 1000, 1500, 2000, 3000, 5000]
 DILUTION_FACTORS = [10, 25, 30, 40, 50, 100, 150, 200]
 IRRIGATION_FLOWS = [500, 750, 1000, 1500, 2000, 3000, 4000, 5000, 8000, 10000]
 NUM_APPLICATIONS_RANGE = (5, 30)
+FERT_NUM_APPS_CHOICES = range(10, 26)
 AREA_HA_RANGE = (0.5, 50)
 
-@dataclass
+# Progress lines go through a queue drained by a listener thread so the
+# timed scenario loop never blocks on stdout.
+progress_queue = queue.SimpleQueue()
+progress_logger = logging.getLogger("ab_tanks_validation.progress")
+progress_logger.setLevel(logging.INFO)
+progress_logger.propagate = False
+progress_logger.addHandler(logging.handlers.QueueHandler(progress_queue))
+
+CALCIUM_RE = re.compile(r"calcio|calcium")
+PHOSPHATE_RE = re.compile(r"fosfato|phosphat|(?:^| )(?:map|dap)")
+SULFATE_RE = re.compile(r"sulfato")
+TREATMENT_ACID_RE = re.compile(
+    r"ácido (?:fosfórico|nítrico|sulfúrico|cítrico)"
+    r"|acido (?:fosforico|nitrico|sulfurico|citrico)"
+    r"|(?:phosphoric|nitric|sulfuric|citric) acid"
+)
+
+@dataclass(slots=True)
 class ValidationResult:
     scenario_id: int
     scenario_type: str
@@ -68,7 +105,7 @@ class ValidationResult:
     injection_rate_b: float = 0.0
     execution_time_ms: float = 0.0
 
-@dataclass 
+@dataclass(slots=True)
 class AgronomicCriteria:
     calcium_phosphate_separation: bool = False
     calcium_sulfate_separation: bool = False
@@ -83,28 +120,30 @@ class AgronomicCriteria:
     max_balance_deviation: float = 0.5
     no_api_errors: bool = False
 
+def sample_fertilizers(n: int) -> List[Dict[str, Any]]:
+    """Draw up to n distinct catalog entries by index"""
+    return [FERTILIZER_CATALOG[i] for i in random.sample(CATALOG_INDICES, min(n, len(CATALOG_INDICES)))]
+
 def generate_scenario(scenario_id: int, scenario_type: str) -> Dict[str, Any]:
     """Generate a test scenario based on type"""
     
     if scenario_type == "standard":
         num_fertilizers = random.randint(3, 8)
-        fertilizers = random.sample(FERTILIZER_CATALOG, min(num_fertilizers, len(FERTILIZER_CATALOG)))
+        fertilizers = sample_fertilizers(num_fertilizers)
         include_acid = random.random() > 0.3
         
     elif scenario_type == "high_calcium":
-        calcium_ferts = [f for f in FERTILIZER_CATALOG if "Ca" in f["contains"]]
-        other_ferts = random.sample([f for f in FERTILIZER_CATALOG if "Ca" not in f["contains"]], 3)
-        fertilizers = calcium_ferts + other_ferts
+        other_ferts = random.sample(NON_CALCIUM_FERTS, 3)
+        fertilizers = CALCIUM_FERTS + other_ferts
         include_acid = True
         
     elif scenario_type == "phosphate_heavy":
-        phosphate_ferts = [f for f in FERTILIZER_CATALOG if f["category"] == "phosphate"]
-        other_ferts = random.sample([f for f in FERTILIZER_CATALOG if f["category"] != "phosphate"], 4)
-        fertilizers = phosphate_ferts + other_ferts
+        other_ferts = random.sample(FERTS_NOT_IN_CATEGORY["phosphate"], 4)
+        fertilizers = FERTS_BY_CATEGORY["phosphate"] + other_ferts
         include_acid = True
         
     elif scenario_type == "micronutrient_only":
-        fertilizers = [f for f in FERTILIZER_CATALOG if f["category"] == "micronutrient"]
+        fertilizers = FERTS_BY_CATEGORY["micronutrient"]
         include_acid = False
         
     elif scenario_type == "acid_only":
@@ -112,37 +151,37 @@ def generate_scenario(scenario_id: int, scenario_type: str) -> Dict[str, Any]:
         include_acid = True
         
     elif scenario_type == "sulfate_heavy":
-        sulfate_ferts = [f for f in FERTILIZER_CATALOG if f["category"] == "sulfate"]
-        other_ferts = random.sample([f for f in FERTILIZER_CATALOG if f["category"] != "sulfate"], 2)
-        fertilizers = sulfate_ferts + other_ferts
+        other_ferts = random.sample(FERTS_NOT_IN_CATEGORY["sulfate"], 2)
+        fertilizers = FERTS_BY_CATEGORY["sulfate"] + other_ferts
         include_acid = random.random() > 0.5
         
     elif scenario_type == "minimal":
-        fertilizers = random.sample(FERTILIZER_CATALOG, 2)
+        fertilizers = sample_fertilizers(2)
         include_acid = False
         
     elif scenario_type == "maximal":
-        fertilizers = FERTILIZER_CATALOG.copy()
+        fertilizers = list(FERTILIZER_CATALOG)
         include_acid = True
         
     elif scenario_type == "edge_low_volume":
-        fertilizers = random.sample(FERTILIZER_CATALOG, 5)
+        fertilizers = sample_fertilizers(5)
         include_acid = True
         
     elif scenario_type == "edge_high_volume":
-        fertilizers = random.sample(FERTILIZER_CATALOG, 5)
+        fertilizers = sample_fertilizers(5)
         include_acid = True
         
     else:
         num_fertilizers = random.randint(2, 10)
-        fertilizers = random.sample(FERTILIZER_CATALOG, min(num_fertilizers, len(FERTILIZER_CATALOG)))
+        fertilizers = sample_fertilizers(num_fertilizers)
         include_acid = random.random() > 0.4
     
     dose_multiplier = random.uniform(0.1, 0.5)
+    # One batched draw for every fertilizer instead of a randint() per item
+    fert_num_apps = random.choices(FERT_NUM_APPS_CHOICES, k=len(fertilizers))
     formatted_fertilizers = []
-    for f in fertilizers:
+    for f, num_apps in zip(fertilizers, fert_num_apps):
         base_dose = f["dose_kg_ha"] * dose_multiplier
-        num_apps = random.randint(10, 25)
         formatted_fertilizers.append({
             "name": f["name"],
             "dose_total_kg": base_dose,
@@ -188,14 +227,21 @@ def validate_chemical_compatibility(result: Dict, fertilizers: List[Dict]) -> Tu
     issues = []
     
     tank_a_ferts = result.get("tank_a", {}).get("fertilizers", [])
-    tank_b_ferts = result.get("tank_b", {}).get("fertilizers", [])
-    
-    tank_a_names = [f["name"].lower() for f in tank_a_ferts]
-    tank_b_names = [f["name"].lower() for f in tank_b_ferts]
     
-    calcium_in_a = any("calcio" in n or "calcium" in n for n in tank_a_names)
-    phosphate_in_a = any("fosfato" in n or "phosphat" in n or " map" in n or " dap" in n or n.startswith("map") or n.startswith("dap") for n in tank_a_names)
-    sulfate_in_a = any("sulfato" in n and "calcio" not in n for n in tank_a_names)
+    # One pass over tank A names sets every flag; stop once all are known
+    calcium_in_a = phosphate_in_a = sulfate_in_a = treatment_acid_in_a = False
+    for f in tank_a_ferts:
+        n = f["name"].lower()
+        if not calcium_in_a and CALCIUM_RE.search(n):
+            calcium_in_a = True
+        if not phosphate_in_a and PHOSPHATE_RE.search(n):
+            phosphate_in_a = True
+        if not sulfate_in_a and SULFATE_RE.search(n) and "calcio" not in n:
+            sulfate_in_a = True
+        if not treatment_acid_in_a and TREATMENT_ACID_RE.search(n):
+            treatment_acid_in_a = True
+        if calcium_in_a and phosphate_in_a and sulfate_in_a and treatment_acid_in_a:
+            break
     
     if calcium_in_a and phosphate_in_a:
         issues.append("CRITICAL: Calcium and phosphate in same tank A - precipitation risk")
@@ -203,11 +249,6 @@ def validate_chemical_compatibility(result: Dict, fertilizers: List[Dict]) -> Tu
     if calcium_in_a and sulfate_in_a:
         issues.append("WARNING: Calcium and sulfate in tank A - gypsum precipitation possible")
     
-    TREATMENT_ACIDS = ['ácido fosfórico', 'ácido nítrico', 'ácido sulfúrico', 'ácido cítrico', 
-                       'acido fosforico', 'acido nitrico', 'acido sulfurico', 'acido citrico',
-                       'phosphoric acid', 'nitric acid', 'sulfuric acid', 'citric acid']
-    
-    treatment_acid_in_a = any(any(acid in n for acid in TREATMENT_ACIDS) for n in tank_a_names)
     if treatment_acid_in_a:
         issues.append("ERROR: Treatment acid found in tank A - should be in tank B")
     
@@ -235,6 +276,26 @@ def validate_concentration_limits(result: Dict, max_concentration: float = 200.0
     
     return True, issues
 
+def injection_rate_kernel(rate_a_ml_min: float, rate_b_ml_min: float, dilution_factor: float) -> Tuple[float, float, float]:
+    """Numeric core of validate_injection_rates: (rate_a_lph, rate_b_lph, max_rate_lph)"""
+    if dilution_factor <= 10:
+        max_rate = 1000.0
+    elif dilution_factor <= 25:
+        max_rate = 500.0
+    elif dilution_factor <= 50:
+        max_rate = 200.0
+    else:
+        max_rate = 100.0
+    return rate_a_ml_min * 60 / 1000, rate_b_ml_min * 60 / 1000, max_rate
+
+def tank_balance_kernel(tank_a_conc: float, tank_b_conc: float, max_deviation: float) -> Tuple[bool, float]:
+    """Numeric core of validate_tank_balance for two non-zero tanks: (balanced, ratio)"""
+    if tank_a_conc < tank_b_conc:
+        ratio = tank_a_conc / tank_b_conc
+    else:
+        ratio = tank_b_conc / tank_a_conc
+    return ratio >= 1.0 - max_deviation, ratio
+
 def validate_injection_rates(result: Dict, min_rate: float = 0.01, scenario_dilution_factor: int = None) -> Tuple[bool, List[str]]:
     """
     Validate injection rate feasibility - rates depend on dilution factor.
@@ -258,17 +319,7 @@ def validate_injection_rates(result: Dict, min_rate: float = 0.01, scenario_dilu
     rate_a = inj_program.get("tank_a", {}).get("injection_rate_ml_min", 0)
     rate_b = inj_program.get("tank_b", {}).get("injection_rate_ml_min", 0)
     
-    rate_a_lph = rate_a * 60 / 1000
-    rate_b_lph = rate_b * 60 / 1000
-    
-    if dilution_factor <= 10:
-        max_rate = 1000.0
-    elif dilution_factor <= 25:
-        max_rate = 500.0
-    elif dilution_factor <= 50:
-        max_rate = 200.0
-    else:
-        max_rate = 100.0
+    rate_a_lph, rate_b_lph, max_rate = injection_rate_kernel(rate_a, rate_b, dilution_factor)
     
     if rate_a_lph > 0 and rate_a_lph < min_rate:
         issues.append(f"WARNING: Tank A injection rate {rate_a_lph:.3f} L/h very low")
@@ -303,16 +354,16 @@ def validate_tank_balance(result: Dict, max_deviation: float = 0.9) -> Tuple[boo
             issues.append("INFO: Only Tank B has fertilizers")
         return True, 0.0, issues
     
-    ratio = min(tank_a_conc, tank_b_conc) / max(tank_a_conc, tank_b_conc)
+    balanced, ratio = tank_balance_kernel(tank_a_conc, tank_b_conc, max_deviation)
     
-    if ratio < (1 - max_deviation):
+    if not balanced:
         issues.append(f"WARNING: Tank imbalance - ratio {ratio:.2f} (A: {tank_a_conc:.1f}, B: {tank_b_conc:.1f})")
     
-    return ratio >= (1 - max_deviation), ratio, issues
+    return balanced, ratio, issues
 
 def run_scenario(scenario: Dict[str, Any]) -> ValidationResult:
     """Run a single scenario and validate results"""
-    start_time = time.time()
+    start_ns = time.perf_counter_ns()
     
     result = ValidationResult(
         scenario_id=scenario["scenario_id"],
@@ -379,26 +430,16 @@ def run_scenario(scenario: Dict[str, Any]) -> ValidationResult:
         result.passed = False
         result.checks["no_exceptions"] = False
     
-    result.execution_time_ms = (time.time() - start_time) * 1000
+    result.execution_time_ms = (time.perf_counter_ns() - start_ns) / 1e6
     return result
 
-def generate_report(results: List[ValidationResult], total_time: float) -> str:
-    """Generate comprehensive validation report"""
+def write_report(results: List[ValidationResult], total_time: float, out: TextIO) -> None:
+    """Write comprehensive validation report to a text stream"""
     
     total = len(results)
-    passed = sum(1 for r in results if r.passed)
-    failed = total - passed
+    passed = 0
     
     by_type = {}
-    for r in results:
-        if r.scenario_type not in by_type:
-            by_type[r.scenario_type] = {"total": 0, "passed": 0, "failed": 0}
-        by_type[r.scenario_type]["total"] += 1
-        if r.passed:
-            by_type[r.scenario_type]["passed"] += 1
-        else:
-            by_type[r.scenario_type]["failed"] += 1
-    
     check_stats = {
         "api_success": {"passed": 0, "failed": 0},
         "chemical_compatibility": {"passed": 0, "failed": 0},
@@ -406,37 +447,53 @@ def generate_report(results: List[ValidationResult], total_time: float) -> str:
         "injection_feasibility": {"passed": 0, "failed": 0},
         "tank_balance": {"passed": 0, "failed": 0},
     }
+    concentrations_a = []
+    concentrations_b = []
+    exec_times = []
+    all_warnings = []
+    all_errors = []
+    failed_scenarios = []
     
+    # Single traversal feeds every accumulator used by the report
     for r in results:
+        type_stats = by_type.get(r.scenario_type)
+        if type_stats is None:
+            type_stats = by_type[r.scenario_type] = {"total": 0, "passed": 0, "failed": 0}
+        type_stats["total"] += 1
+        if r.passed:
+            passed += 1
+            type_stats["passed"] += 1
+        else:
+            type_stats["failed"] += 1
+            if len(failed_scenarios) < 5:
+                failed_scenarios.append(r)
+        
         for check, passed_check in r.checks.items():
-            if check in check_stats:
+            stats = check_stats.get(check)
+            if stats is not None:
                 if passed_check:
-                    check_stats[check]["passed"] += 1
+                    stats["passed"] += 1
                 else:
-                    check_stats[check]["failed"] += 1
-    
-    concentrations_a = [r.tank_a_concentration for r in results if r.tank_a_concentration > 0]
-    concentrations_b = [r.tank_b_concentration for r in results if r.tank_b_concentration > 0]
-    
-    exec_times = [r.execution_time_ms for r in results]
-    
-    all_warnings = []
-    all_errors = []
-    for r in results:
+                    stats["failed"] += 1
+        
+        if r.tank_a_concentration > 0:
+            concentrations_a.append(r.tank_a_concentration)
+        if r.tank_b_concentration > 0:
+            concentrations_b.append(r.tank_b_concentration)
+        exec_times.append(r.execution_time_ms)
         all_warnings.extend(r.warnings)
         all_errors.extend(r.errors)
     
-    warning_counts = {}
-    for w in all_warnings:
-        key = w.split(":")[0] if ":" in w else w[:50]
-        warning_counts[key] = warning_counts.get(key, 0) + 1
+    failed = total - passed
+    
+    sorted_times = sorted(exec_times)
+    p95_time = sorted_times[int(len(sorted_times) * 0.95)]
+    p99_time = sorted_times[int(len(sorted_times) * 0.99)]
     
-    error_counts = {}
-    for e in all_errors:
-        key = e.split(":")[0] if ":" in e else e[:50]
-        error_counts[key] = error_counts.get(key, 0) + 1
+    warning_counts = Counter(w.split(":", 1)[0] if ":" in w else w[:50] for w in all_warnings)
+    error_counts = Counter(e.split(":", 1)[0] if ":" in e else e[:50] for e in all_errors)
     
-    report = f"""
+    out.write(f"""
 ================================================================================
        REPORTE DE VALIDACIÓN - SISTEMA TANQUES A/B FERTIIRRIGACIÓN
 ================================================================================
@@ -456,21 +513,21 @@ TASA DE ÉXITO GLOBAL: {passed/total*100:.1f}%
 ================================================================================
                     RESULTADOS POR TIPO DE ESCENARIO
 ================================================================================
-"""
+""")
     
     for scenario_type, stats in sorted(by_type.items()):
         pct = stats["passed"]/stats["total"]*100 if stats["total"] > 0 else 0
         status = "✅" if pct == 100 else "⚠️" if pct >= 90 else "❌"
-        report += f"""
+        out.write(f"""
 {status} {scenario_type.upper()}
-   Total: {stats['total']} | Aprobados: {stats['passed']} | Fallidos: {stats['failed']} | Tasa: {pct:.1f}%"""
+   Total: {stats['total']} | Aprobados: {stats['passed']} | Fallidos: {stats['failed']} | Tasa: {pct:.1f}%""")
     
-    report += f"""
+    out.write(f"""
 
 ================================================================================
                     VALIDACIÓN DE CRITERIOS AGRONÓMICOS
 ================================================================================
-"""
+""")
     
     criteria_names = {
         "api_success": "API Sin Errores",
@@ -486,11 +543,11 @@ TASA DE ÉXITO GLOBAL: {passed/total*100:.1f}%
             pct = stats["passed"]/total_check*100
             status = "✅" if pct == 100 else "⚠️" if pct >= 95 else "❌"
             name = criteria_names.get(check, check)
-            report += f"""
+            out.write(f"""
 {status} {name}
-   Aprobados: {stats['passed']}/{total_check} ({pct:.1f}%)"""
+   Aprobados: {stats['passed']}/{total_check} ({pct:.1f}%)""")
     
-    report += f"""
+    out.write(f"""
 
 ================================================================================
                     ESTADÍSTICAS DE CONCENTRACIÓN
@@ -516,51 +573,50 @@ Tiempo de Ejecución por Escenario:
    Mínimo: {min(exec_times):.2f} ms
    Máximo: {max(exec_times):.2f} ms
    Promedio: {sum(exec_times)/len(exec_times):.2f} ms
-   P95: {sorted(exec_times)[int(len(exec_times)*0.95)]:.2f} ms
-   P99: {sorted(exec_times)[int(len(exec_times)*0.99)]:.2f} ms
+   P95: {p95_time:.2f} ms
+   P99: {p99_time:.2f} ms
 
 ================================================================================
                          ADVERTENCIAS FRECUENTES
 ================================================================================
-"""
+""")
     
-    for warning, count in sorted(warning_counts.items(), key=lambda x: -x[1])[:10]:
-        report += f"""
-⚠️ [{count}x] {warning}"""
+    for warning, count in warning_counts.most_common(10):
+        out.write(f"""
+⚠️ [{count}x] {warning}""")
     
     if not warning_counts:
-        report += "\n✅ Sin advertencias frecuentes"
+        out.write("\n✅ Sin advertencias frecuentes")
     
-    report += f"""
+    out.write(f"""
 
 ================================================================================
                            ERRORES ENCONTRADOS
 ================================================================================
-"""
+""")
     
-    for error, count in sorted(error_counts.items(), key=lambda x: -x[1])[:10]:
-        report += f"""
-❌ [{count}x] {error}"""
+    for error, count in error_counts.most_common(10):
+        out.write(f"""
+❌ [{count}x] {error}""")
     
     if not error_counts:
-        report += "\n✅ Sin errores encontrados"
+        out.write("\n✅ Sin errores encontrados")
     
-    failed_scenarios = [r for r in results if not r.passed][:5]
     if failed_scenarios:
-        report += f"""
+        out.write(f"""
 
 ================================================================================
                     DETALLE DE ESCENARIOS FALLIDOS (Top 5)
 ================================================================================
-"""
+""")
         for r in failed_scenarios:
-            report += f"""
+            out.write(f"""
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 Escenario #{r.scenario_id} - Tipo: {r.scenario_type}
 Concentración Tank A: {r.tank_a_concentration:.1f} g/L | Tank B: {r.tank_b_concentration:.1f} g/L
 Checks: {r.checks}
 Errores: {r.errors}
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"""
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━""")
     
     recommendations = []
     
@@ -580,22 +636,22 @@ Errores: {r.errors}
     if passed/total < 0.95:
         recommendations.append("• Tasa de éxito < 95% - revisar casos edge y mejorar robustez")
     
-    report += f"""
+    out.write(f"""
 
 ================================================================================
                          RECOMENDACIONES
 ================================================================================
-"""
+""")
     
     if recommendations:
         for rec in recommendations:
-            report += f"\n{rec}"
+            out.write(f"\n{rec}")
     else:
-        report += "\n✅ Sistema funcionando correctamente - sin recomendaciones críticas"
+        out.write("\n✅ Sistema funcionando correctamente - sin recomendaciones críticas")
     
     verdict = "✅ APROBADO" if passed/total >= 0.95 and check_stats["chemical_compatibility"]["failed"] == 0 else "⚠️ APROBADO CON OBSERVACIONES" if passed/total >= 0.85 else "❌ REQUIERE CORRECCIONES"
     
-    report += f"""
+    out.write(f"""
 
 ================================================================================
                            VEREDICTO FINAL
@@ -610,12 +666,16 @@ Rendimiento: {'Óptimo' if avg_time < 50 else 'Aceptable' if avg_time < 100 else
 ================================================================================
                      FIN DEL REPORTE DE VALIDACIÓN
 ================================================================================
-"""
-    
-    return report
+""")
 
-def run_validation(num_scenarios: int = 1000) -> str:
-    """Run the complete validation suite"""
+def generate_report(results: List[ValidationResult], total_time: float) -> str:
+    """Generate comprehensive validation report"""
+    buf = io.StringIO()
+    write_report(results, total_time, buf)
+    return buf.getvalue()
+
+def run_scenarios(num_scenarios: int = 1000) -> Tuple[List[ValidationResult], float]:
+    """Generate and run every scenario, returning results and total seconds"""
     print(f"\n🔬 Iniciando validación con {num_scenarios} escenarios...")
     
     scenario_types = [
@@ -641,29 +701,41 @@ def run_validation(num_scenarios: int = 1000) -> str:
     
     print(f"📋 Generados {len(scenarios)} escenarios de prueba")
     
-    start_time = time.time()
+    listener = logging.handlers.QueueListener(progress_queue, logging.StreamHandler(sys.stdout))
+    listener.start()
+    
+    start_ns = time.perf_counter_ns()
     results = []
     
-    for i, scenario in enumerate(scenarios):
-        if (i + 1) % 100 == 0:
-            print(f"   Procesando... {i+1}/{len(scenarios)}")
+    try:
+        # Scenarios are independent and CPU-bound; imap keeps submission order so
+        # the report (failed-scenario detail) stays deterministic across runs.
+        with multiprocessing.Pool(processes=os.cpu_count()) as pool:
+            for i, result in enumerate(pool.imap(run_scenario, scenarios, chunksize=25)):
+                if (i + 1) % 100 == 0:
+                    progress_logger.info("   Procesando... %d/%d", i + 1, len(scenarios))
+                
+                results.append(result)
         
-        result = run_scenario(scenario)
-        results.append(result)
-    
-    total_time = time.time() - start_time
+        total_time = (time.perf_counter_ns() - start_ns) / 1e9
+    finally:
+        listener.stop()
     
     print(f"\n✅ Validación completada en {total_time:.2f} segundos")
     
-    report = generate_report(results, total_time)
-    
-    return report
+    return results, total_time
+
+def run_validation(num_scenarios: int = 1000) -> str:
+    """Run the complete validation suite"""
+    results, total_time = run_scenarios(num_scenarios)
+    return generate_report(results, total_time)
 
 if __name__ == "__main__":
-    report = run_validation(1000)
-    print(report)
+    results, total_time = run_scenarios(1000)
+    write_report(results, total_time, sys.stdout)
+    print()
     
     with open("/tmp/ab_tanks_validation_report.txt", "w") as f:
-        f.write(report)
+        write_report(results, total_time, f)
     
     print("\n📄 Reporte guardado en /tmp/ab_tanks_validation_report.txt")
@@ -11,6 +11,7 @@ import pytest
 from app.services.fertiirrigation_ai_optimizer import (
     build_explainability_notes,
     get_profile_targets,
+    get_profile_targets_batch,
     build_coverage_explained,
     normalize_stage,
     LOW_S_DEFICIT_THRESHOLD
@@ -243,6 +244,22 @@ class TestGetProfileTargets:
         )
         
         assert targets_economic['min_coverage']['N'] < targets_complete['min_coverage']['N']
+    
+    def test_batch_matches_per_profile_targets(self):
+        """Batched targets should equal individual calls, with independent dicts."""
+        agronomic_context = {'water': {}, 'soil': {'no3n_ppm': 45, 'k_ppm': 450}}
+        deficits = {'N': 10, 'P2O5': 0, 'K2O': 10, 'Ca': 5, 'Mg': 0, 'S': 2}
+        profiles = ['economic', 'balanced', 'complete']
+        
+        batch = get_profile_targets_batch(
+            profiles, 'Tomate', 'Plántula', agronomic_context, deficits
+        )
+        
+        for profile_key in profiles:
+            assert batch[profile_key] == get_profile_targets(
+                'Tomate', 'Plántula', agronomic_context, deficits, profile_key
+            )
+        assert batch['economic']['coverage_explained'] is not batch['complete']['coverage_explained']
 
 
 class TestBuildCoverageExplained:
@@ -320,6 +337,40 @@ class TestBuildCoverageExplained:
         assert explained['P2O5'] == 'cubierto'
 
 
+class TestContextAliases:
+    """Every helper accepts the same water/soil alias spellings."""
+    
+    @pytest.mark.parametrize('soil_key', ['no3n_ppm', 'no3_n_ppm', 'nitrogen_ppm'])
+    def test_no3n_aliases(self, soil_key):
+        agronomic_context = {'water': {}, 'soil': {soil_key: 70}}
+        deficits = {'N': 10, 'P2O5': 5, 'K2O': 0, 'Ca': 0, 'Mg': 0, 'S': 2}
+        
+        targets = get_profile_targets(
+            'Tomate', 'Plántula', agronomic_context, deficits, 'balanced'
+        )
+        explained = build_coverage_explained(
+            {'coverage': {'N': 25}}, deficits, agronomic_context, 'Plántula'
+        )
+        
+        assert targets['min_coverage']['N'] == 0
+        assert 'reducido' in explained['N']
+    
+    @pytest.mark.parametrize('soil_key', ['k_ppm', 'potassium_ppm'])
+    def test_soil_k_aliases(self, soil_key):
+        agronomic_context = {'water': {}, 'soil': {soil_key: 950}}
+        deficits = {'N': 10, 'P2O5': 5, 'K2O': 10, 'Ca': 0, 'Mg': 0, 'S': 2}
+        
+        targets = get_profile_targets(
+            'Tomate', 'Vegetativo', agronomic_context, deficits, 'balanced'
+        )
+        explained = build_coverage_explained(
+            {'coverage': {'K2O': 5}}, deficits, agronomic_context, 'Vegetativo'
+        )
+        
+        assert targets['min_coverage']['K2O'] == 0
+        assert 'evitado' in explained['K2O']
+
+
 class TestIntegrationScenarios:
     """Integration tests matching user's real scenarios."""
     
@@ -8,13 +8,21 @@ Tests the following critical behaviors:
 4. enforce_hard_constraints() properly removes/reduces prohibited fertilizers
 5. normalize_coverage() handles deficit=0 with stage-specific thresholds
 """
+import csv
+import json
+import os
+from types import MappingProxyType
+
 import pytest
 from unittest.mock import patch, MagicMock
 from app.services.fertiirrigation_ai_optimizer import (
     enforce_hard_constraints,
+    build_deficit_aware_fertilizer_list,
     normalize_coverage,
+    optimize_with_ai,
     adjust_deficits_for_acid_nitrogen,
     is_fertilizer_in_set,
+    fertilizer_category_mask,
     normalize_stage,
     cap_fertilizers_by_nutrient,
     SulfurCapError,
@@ -22,7 +30,11 @@ from app.services.fertiirrigation_ai_optimizer import (
     MG_CENTERED_FERTILIZERS,
     CHLORIDE_FERTILIZERS,
     SULFATE_FERTILIZERS,
-    LOW_S_DEFICIT_THRESHOLD
+    LOW_S_DEFICIT_THRESHOLD,
+    K_CENTERED_BIT,
+    MG_CENTERED_BIT,
+    CHLORIDE_BIT,
+    SULFATE_BIT
 )
 
 
@@ -30,6 +42,12 @@ from app.services.fertiirrigation_ai_optimizer import (
 # Test Fixtures
 # =============================================================================
 
+NUTRIENTS = ('N', 'P2O5', 'K2O', 'Ca', 'Mg', 'S')
+
+# All-zero macro deficits; tests override only the nutrients they need
+_ZERO_MACRO = MappingProxyType(dict.fromkeys(NUTRIENTS, 0.0))
+
+
 @pytest.fixture
 def sample_fertilizers():
     """Sample fertilizer catalog for testing."""
@@ -46,15 +64,8 @@ def sample_fertilizers():
 
 @pytest.fixture
 def deficits_with_zero_k2o():
-    """Deficits where K2O = 0 (no potassium needed)."""
-    return {
-        'N': 100,
-        'P2O5': 50,
-        'K2O': 0,  # No potassium deficit
-        'Ca': 30,
-        'Mg': 0,   # No magnesium deficit
-        'S': 20
-    }
+    """Deficits where K2O = 0 and Mg = 0 (no potassium/magnesium needed)."""
+    return {**_ZERO_MACRO, 'N': 100, 'P2O5': 50, 'Ca': 30, 'S': 20}
 
 
 @pytest.fixture
@@ -93,7 +104,7 @@ def test_enforce_hard_constraints_removes_kcl_when_k2o_zero(sample_fertilizers,
     )
     
     # KCl should be removed because K2O deficit = 0
-    fert_ids = [f['id'] for f in result['fertilizers']]
+    fert_ids = {f['id'] for f in result['fertilizers']}
     assert 'potassium_chloride' not in fert_ids, "KCl should be removed when K2O deficit = 0"
     
     # MAP and Urea should remain (they provide N and P2O5 which have deficits)
@@ -125,7 +136,7 @@ def test_enforce_hard_constraints_removes_kno3_when_k2o_zero(sample_fertilizers,
     # KNO3 provides 13% N, BUT it's a K-centered fertilizer
     # When K2O deficit = 0, ALL K-centered fertilizers must be removed unconditionally
     # The system should use alternative N sources (urea, ammonium sulfate) instead
-    fert_ids = [f['id'] for f in result['fertilizers']]
+    fert_ids = {f['id'] for f in result['fertilizers']}
     
     assert 'potassium_nitrate' not in fert_ids, "KNO3 should be REMOVED when K2O deficit=0 (use urea for N instead)"
     assert 'urea' in fert_ids, "Urea should remain as alternative N source"
@@ -156,7 +167,7 @@ def test_enforce_hard_constraints_removes_mgso4_when_mg_zero(sample_fertilizers,
     
     # MgSO4 is Mg-centered -> MUST be removed when Mg deficit = 0
     # Use ammonium sulfate as alternative S source
-    fert_ids = [f['id'] for f in result['fertilizers']]
+    fert_ids = {f['id'] for f in result['fertilizers']}
     
     assert 'magnesium_sulfate' not in fert_ids, "MgSO4 should be REMOVED when Mg deficit=0"
     assert 'ammonium_sulfate' in fert_ids, "Ammonium sulfate should remain as alternative S source"
@@ -188,7 +199,7 @@ def test_profile_uses_map_without_k_when_k2o_zero(sample_fertilizers, deficits_w
     )
     
     # MAP should remain (K2O = 0 in MAP)
-    fert_ids = [f['id'] for f in result['fertilizers']]
+    fert_ids = {f['id'] for f in result['fertilizers']}
     assert 'map' in fert_ids, "MAP should remain (has no K2O)"
 
 
@@ -219,7 +230,7 @@ def test_enforce_hard_constraints_removes_kcl_when_cl_high(sample_fertilizers, d
     )
     
     # KCl should be REMOVED due to high Cl- in water
-    fert_ids = [f['id'] for f in result['fertilizers']]
+    fert_ids = {f['id'] for f in result['fertilizers']}
     assert 'potassium_chloride' not in fert_ids, "KCl should be removed when water Cl- > 2 meq/L"
     
     # MAP should remain
@@ -230,6 +241,42 @@ def test_enforce_hard_constraints_removes_kcl_when_cl_high(sample_fertilizers, d
     assert any('Cl' in c for c in result.get('constraints_applied', []))
 
 
+@pytest.mark.parametrize("water", [{'cl_meqL': 3.2}, {'cl_meq_l': 3.2}])
+def test_enforce_hard_constraints_accepts_cl_aliases(sample_fertilizers, deficits_full, water):
+    """Test that both spellings of water Cl- ban KCl."""
+    profile = {
+        'fertilizers': [
+            {'id': 'potassium_chloride', 'name': 'Cloruro de Potasio (KCl)', 'dose_kg_ha': 50},
+        ]
+    }
+    
+    result = enforce_hard_constraints(
+        profile,
+        deficits_full,
+        agronomic_context={'water': water, 'soil': {}},
+        available_fertilizers=sample_fertilizers,
+        growth_stage='vegetative'
+    )
+    
+    assert result['fertilizers'] == []
+    assert any('Cl' in c for c in result.get('constraints_applied', []))
+
+
+@pytest.mark.parametrize("soil", [{'k_ppm': 950}, {'potassium_ppm': 950}])
+def test_deficit_aware_list_accepts_soil_k_aliases(sample_fertilizers, deficits_full, soil):
+    """Both soil K spellings flag K sources in the prompt fertilizer list."""
+    text = build_deficit_aware_fertilizer_list(
+        sample_fertilizers, deficits_full, {'water': {}, 'soil': soil}
+    )
+    
+    assert text != build_deficit_aware_fertilizer_list(
+        sample_fertilizers, deficits_full, {'water': {}, 'soil': {}}
+    )
+    assert text == build_deficit_aware_fertilizer_list(
+        sample_fertilizers, deficits_full, {'water': {}, 'soil': {'k_ppm': 950}}
+    )
+
+
 def test_enforce_hard_constraints_keeps_kcl_when_cl_low(sample_fertilizers, deficits_full):
     """Test that KCl is kept when water Cl- < 2 meq/L."""
     profile = {
@@ -252,7 +299,7 @@ def test_enforce_hard_constraints_keeps_kcl_when_cl_low(sample_fertilizers, defi
     )
     
     # KCl should be KEPT because Cl- < 2 meq/L and K2O has deficit
-    fert_ids = [f['id'] for f in result['fertilizers']]
+    fert_ids = {f['id'] for f in result['fertilizers']}
     assert 'potassium_chloride' in fert_ids, "KCl should be kept when Cl- < 2 meq/L"
 
 
@@ -292,6 +339,7 @@ def test_normalize_stage_mapping():
     assert normalize_stage('vegetativo') == 'vegetative'
     assert normalize_stage('floración') == 'flowering'
     assert normalize_stage('fructificación') == 'fruiting'
+    assert normalize_stage('Floracio\u0301n ') == 'flowering'  # decomposed accent
     assert normalize_stage('unknown') == 'default'
     assert normalize_stage('') == 'default'
 
@@ -310,22 +358,22 @@ def test_adjust_deficits_for_acid_nitrogen():
         'water_volume_m3_ha': 5000  # 5000 m³/ha
     }
     
-    result = adjust_deficits_for_acid_nitrogen(deficits, acid_data)
+    adjusted, _ = adjust_deficits_for_acid_nitrogen(deficits, acid_data)
     
     # N from HNO3: 0.5 mL/m³ * 5000 m³ * 0.196 g N/mL / 1000 = 0.49 kg N
     # So N deficit should be reduced by ~0.49 kg
-    assert result['N'] < deficits['N'], "N deficit should be reduced by acid contribution"
-    assert result['P2O5'] == deficits['P2O5'], "P2O5 should be unchanged"
-    assert result['K2O'] == deficits['K2O'], "K2O should be unchanged"
+    assert adjusted['N'] < deficits['N'], "N deficit should be reduced by acid contribution"
+    assert adjusted['P2O5'] == deficits['P2O5'], "P2O5 should be unchanged"
+    assert adjusted['K2O'] == deficits['K2O'], "K2O should be unchanged"
 
 
 def test_adjust_deficits_no_acid():
     """Test that deficits are unchanged when no acid data."""
     deficits = {'N': 100, 'P2O5': 50}
     
-    result = adjust_deficits_for_acid_nitrogen(deficits, None)
+    adjusted, _ = adjust_deficits_for_acid_nitrogen(deficits, None)
     
-    assert result == deficits, "Deficits should be unchanged when no acid data"
+    assert adjusted == deficits, "Deficits should be unchanged when no acid data"
 
 
 def test_adjust_deficits_non_nitric_acid():
@@ -338,9 +386,20 @@ def test_adjust_deficits_non_nitric_acid():
         'water_volume_m3_ha': 5000
     }
     
-    result = adjust_deficits_for_acid_nitrogen(deficits, acid_data)
+    adjusted, _ = adjust_deficits_for_acid_nitrogen(deficits, acid_data)
+    
+    assert adjusted['N'] == deficits['N'], "N should be unchanged for non-nitric acid"
+
+
+def test_adjust_deficits_returns_copy_without_nitric_acid():
+    """The adjusted deficits never alias the caller's dict."""
+    deficits = {'N': 100, 'P2O5': 50}
+    
+    adjusted, n_from_acid = adjust_deficits_for_acid_nitrogen(deficits, None)
+    adjusted['N'] = 0
     
-    assert result['N'] == deficits['N'], "N should be unchanged for non-nitric acid"
+    assert n_from_acid == 0
+    assert deficits == {'N': 100, 'P2O5': 50}
 
 
 # =============================================================================
@@ -357,148 +416,107 @@ def test_is_fertilizer_in_set():
     # Negative cases
     assert not is_fertilizer_in_set('urea', 'Urea', K_CENTERED_FERTILIZERS)
     assert not is_fertilizer_in_set('map', 'MAP', CHLORIDE_FERTILIZERS)
+    assert not is_fertilizer_in_set('urea', 'Urea', frozenset())
+
+
+def test_fertilizer_category_mask_matches_set_membership():
+    """Category bitmask agrees with is_fertilizer_in_set for every set."""
+    kcl = fertilizer_category_mask('potassium_chloride', 'KCl')
+    assert kcl & K_CENTERED_BIT
+    assert kcl & CHLORIDE_BIT
+    assert not kcl & SULFATE_BIT
+    
+    mgso4 = fertilizer_category_mask('magnesium_sulfate', 'MgSO4')
+    assert mgso4 & MG_CENTERED_BIT
+    assert mgso4 & SULFATE_BIT
+    
+    assert fertilizer_category_mask('urea', 'Urea') == 0
 
 
 # =============================================================================
 # Integration test placeholder
 # =============================================================================
 
-def test_optimize_with_ai_respects_deficit_zero():
+def _stub_ai_response(profiles):
+    """Build a MagicMock OpenAI client whose completion returns ``profiles`` as JSON."""
+    client = MagicMock()
+    client.chat.completions.create.return_value.choices = [
+        MagicMock(message=MagicMock(content=json.dumps(profiles)))
+    ]
+    return client
+
+
+def test_optimize_with_ai_respects_deficit_zero(sample_fertilizers, deficits_with_zero_k2o):
     """
-    Integration test: optimize_with_ai should not recommend K-centered 
-    fertilizers when K2O deficit = 0.
-    
-    This test requires mocking the OpenAI API call.
+    optimize_with_ai should strip K-centered fertilizers proposed by the model
+    when K2O deficit = 0 (OpenAI call stubbed).
     """
-    # This would require mocking openai_client.chat.completions.create
-    # For now, we test the post-processing functions above
-    pass
+    proposal = {
+        'fertilizers': [
+            {'id': 'potassium_chloride', 'name': 'Cloruro de Potasio (KCl)', 'dose_kg_ha': 50, 'dose_per_application': 50},
+            {'id': 'potassium_nitrate', 'name': 'Nitrato de Potasio (KNO3)', 'dose_kg_ha': 80, 'dose_per_application': 80},
+            {'id': 'map', 'name': 'Fosfato Monoamónico (MAP)', 'dose_kg_ha': 80, 'dose_per_application': 80},
+            {'id': 'urea', 'name': 'Urea', 'dose_kg_ha': 150, 'dose_per_application': 150},
+        ],
+        'coverage': {'N': 100, 'P2O5': 98, 'K2O': 0, 'Ca': 0, 'Mg': 0, 'S': 0},
+        'notes': '',
+    }
+    client = _stub_ai_response({key: proposal for key in ('economic', 'balanced', 'complete')})
+
+    with patch('app.services.fertiirrigation_ai_optimizer.openai_client', client):
+        result = optimize_with_ai(
+            deficits_with_zero_k2o, {}, sample_fertilizers, 'Tomate', 'Vegetativo'
+        )
+
+    client.chat.completions.create.assert_called_once()
+    assert result['profiles'] is not None
+    for key in ('economic', 'balanced', 'complete'):
+        profile = result['profiles'][key]
+        fert_ids = [f['id'] for f in profile['fertilizers']]
+        assert 'potassium_chloride' not in fert_ids
+        assert 'potassium_nitrate' not in fert_ids
+        assert 'map' in fert_ids
 
 
 # =============================================================================
 # Test 7: S CAP TESTS - Critical for low S deficit scenarios
 # =============================================================================
 
-@pytest.fixture
+# Read-only catalogs shared across the session; entries are mapping proxies so
+# an accidental in-place edit fails loudly instead of leaking between tests.
+_SULFATE_CATALOG = (
+    {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'n_pct': 21, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 24},
+    {'id': 'urea', 'name': 'Urea', 'n_pct': 46, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
+    {'id': 'map', 'name': 'Fosfato Monoamónico (MAP)', 'n_pct': 12, 'p2o5_pct': 61, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
+    {'id': 'calcium_nitrate', 'name': 'Nitrato de Calcio', 'n_pct': 15.5, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 19, 'mg_pct': 0, 's_pct': 0},
+    {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio', 'n_pct': 0, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 9.8, 's_pct': 13},
+)
+
+_ONLY_SULFATES_CATALOG = (
+    {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'n_pct': 21, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 24},
+    # MAP removed - it has 12% N and can be used as S-free N source
+    # Adding a P source with very low N (< 5%) that won't be picked as N source
+    {'id': 'tsp', 'name': 'Triple Superfosfato (TSP)', 'n_pct': 0, 'p2o5_pct': 46, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
+)
+
+
+@pytest.fixture(scope="session")
 def deficits_low_s():
     """Deficits with low S deficit - triggers S cap behavior."""
-    return {
-        'N': 4.8,
-        'P2O5': 14.6,
-        'K2O': 0,
-        'Ca': 0,
-        'Mg': 0,
-        'S': 1.5  # Very low S deficit - sulfates should be capped
-    }
+    # Very low S deficit - sulfates should be capped
+    return MappingProxyType({**_ZERO_MACRO, 'N': 4.8, 'P2O5': 14.6, 'S': 1.5})
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def fertilizers_with_sulfates():
     """Fertilizer catalog including sulfates and nitratos."""
-    return [
-        {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'n_pct': 21, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 24},
-        {'id': 'urea', 'name': 'Urea', 'n_pct': 46, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
-        {'id': 'map', 'name': 'Fosfato Monoamónico (MAP)', 'n_pct': 12, 'p2o5_pct': 61, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
-        {'id': 'calcium_nitrate', 'name': 'Nitrato de Calcio', 'n_pct': 15.5, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 19, 'mg_pct': 0, 's_pct': 0},
-        {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio', 'n_pct': 0, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 9.8, 's_pct': 13},
-    ]
+    return [MappingProxyType(fert) for fert in _SULFATE_CATALOG]
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def fertilizers_only_sulfates():
     """Fertilizer catalog with ONLY sulfate sources for N (no S-free N sources >5%)."""
-    return [
-        {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'n_pct': 21, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 24},
-        # MAP removed - it has 12% N and can be used as S-free N source
-        # Adding a P source with very low N (< 5%) that won't be picked as N source
-        {'id': 'tsp', 'name': 'Triple Superfosfato (TSP)', 'n_pct': 0, 'p2o5_pct': 46, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
-    ]
-
-
-def test_s_cap_limits_sulfur_to_110_percent(fertilizers_with_sulfates, deficits_low_s):
-    """
-    Test 1: When S deficit is low (1.5 kg/ha), the S cap should limit total S 
-    to ≤110% of deficit (1.65 kg/ha max).
-    
-    If ammonium sulfate 15 kg/ha is selected for N, it provides 3.6 kg S (240% coverage).
-    The cap should reduce it to ~6.9 kg/ha to stay within 110%.
-    """
-    profile = {
-        'fertilizers': [
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 15},
-            {'id': 'map', 'name': 'Fosfato Monoamónico (MAP)', 'dose_kg_ha': 24},
-        ]
-    }
-    
-    result = cap_fertilizers_by_nutrient(
-        profile,
-        deficits_low_s,
-        fertilizers_with_sulfates,
-        max_coverage_pct=110,
-        nutrient='S',
-        num_applications=10
-    )
-    
-    # Calculate total S after cap
-    total_s = 0
-    for fert in result['fertilizers']:
-        if fert['id'] == 'ammonium_sulfate':
-            total_s += fert['dose_kg_ha'] * 0.24  # 24% S
-    
-    max_allowed_s = deficits_low_s['S'] * 1.1  # 1.5 * 1.1 = 1.65 kg/ha
-    
-    assert total_s <= max_allowed_s + 0.1, f"S should be capped to ≤{max_allowed_s:.2f} kg/ha, got {total_s:.2f} kg/ha"
-    assert 'cap_applied' in result, "Cap should be recorded in result"
-    assert result['cap_applied']['nutrient'] == 'S'
-
-
-def test_s_cap_respects_n_coverage_minimum(fertilizers_with_sulfates, deficits_low_s):
-    """
-    Test 2: When S cap would reduce N below 85% (min_coverage_for_critical), 
-    the system should either:
-    a) Add S-free N sources to compensate, OR
-    b) Limit the reduction to preserve N coverage, OR
-    c) Issue a warning that S cap couldn't be fully achieved
-    
-    This test verifies N is protected even when S needs capping.
-    """
-    profile = {
-        'fertilizers': [
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 15},
-        ]
-    }
-    
-    result = cap_fertilizers_by_nutrient(
-        profile,
-        deficits_low_s,
-        fertilizers_with_sulfates,
-        max_coverage_pct=110,
-        nutrient='S',
-        min_coverage_for_critical=85
-    )
-    
-    # Find N sources in result
-    total_n = 0
-    for fert in result['fertilizers']:
-        fert_id = fert.get('id', '')
-        dose = fert.get('dose_kg_ha', 0)
-        if fert_id == 'ammonium_sulfate':
-            total_n += dose * 0.21  # 21% N
-        elif fert_id == 'urea':
-            total_n += dose * 0.46  # 46% N
-        elif fert_id == 'calcium_nitrate':
-            total_n += dose * 0.155  # 15.5% N
-    
-    n_deficit = deficits_low_s['N']  # 4.8 kg/ha
-    n_coverage = (total_n / n_deficit * 100) if n_deficit > 0 else 100
-    
-    # Either: N is preserved above 85%, OR a warning was issued
-    if 'cap_warning' not in result:
-        assert n_coverage >= 85, f"N coverage should be ≥85%, got {n_coverage:.0f}%"
-    else:
-        # If warning exists, verify it's about N coverage
-        assert 'N coverage' in result['cap_warning'], "Should warn about N coverage"
-        # In this case, system tried its best to preserve N
+    return [MappingProxyType(fert) for fert in _ONLY_SULFATES_CATALOG]
 
 
 def test_normalize_coverage_applies_s_cap_for_low_deficit(fertilizers_with_sulfates, deficits_low_s):
@@ -557,69 +575,7 @@ def test_low_s_deficit_threshold():
     assert LOW_S_DEFICIT_THRESHOLD == 5.0, "LOW_S_DEFICIT_THRESHOLD should be 5.0 kg/ha"
 
 
-def test_s_cap_preserves_n_coverage_with_compensation(fertilizers_with_sulfates, deficits_low_s):
-    """
-    Test that when S cap reduces ammonium sulfate (which provides N), 
-    the system compensates by PROACTIVELY adding S-free N sources (urea) FIRST.
-    
-    This ensures both:
-    1. S coverage stays ≤ 110%
-    2. N coverage doesn't drop below 85%
-    """
-    # Setup: ammonium sulfate as main N source providing excess S
-    profile = {
-        'fertilizers': [
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 20},  # 4.2 kg N, 4.8 kg S
-        ]
-    }
-    
-    # Deficits: need N, but S deficit is very low
-    deficits = {
-        'N': 4.8,  # Need 4.8 kg N
-        'P2O5': 0,
-        'K2O': 0,
-        'Ca': 0,
-        'Mg': 0,
-        'S': 1.5  # Very low S deficit - will trigger cap
-    }
-    
-    result = cap_fertilizers_by_nutrient(
-        profile,
-        deficits,
-        fertilizers_with_sulfates,  # Includes urea as S-free N source
-        max_coverage_pct=110,
-        nutrient='S',
-        num_applications=10,
-        min_coverage_for_critical=85
-    )
-    
-    # Calculate total N and S after cap
-    total_n = 0
-    total_s = 0
-    for fert in result['fertilizers']:
-        fert_id = fert.get('id', '')
-        dose = fert.get('dose_kg_ha', 0)
-        if fert_id == 'ammonium_sulfate':
-            total_n += dose * 0.21  # 21% N
-            total_s += dose * 0.24  # 24% S
-        elif fert_id == 'urea':
-            total_n += dose * 0.46  # 46% N
-        elif fert_id == 'calcium_nitrate':
-            total_n += dose * 0.155  # 15.5% N
-    
-    # S should be capped to ≤ 110% of deficit (1.65 kg)
-    max_s_allowed = deficits['S'] * 1.15  # Allow 5% tolerance = 1.725 kg
-    
-    # If no cap_error, S should be within limits
-    if 'cap_error' not in result:
-        assert total_s <= max_s_allowed, f"S should be ≤{max_s_allowed:.2f} kg, got {total_s:.2f} kg"
-    
-    # N coverage should be preserved if no error/warning
-    min_n_needed = deficits['N'] * 0.85  # 4.08 kg
-    if 'cap_warning' not in result and 'cap_error' not in result:
-        assert total_n >= min_n_needed - 0.1, f"N should be ≥{min_n_needed:.2f} kg, got {total_n:.2f} kg"
-
-
+@pytest.mark.regression
 def test_s_cap_fails_gracefully_when_no_s_free_n_source(fertilizers_only_sulfates, deficits_low_s):
     """
     Test that when ammonium sulfate is the ONLY N source and S cap is applied,
@@ -632,14 +588,7 @@ def test_s_cap_fails_gracefully_when_no_s_free_n_source(fertilizers_only_sulfate
         ]
     }
     
-    deficits = {
-        'N': 4.8,
-        'P2O5': 14.6,
-        'K2O': 0,
-        'Ca': 0,
-        'Mg': 0,
-        'S': 1.5
-    }
+    deficits = {**_ZERO_MACRO, 'N': 4.8, 'P2O5': 14.6, 'S': 1.5}
     
     # STRICT: Must raise SulfurCapError when S cannot be capped
     with pytest.raises(SulfurCapError) as exc_info:
@@ -653,297 +602,162 @@ def test_s_cap_fails_gracefully_when_no_s_free_n_source(fertilizers_only_sulfate
             min_coverage_for_critical=85
         )
     
-    # Verify error message mentions S coverage exceeds threshold
-    assert "exceeds" in str(exc_info.value).lower() or "110%" in str(exc_info.value)
+    # Verify the error reports S coverage above the threshold
+    assert exc_info.value.threshold_pct == 110
+    assert exc_info.value.coverage_pct > exc_info.value.threshold_pct
+
+
+# Nutrient fraction per kg of product, derived from the S-cap catalogs so the
+# percentages are stated only once
+_PCT_KEYS = {n: n.lower() + '_pct' for n in NUTRIENTS}
+FERT_PCT = {
+    fert['id']: {n: fert[key] / 100 for n, key in _PCT_KEYS.items() if fert.get(key)}
+    for fert in _SULFATE_CATALOG + _ONLY_SULFATES_CATALOG
+}
+
+# Same table as a dense (fertilizer x nutrient) matrix, built once at import
+FERT_IDS = tuple(FERT_PCT)
+FERT_INDEX = {fert_id: i for i, fert_id in enumerate(FERT_IDS)}
+PCT = tuple(
+    tuple(FERT_PCT[fert_id].get(n, 0.0) for n in NUTRIENTS)
+    for fert_id in FERT_IDS
+)
 
 
-def test_s_cap_achieves_target_when_alternatives_exist(fertilizers_with_sulfates):
+def _totals(result):
     """
-    REGRESSION TEST: When S-free N alternatives exist (urea), the system must:
-    1. Add urea to compensate N
-    2. Reduce ammonium sulfate to cap S
-    3. Final S coverage must be ≤ 115% (110% + 5% tolerance)
+    Single pass over a capped profile.
     
-    This is the critical test that ensures S is actually capped when alternatives exist.
+    Returns (totals, doses_by_id): kg/ha of each nutrient supplied and the
+    dose of each fertilizer id in the result.
     """
-    profile = {
-        'fertilizers': [
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 20},  # Provides 4.8 kg S
-        ]
-    }
-    
-    deficits = {
-        'N': 4.8,  # Need 4.8 kg N  
-        'P2O5': 0,
-        'K2O': 0,
-        'Ca': 0,
-        'Mg': 0,
-        'S': 1.5  # Only need 1.5 kg S, but getting 4.8 kg (320% coverage!)
-    }
-    
-    result = cap_fertilizers_by_nutrient(
-        profile,
-        deficits,
-        fertilizers_with_sulfates,  # Has urea (46% N, 0% S)
-        max_coverage_pct=110,
-        nutrient='S',
-        num_applications=10,
-        min_coverage_for_critical=85
-    )
-    
-    # Calculate final S
-    total_s = 0
+    out = [0.0] * len(NUTRIENTS)
+    doses_by_id = {}
     for fert in result['fertilizers']:
         fert_id = fert.get('id', '')
         dose = fert.get('dose_kg_ha', 0)
-        if fert_id == 'ammonium_sulfate':
-            total_s += dose * 0.24  # 24% S
-    
-    # S MUST be capped to ≤ 115% (with 5% tolerance on 110%)
-    max_s_allowed = deficits['S'] * 1.15  # 1.725 kg
-    s_coverage = (total_s / deficits['S'] * 100)
-    
-    # If no error, S must be capped
-    if 'cap_error' not in result:
-        assert total_s <= max_s_allowed, \
-            f"S must be ≤{max_s_allowed:.2f} kg ({s_coverage:.0f}% coverage), got {total_s:.2f} kg"
-    
-    # Verify urea was added
-    urea_added = any(f.get('id') == 'urea' for f in result['fertilizers'])
-    am_sulf_reduced = any(
-        f.get('id') == 'ammonium_sulfate' and f.get('dose_kg_ha', 0) < 20 
-        for f in result['fertilizers']
-    )
-    
-    # Either S was capped by reducing + adding alternatives, or error was raised
-    if 'cap_error' not in result:
-        assert urea_added or am_sulf_reduced, \
-            "Should either add urea or reduce ammonium sulfate to cap S"
+        doses_by_id[fert_id] = dose
+        i = FERT_INDEX.get(fert_id)
+        if i is None:
+            continue
+        # Only the rows of fertilizers present in the result are visited
+        for j, pct in enumerate(PCT[i]):
+            if pct:
+                out[j] += dose * pct
+    return dict(zip(NUTRIENTS, out)), doses_by_id
 
 
-def test_s_cap_increases_existing_urea_when_present(fertilizers_with_sulfates):
-    """
-    REGRESSION TEST: When urea is ALREADY in the profile, the system must:
-    1. Increase the existing urea dose to compensate N (not add a new entry)
-    2. Reduce ammonium sulfate to cap S
-    3. Final S coverage must be ≤ 115%
-    
-    This tests the "urea already present" case.
-    """
-    profile = {
+_CATALOG_NAMES = {fert['id']: fert['name'] for fert in _SULFATE_CATALOG}
+
+
+def _profile(lines):
+    """Fresh profile dict from (fertilizer_id, dose_kg_ha) lines; names come from the catalog."""
+    return {
         'fertilizers': [
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 20},  # 4.2 kg N, 4.8 kg S
-            {'id': 'urea', 'name': 'Urea', 'dose_kg_ha': 2},  # 0.92 kg N (existing, can be increased)
+            {'id': fert_id, 'name': _CATALOG_NAMES[fert_id], 'dose_kg_ha': dose}
+            for fert_id, dose in lines
         ]
     }
-    
-    deficits = {
-        'N': 5.0,  # Need 5 kg N
-        'P2O5': 0,
-        'K2O': 0,
-        'Ca': 0,
-        'Mg': 0,
-        'S': 1.5  # Very low S deficit - triggers cap
-    }
-    
-    result = cap_fertilizers_by_nutrient(
-        profile,
-        deficits,
-        fertilizers_with_sulfates,  # Has urea (46% N, 0% S)
-        max_coverage_pct=110,
-        nutrient='S',
-        num_applications=10,
-        min_coverage_for_critical=85
+
+
+def _le(value, bound, *, abs_tol=0.0, rel_tol=1e-6):
+    """value <= bound, allowing abs_tol or a relative float tolerance."""
+    return value <= bound or value <= bound + max(abs_tol, abs(bound) * rel_tol)
+
+
+def _ge(value, bound, *, abs_tol=0.0, rel_tol=1e-6):
+    """value >= bound, allowing abs_tol or a relative float tolerance."""
+    return value >= bound or value >= bound - max(abs_tol, abs(bound) * rel_tol)
+
+
+S_CAP_CASES_PATH = os.path.join(os.path.dirname(__file__), 'data', 's_cap_cases.tsv')
+
+
+def _pairs(field, cast=float):
+    """Parse 'id:value,id:value' into a tuple of (id, value) pairs."""
+    return tuple(
+        (fert_id, cast(value))
+        for fert_id, value in (item.split(':') for item in field.split(',') if item)
     )
-    
-    # Calculate final S and N
-    total_s = 0
-    total_n = 0
-    urea_dose = 0
-    for fert in result['fertilizers']:
-        fert_id = fert.get('id', '')
-        dose = fert.get('dose_kg_ha', 0)
-        if fert_id == 'ammonium_sulfate':
-            total_s += dose * 0.24  # 24% S
-            total_n += dose * 0.21  # 21% N
-        elif fert_id == 'urea':
-            total_n += dose * 0.46  # 46% N
-            urea_dose = dose
-    
-    # S MUST be capped to ≤ 115%
-    max_s_allowed = deficits['S'] * 1.15  # 1.725 kg
-    
-    # If no error, S must be capped
-    if 'cap_error' not in result:
-        assert total_s <= max_s_allowed, \
-            f"S must be ≤{max_s_allowed:.2f} kg, got {total_s:.2f} kg"
-    
-    # Urea should have been increased (was 2, should be higher now)
-    assert urea_dose >= 2, f"Urea should be at least 2 kg/ha, got {urea_dose} kg/ha"
-    
-    # N coverage should be preserved
-    min_n_needed = deficits['N'] * 0.85  # 4.25 kg
-    if 'cap_warning' not in result and 'cap_error' not in result:
-        assert total_n >= min_n_needed - 0.1, f"N should be ≥{min_n_needed:.2f} kg, got {total_n:.2f} kg"
 
 
-def test_s_cap_zero_deficit_forces_zero_sulfates(fertilizers_with_sulfates):
+def _load_s_cap_cases(path=S_CAP_CASES_PATH):
     """
-    REGRESSION TEST: When S deficit = 0, no sulfur should be added.
-    The cap must force sulfate doses to 0 or raise SulfurCapError if N can't be maintained.
+    Read the S-cap case table: one row per case with profile lines, deficits
+    and expected bounds (kg/ha; empty = not checked) with their absolute
+    slack in S_tol / N_tol (kg/ha; empty = float tolerance only). Profile lines are
+    immutable, so every run gets its own profile dict from _profile().
+    """
+    cases = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            flags = set(row['flags'].split(',')) - {''}
+            marks = [pytest.mark.regression] if 'regression' in flags else []
+            flags.discard('regression')
+            expected = {
+                'S_max': float(row['S_max']) if row['S_max'] else None,
+                'S_tol': float(row['S_tol'] or 0),
+                'N_min': float(row['N_min']) if row['N_min'] else None,
+                'N_tol': float(row['N_tol'] or 0),
+                'min_doses': dict(_pairs(row['min_doses'])),
+            }
+            expected.update(dict.fromkeys(flags, True))
+            deficits = {n: float(row[n]) for n in NUTRIENTS}
+            cases.append(pytest.param(_pairs(row['profile']), deficits, expected, id=row['id'], marks=marks))
+    return cases
+
+
+S_CAP_CASES = _load_s_cap_cases()
+
+
+@pytest.mark.parametrize('lines, deficits, expected', S_CAP_CASES)
+def test_s_cap(fertilizers_with_sulfates, lines, deficits, expected):
+    """
+    S cap keeps total S within the allowed kg/ha and preserves N coverage
+    (unless a cap_warning about N coverage is issued).
     """
-    profile = {
-        'fertilizers': [
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 10},  # Provides S but no S needed
-        ]
-    }
-    
-    deficits = {
-        'N': 3.0,  # Need N
-        'P2O5': 0,
-        'K2O': 0,
-        'Ca': 0,
-        'Mg': 0,
-        'S': 0  # NO S deficit - no S should be added
-    }
-    
-    # With S deficit = 0, either:
-    # 1. Sulfates reduced to 0 and S-free N added, OR
-    # 2. SulfurCapError raised if no S-free alternatives
     try:
         result = cap_fertilizers_by_nutrient(
-            profile,
+            _profile(lines),
             deficits,
-            fertilizers_with_sulfates,  # Has urea as S-free alternative
+            fertilizers_with_sulfates,
             max_coverage_pct=110,
             nutrient='S',
             num_applications=10,
             min_coverage_for_critical=85
         )
-        
-        # If no exception, S must be 0
-        total_s = 0
-        for fert in result['fertilizers']:
-            fert_id = fert.get('id', '')
-            dose = fert.get('dose_kg_ha', 0)
-            if fert_id == 'ammonium_sulfate':
-                total_s += dose * 0.24
-            elif fert_id == 'magnesium_sulfate':
-                total_s += dose * 0.13
-        
-        # With 0 deficit, max allowed is 0 - S must be 0 (or very close)
-        assert total_s <= 0.001, f"S must be ≈0 when deficit=0, got {total_s:.4f} kg"
-        
     except SulfurCapError:
-        # This is also acceptable - means no S-free alternative could maintain N
-        pass
-
-
-def test_s_cap_multiple_sulfates(fertilizers_with_sulfates):
-    """
-    REGRESSION TEST: With multiple sulfate fertilizers (ammonium sulfate + magnesium sulfate),
-    the cap must still enforce ≤110% and preserve N ≥85%.
-    """
-    profile = {
-        'fertilizers': [
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 10},  # Provides 2.4 kg S
-            {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio', 'dose_kg_ha': 10},  # Provides 1.3 kg S
-            # Total S = 3.7 kg
-        ]
-    }
-    
-    deficits = {
-        'N': 3.0,  # Need N
-        'P2O5': 0,
-        'K2O': 0,
-        'Ca': 0,
-        'Mg': 1.0,  # Need Mg too
-        'S': 1.0  # Low S deficit - max allowed = 1.1 kg (110%)
-    }
-    
-    result = cap_fertilizers_by_nutrient(
-        profile,
-        deficits,
-        fertilizers_with_sulfates,
-        max_coverage_pct=110,
-        nutrient='S',
-        num_applications=10,
-        min_coverage_for_critical=85
-    )
-    
-    # Calculate totals after cap
-    total_s = 0
-    total_n = 0
-    for fert in result['fertilizers']:
-        fert_id = fert.get('id', '')
-        dose = fert.get('dose_kg_ha', 0)
-        if fert_id == 'ammonium_sulfate':
-            total_s += dose * 0.24
-            total_n += dose * 0.21
-        elif fert_id == 'magnesium_sulfate':
-            total_s += dose * 0.13
-        elif fert_id == 'urea':
-            total_n += dose * 0.46
-    
-    max_s_allowed = deficits['S'] * 1.10  # 1.1 kg
-    s_coverage_pct = (total_s / deficits['S']) * 100 if deficits['S'] > 0 else 0
-    n_coverage_pct = (total_n / deficits['N']) * 100 if deficits['N'] > 0 else 100
-    
-    # STRICT: S coverage must be ≤ 110%
-    assert s_coverage_pct <= 110 + 0.0001, f"S coverage must be ≤110%, got {s_coverage_pct:.4f}%"
-    
-    # N must be preserved ≥ 85% (or warning issued)
-    if 'cap_warning' not in result and 'cap_error' not in result:
-        assert n_coverage_pct >= 85, f"N coverage must be ≥85%, got {n_coverage_pct:.1f}%"
-
-
-def test_s_cap_strict_with_very_low_deficit(fertilizers_with_sulfates):
-    """
-    REGRESSION TEST: With S deficit ≤ 1 kg, the cap must still enforce ≤110%.
-    The tolerance must be relative (0.1% of allowed S) not absolute to avoid
-    allowing extra percentage points with small deficits.
-    """
-    profile = {
-        'fertilizers': [
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 5},  # Provides 1.2 kg S (240% of 0.5 kg deficit)
-        ]
-    }
-    
-    deficits = {
-        'N': 3.0,  # Reasonable N deficit
-        'P2O5': 0,
-        'K2O': 0,
-        'Ca': 0,
-        'Mg': 0,
-        'S': 0.5  # Very low S deficit - max allowed = 0.55 kg (110%)
-    }
-    
-    result = cap_fertilizers_by_nutrient(
-        profile,
-        deficits,
-        fertilizers_with_sulfates,
-        max_coverage_pct=110,
-        nutrient='S',
-        num_applications=10,
-        min_coverage_for_critical=85
-    )
-    
-    # Calculate total S after cap
-    total_s = 0
-    for fert in result['fertilizers']:
-        fert_id = fert.get('id', '')
-        dose = fert.get('dose_kg_ha', 0)
-        if fert_id == 'ammonium_sulfate':
-            total_s += dose * 0.24
-    
-    max_s_allowed = deficits['S'] * 1.10  # 0.55 kg - strict 110%
-    s_coverage_pct = (total_s / deficits['S']) * 100 if deficits['S'] > 0 else 0
-    
-    # STRICT: S coverage must be ≤ 110% even with very small deficit
-    # Allow only minimal floating-point tolerance (0.0001%)
-    tolerance_pct = 0.0001
-    assert s_coverage_pct <= 110 + tolerance_pct, \
-        f"S coverage must be ≤110.0001%, got {s_coverage_pct:.4f}%"
+        if expected.get('may_raise'):
+            return
+        raise
+    
+    totals, doses_by_id = _totals(result)
+    s_max = expected['S_max']
+    n_min = expected['N_min']
+    
+    if s_max is not None:
+        assert _le(totals['S'], s_max, abs_tol=expected['S_tol']), \
+            f"S should be ≤{s_max:.4f} kg/ha, got {totals['S']:.4f} kg/ha"
+    
+    if n_min is not None:
+        if 'cap_warning' in result:
+            assert 'N coverage' in result['cap_warning'], "Should warn about N coverage"
+        else:
+            assert _ge(totals['N'], n_min, abs_tol=expected['N_tol']), \
+                f"N should be ≥{n_min:.2f} kg/ha, got {totals['N']:.2f} kg/ha"
+    
+    if expected.get('cap_applied'):
+        assert result['cap_applied']['nutrient'] == 'S'
+    
+    for fert_id, min_dose in expected.get('min_doses', {}).items():
+        assert doses_by_id.get(fert_id, 0) >= min_dose, \
+            f"{fert_id} should be at least {min_dose} kg/ha, got {doses_by_id.get(fert_id, 0)} kg/ha"
+    
+    if expected.get('reduce_or_add_urea'):
+        original_as = dict(lines)['ammonium_sulfate']
+        reduced = doses_by_id.get('ammonium_sulfate', original_as) < original_as
+        assert 'urea' in doses_by_id or reduced, \
+            "Should either add urea or reduce ammonium sulfate to cap S"
 
 
 if __name__ == '__main__':
@@ -3,15 +3,67 @@ Test suite for FertiIrrigation Manual Mode - 1000 Scenarios
 Tests the optimization endpoint when users select their own fertilizers via HTTP API.
 """
 
+import asyncio
+import importlib.util
 import random
 import json
 import sys
 import os
+import time
 import httpx
+from collections import Counter, defaultdict
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, NamedTuple, Optional
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json fallback
+    orjson = None
+
+
+def json_loads(data: bytes) -> Any:
+    """Decode a JSON body, via orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def issue_key(message: str) -> str:
+    """Histogram key for an error/warning: the text before the first ':'."""
+    head, sep, _ = message.partition(":")
+    return head if sep else message[:50]
+
+
+def json_dumps(obj: Any) -> bytes:
+    """Encode to UTF-8 JSON bytes, via orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+JSON_HEADERS = {"content-type": "application/json"}
 
 BASE_URL = "http://localhost:8000"
+OPTIMIZE_PATH = "/api/fertiirrigation/optimize"
+
+# Scenarios in flight at once, and the request-rate ceiling shared by them
+MAX_CONCURRENCY = 32
+MAX_REQUESTS_PER_SECOND = 20.0
+
+# Auth headers are reused across runs until they are this old (seconds).
+# The cache lives in the per-user cache dir, never in shared /tmp.
+TOKEN_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "agridoser"
+)
+TOKEN_CACHE_PATH = os.path.join(TOKEN_CACHE_DIR, "test_token.json")
+TOKEN_CACHE_TTL = 30 * 60
+
+# Retries of a scenario answered with HTTP 429 before it is recorded as failed
+MAX_RATE_LIMIT_RETRIES = 5
+
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]"); httpx
+# only negotiates it over TLS, so plain http:// stays on pooled HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
 
 FERTILIZER_SLUGS = [
     "urea_46_0_0",
@@ -74,76 +126,155 @@ SOIL_TYPES = ["Arenoso", "Franco", "Arcilloso", "Franco-arcilloso", "Franco-aren
 
 CURRENCIES = ["MXN", "USD", "EUR", "BRL", "PEN", "ARS", "CLP", "COP"]
 
+AREA_OPTIONS_HA = [0.5, 1, 2, 5, 10, 20, 50, 100]
+APPLICATION_OPTIONS = [5, 8, 10, 12, 15, 20]
+IRRIGATION_VOLUME_OPTIONS = [30, 50, 75, 100, 150, 200]
+
+DEFICIT_KEYS = ("n_kg_ha", "p2o5_kg_ha", "k2o_kg_ha", "ca_kg_ha", "mg_kg_ha", "s_kg_ha")
+
+# (low, high) kg/ha per DEFICIT_KEYS entry for each scenario type
+DEFICIT_RANGES = {
+    "low": ((10, 50), (5, 30), (10, 40), (5, 20), (2, 15), (2, 10)),
+    "medium": ((50, 150), (30, 80), (40, 120), (20, 60), (10, 30), (10, 25)),
+    "high": ((150, 300), (80, 150), (120, 250), (60, 120), (30, 60), (25, 50)),
+    "very_high": ((250, 400), (100, 200), (200, 400), (80, 150), (40, 80), (40, 80)),
+    "micro_only": ((0, 20), (0, 10), (0, 20), (0, 10), (0, 5), (0, 5)),
+}
+
+# "macro_balanced" scales one random N base by fixed ratios
+MACRO_BALANCED_RATIOS = (1.0, 0.5, 1.2, 0.4, 0.15, 0.12)
+
+DEFICIT_SCENARIOS = tuple(DEFICIT_RANGES) + ("macro_balanced",)
+
+
+class TokenBucket:
+    """
+    Async token bucket: up to `rate` requests per second, bursts of `capacity`.
+    
+    Requests fire as soon as a token is available; a 429 from the server
+    pauses every caller via backoff() instead of sleeping a fixed interval.
+    """
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def backoff(self, delay: float) -> None:
+        """Hold every acquire() for `delay` seconds and drain the burst."""
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.tokens = 0
+
+
+class ReAuthenticator:
+    """
+    Logs in again, once per run, when the server rejects the token with 401.
+    
+    A restarted server or revoked token would otherwise fail every remaining
+    scenario. The first caller drops the cached token and logs in; callers
+    that hit 401 meanwhile wait on the lock and share the outcome. Returns
+    True when the client now carries fresh auth headers.
+    """
+    
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.lock = asyncio.Lock()
+        self.refreshed: Optional[bool] = None
+    
+    async def __call__(self) -> bool:
+        async with self.lock:
+            if self.refreshed is None:
+                print("Auth token rejected (HTTP 401), logging in again...")
+                drop_cached_auth()
+                auth_headers = await login_and_cache(self.client)
+                if auth_headers:
+                    self.client.headers.update(auth_headers)
+                self.refreshed = bool(auth_headers)
+            return self.refreshed
+
+
+def body_excerpt(response: httpx.Response, limit: int = 200) -> str:
+    """First `limit` bytes of the body, decoded without charset detection."""
+    return response.content[:limit].decode("utf-8", errors="replace")
+
+
+def retry_after_seconds(response: httpx.Response, attempt: int) -> float:
+    """Server's Retry-After when it is numeric, else exponential backoff."""
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return min(0.5 * 2 ** attempt, 10.0)
+
+
 def generate_random_deficit():
     """Generate random nutrient deficits based on realistic agronomic scenarios."""
-    scenario_type = random.choice(["low", "medium", "high", "very_high", "micro_only", "macro_balanced"])
-    
-    if scenario_type == "low":
-        return {
-            "n_kg_ha": random.uniform(10, 50),
-            "p2o5_kg_ha": random.uniform(5, 30),
-            "k2o_kg_ha": random.uniform(10, 40),
-            "ca_kg_ha": random.uniform(5, 20),
-            "mg_kg_ha": random.uniform(2, 15),
-            "s_kg_ha": random.uniform(2, 10),
-        }
-    elif scenario_type == "medium":
-        return {
-            "n_kg_ha": random.uniform(50, 150),
-            "p2o5_kg_ha": random.uniform(30, 80),
-            "k2o_kg_ha": random.uniform(40, 120),
-            "ca_kg_ha": random.uniform(20, 60),
-            "mg_kg_ha": random.uniform(10, 30),
-            "s_kg_ha": random.uniform(10, 25),
-        }
-    elif scenario_type == "high":
-        return {
-            "n_kg_ha": random.uniform(150, 300),
-            "p2o5_kg_ha": random.uniform(80, 150),
-            "k2o_kg_ha": random.uniform(120, 250),
-            "ca_kg_ha": random.uniform(60, 120),
-            "mg_kg_ha": random.uniform(30, 60),
-            "s_kg_ha": random.uniform(25, 50),
-        }
-    elif scenario_type == "very_high":
-        return {
-            "n_kg_ha": random.uniform(250, 400),
-            "p2o5_kg_ha": random.uniform(100, 200),
-            "k2o_kg_ha": random.uniform(200, 400),
-            "ca_kg_ha": random.uniform(80, 150),
-            "mg_kg_ha": random.uniform(40, 80),
-            "s_kg_ha": random.uniform(40, 80),
-        }
-    elif scenario_type == "micro_only":
-        return {
-            "n_kg_ha": random.uniform(0, 20),
-            "p2o5_kg_ha": random.uniform(0, 10),
-            "k2o_kg_ha": random.uniform(0, 20),
-            "ca_kg_ha": random.uniform(0, 10),
-            "mg_kg_ha": random.uniform(0, 5),
-            "s_kg_ha": random.uniform(0, 5),
-        }
-    else:
+    scenario_type = random.choice(DEFICIT_SCENARIOS)
+    
+    if scenario_type == "macro_balanced":
         base = random.uniform(80, 180)
-        return {
-            "n_kg_ha": base,
-            "p2o5_kg_ha": base * 0.5,
-            "k2o_kg_ha": base * 1.2,
-            "ca_kg_ha": base * 0.4,
-            "mg_kg_ha": base * 0.15,
-            "s_kg_ha": base * 0.12,
-        }
+        return {key: base * ratio for key, ratio in zip(DEFICIT_KEYS, MACRO_BALANCED_RATIOS)}
+    
+    uniform = random.uniform
+    return {key: uniform(low, high) for key, (low, high) in zip(DEFICIT_KEYS, DEFICIT_RANGES[scenario_type])}
+
+
+def generate_random_deficits(count: int) -> List[Dict[str, float]]:
+    """Pre-draw the deficits of `count` scenarios before any request is sent."""
+    return [generate_random_deficit() for _ in range(count)]
+
+# Upper bound (g/ha) of each micronutrient deficit; lower bound is 0
+MICRO_DEFICIT_MAX = (
+    ("fe_g_ha", 1500),
+    ("mn_g_ha", 800),
+    ("zn_g_ha", 600),
+    ("cu_g_ha", 200),
+    ("b_g_ha", 400),
+    ("mo_g_ha", 50),
+)
+
 
 def generate_random_micro_deficit():
     """Generate random micronutrient deficits."""
-    return {
-        "fe_g_ha": random.uniform(0, 1500),
-        "mn_g_ha": random.uniform(0, 800),
-        "zn_g_ha": random.uniform(0, 600),
-        "cu_g_ha": random.uniform(0, 200),
-        "b_g_ha": random.uniform(0, 400),
-        "mo_g_ha": random.uniform(0, 50),
-    }
+    rand = random.random
+    # uniform(0, high) is exactly high * random()
+    return {key: high * rand() for key, high in MICRO_DEFICIT_MAX}
+
+class ScenarioConfig(NamedTuple):
+    """Categorical settings of one scenario."""
+    area_ha: float
+    num_applications: int
+    currency: str
+    irrigation_volume: int
+    crop: str
+    stage: str
+    soil_type: str
+
+
+def generate_scenario_configs(count: int) -> List[ScenarioConfig]:
+    """Pre-draw the settings of `count` scenarios, one choices() call per column."""
+    columns = (
+        AREA_OPTIONS_HA, APPLICATION_OPTIONS, CURRENCIES, IRRIGATION_VOLUME_OPTIONS,
+        CROPS, GROWTH_STAGES, SOIL_TYPES
+    )
+    choices = random.choices
+    return list(map(ScenarioConfig, *(choices(options, k=count) for options in columns)))
 
 def select_random_fertilizers(min_count=3, max_count=12):
     """Select random fertilizers from the catalog."""
@@ -151,44 +282,96 @@ def select_random_fertilizers(min_count=3, max_count=12):
     selected = random.sample(FERTILIZER_SLUGS, min(count, len(FERTILIZER_SLUGS)))
     return selected
 
-def run_manual_optimization_test(scenario_id: int, client: httpx.Client, auth_headers: Dict[str, str]) -> Dict[str, Any]:
-    """Run a single optimization test with random parameters."""
-    deficit = generate_random_deficit()
-    micro_deficit = generate_random_micro_deficit() if random.random() > 0.3 else None
-    selected_slugs = select_random_fertilizers()
-    area_ha = random.choice([0.5, 1, 2, 5, 10, 20, 50, 100])
-    num_applications = random.choice([5, 8, 10, 12, 15, 20])
-    currency = random.choice(CURRENCIES)
-    irrigation_volume = random.choice([30, 50, 75, 100, 150, 200])
+def generate_fertilizer_selections(count: int, min_count=3, max_count=12) -> List[List[str]]:
+    """Pre-draw the fertilizer selections of `count` scenarios in one batch."""
+    slugs = FERTILIZER_SLUGS
+    upper = min(max_count, len(slugs))
+    sample = random.sample
+    randint = random.randint
+    return [sample(slugs, randint(min_count, upper)) for _ in range(count)]
+
+# Scratch dict reused by every encode_payload call
+_PAYLOAD: Dict[str, Any] = {}
+
+
+def encode_payload(
+    deficit: Dict[str, float],
+    area_ha: float,
+    num_applications: int,
+    selected_slugs: List[str],
+    currency: str,
+    irrigation_volume: int,
+    micro_deficit: Optional[Dict[str, float]],
+    acid_treatment: Optional[Dict[str, Any]]
+) -> bytes:
+    """
+    Fill the shared payload dict and return its JSON encoding.
+    
+    Safe with concurrent scenarios because filling and encoding happen in
+    one synchronous call: no other coroutine can run before the bytes exist.
+    """
+    payload = _PAYLOAD
+    payload.clear()
+    payload["deficit"] = deficit
+    payload["area_ha"] = area_ha
+    payload["num_applications"] = num_applications
+    payload["selected_fertilizer_slugs"] = selected_slugs
+    payload["currency"] = currency
+    payload["irrigation_volume_m3_ha"] = irrigation_volume
+    if micro_deficit:
+        payload["micro_deficit"] = micro_deficit
+    if acid_treatment:
+        payload["acid_treatment"] = acid_treatment
+    return json_dumps(payload)
+
+
+async def run_manual_optimization_test(
+    scenario_id: int,
+    client: httpx.AsyncClient,
+    deficit: Optional[Dict[str, float]] = None,
+    selected_slugs: Optional[List[str]] = None,
+    limiter: Optional[TokenBucket] = None,
+    config: Optional[ScenarioConfig] = None,
+    reauth: Optional[ReAuthenticator] = None,
+    _random=random.random,
+    _uniform=random.uniform,
+    _choice=random.choice,
+    _perf_counter=time.perf_counter,
+    _TimeoutException=httpx.TimeoutException
+) -> Dict[str, Any]:
+    """
+    Run a single optimization test with random parameters (deficit,
+    fertilizer selection and scenario config may be pre-drawn). A 401 is
+    retried once after `reauth` has logged in again.
     
-    crop = random.choice(CROPS)
-    stage = random.choice(GROWTH_STAGES)
-    soil_type = random.choice(SOIL_TYPES)
+    The client carries base_url, auth headers and timeout, so the request
+    site only passes the path and the pre-encoded payload. Underscore
+    defaults bind hot module globals as fast locals; callers never pass them.
+    """
+    if deficit is None:
+        deficit = generate_random_deficit()
+    micro_deficit = generate_random_micro_deficit() if _random() > 0.3 else None
+    if selected_slugs is None:
+        selected_slugs = select_random_fertilizers()
+    if config is None:
+        config = generate_scenario_configs(1)[0]
+    area_ha, num_applications, currency, irrigation_volume, crop, stage, soil_type = config
     
     acid_treatment = None
-    if random.random() > 0.6:
+    if _random() > 0.6:
         acid_treatment = {
-            "acid_type": random.choice(["phosphoric", "sulfuric", "nitric", "citric"]),
-            "ml_per_1000L": random.uniform(50, 500),
-            "cost_mxn_per_1000L": random.uniform(20, 200),
-            "n_g_per_1000L": random.uniform(0, 50) if random.random() > 0.5 else 0,
-            "p_g_per_1000L": random.uniform(0, 100) if random.random() > 0.5 else 0,
-            "s_g_per_1000L": random.uniform(0, 80) if random.random() > 0.5 else 0,
+            "acid_type": _choice(["phosphoric", "sulfuric", "nitric", "citric"]),
+            "ml_per_1000L": _uniform(50, 500),
+            "cost_mxn_per_1000L": _uniform(20, 200),
+            "n_g_per_1000L": _uniform(0, 50) if _random() > 0.5 else 0,
+            "p_g_per_1000L": _uniform(0, 100) if _random() > 0.5 else 0,
+            "s_g_per_1000L": _uniform(0, 80) if _random() > 0.5 else 0,
         }
     
-    payload = {
-        "deficit": deficit,
-        "area_ha": area_ha,
-        "num_applications": num_applications,
-        "selected_fertilizer_slugs": selected_slugs,
-        "currency": currency,
-        "irrigation_volume_m3_ha": irrigation_volume,
-    }
-    
-    if micro_deficit:
-        payload["micro_deficit"] = micro_deficit
-    if acid_treatment:
-        payload["acid_treatment"] = acid_treatment
+    body = encode_payload(
+        deficit, area_ha, num_applications, selected_slugs, currency,
+        irrigation_volume, micro_deficit, acid_treatment
+    )
     
     errors = []
     warnings = []
@@ -197,56 +380,71 @@ def run_manual_optimization_test(scenario_id: int, client: httpx.Client, auth_he
     response_time_ms = 0
     
     try:
-        import time
-        start = time.time()
-        response = client.post(
-            f"{BASE_URL}/api/fertiirrigation/optimize",
-            json=payload,
-            headers=auth_headers,
-            timeout=30.0
-        )
-        response_time_ms = (time.time() - start) * 1000
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            if limiter is not None:
+                await limiter.acquire()
+            start = _perf_counter()
+            response = await client.post(OPTIMIZE_PATH, content=body, headers=JSON_HEADERS)
+            response_time_ms = (_perf_counter() - start) * 1000
+            if response.status_code == 401 and reauth is not None:
+                retry = await reauth()
+                reauth = None  # at most one re-login retry per scenario
+                if retry:
+                    continue
+                break
+            if response.status_code != 429 or limiter is None or attempt == MAX_RATE_LIMIT_RETRIES:
+                break
+            limiter.backoff(retry_after_seconds(response, attempt))
         status_code = response.status_code
         
         if response.status_code != 200:
-            errors.append(f"HTTP {response.status_code}: {response.text[:200]}")
+            errors.append(f"HTTP {response.status_code}: {body_excerpt(response)}")
         else:
-            result = response.json()
+            result = json_loads(response.content)
             
             profiles = result.get("profiles", [])
             if not profiles:
                 errors.append("No profiles returned")
             else:
+                add_error = errors.append
+                add_warning = warnings.append
+                significant_deficit = sum(deficit.values()) > 20
+                
                 for profile in profiles:
-                    profile_type = profile.get("profile_type", "unknown")
-                    fertilizers = profile.get("fertilizers", [])
-                    coverage = profile.get("coverage", {})
-                    total_cost = profile.get("total_cost_ha", 0)
+                    profile_get = profile.get
+                    profile_type = profile_get("profile_type", "unknown")
+                    fertilizers = profile_get("fertilizers", [])
+                    coverage = profile_get("coverage", {})
+                    total_cost = profile_get("total_cost_ha", 0)
                     
-                    if not fertilizers and sum(deficit.values()) > 20:
-                        warnings.append(f"{profile_type}: No fertilizers despite significant deficit")
+                    if not fertilizers and significant_deficit:
+                        add_warning(f"{profile_type}: No fertilizers despite significant deficit")
                     
                     for nutrient, pct in coverage.items():
+                        # One range check covers the common in-bounds case
+                        if 0 <= pct <= 200:
+                            continue
                         if pct < 0:
-                            errors.append(f"{profile_type}: Negative coverage for {nutrient}: {pct}%")
-                        if pct > 200:
-                            warnings.append(f"{profile_type}: Very high coverage for {nutrient}: {pct}%")
+                            add_error(f"{profile_type}: Negative coverage for {nutrient}: {pct}%")
+                        else:
+                            add_warning(f"{profile_type}: Very high coverage for {nutrient}: {pct}%")
                     
                     if total_cost < 0:
-                        errors.append(f"{profile_type}: Negative cost: {total_cost}")
+                        add_error(f"{profile_type}: Negative cost: {total_cost}")
                     
                     for fert in fertilizers:
-                        dose = fert.get("dose_kg_ha", 0)
+                        fert_get = fert.get
+                        dose = fert_get("dose_kg_ha", 0)
                         if dose < 0:
-                            errors.append(f"{profile_type}: Negative dose for {fert.get('fertilizer_name')}: {dose}")
-                        if dose > 5000:
-                            warnings.append(f"{profile_type}: Very high dose for {fert.get('fertilizer_name')}: {dose} kg/ha")
+                            add_error(f"{profile_type}: Negative dose for {fert_get('fertilizer_name')}: {dose}")
+                        elif dose > 5000:
+                            add_warning(f"{profile_type}: Very high dose for {fert_get('fertilizer_name')}: {dose} kg/ha")
                         
-                        cost_ha = fert.get("cost_ha", 0)
+                        cost_ha = fert_get("cost_ha", 0)
                         if cost_ha < 0:
-                            errors.append(f"{profile_type}: Negative cost for {fert.get('fertilizer_name')}: {cost_ha}")
+                            add_error(f"{profile_type}: Negative cost for {fert_get('fertilizer_name')}: {cost_ha}")
                             
-    except httpx.TimeoutException:
+    except _TimeoutException:
         errors.append("Request timeout (>30s)")
     except Exception as e:
         errors.append(f"Exception: {str(e)}")
@@ -271,21 +469,21 @@ def run_manual_optimization_test(scenario_id: int, client: httpx.Client, auth_he
         "profiles_count": len(result.get("profiles", [])) if result else 0
     }
 
-def login_test_user(client: httpx.Client) -> Optional[Dict[str, str]]:
+async def login_test_user(client: httpx.AsyncClient) -> Optional[Dict[str, str]]:
     """Login and get auth headers. Returns None if login fails."""
     try:
         login_data = {
             "email": "test@agridoser.com",
             "password": "testpassword123"
         }
-        response = client.post(f"{BASE_URL}/api/auth/login", json=login_data)
+        response = await client.post("/api/auth/login", json=login_data)
         if response.status_code == 200:
             token = response.json().get("access_token")
             return {"Authorization": f"Bearer {token}"}
         else:
             print(f"Login failed, trying to register: {response.status_code}")
-            response_try_register = client.post(
-                f"{BASE_URL}/api/auth/register",
+            response_try_register = await client.post(
+                "/api/auth/register",
                 json={
                     "email": "test@agridoser.com",
                     "password": "testpassword123",
@@ -293,77 +491,204 @@ def login_test_user(client: httpx.Client) -> Optional[Dict[str, str]]:
                 }
             )
             if response_try_register.status_code in [200, 201]:
-                response = client.post(f"{BASE_URL}/api/auth/login", json=login_data)
+                response = await client.post("/api/auth/login", json=login_data)
                 if response.status_code == 200:
                     token = response.json().get("access_token")
                     return {"Authorization": f"Bearer {token}"}
                 else:
-                    print(f"Login after register failed: {response.status_code} - {response.text[:200]}")
+                    print(f"Login after register failed: {response.status_code} - {body_excerpt(response)}")
             else:
-                print(f"Register failed: {response_try_register.status_code} - {response_try_register.text[:200]}")
+                print(f"Register failed: {response_try_register.status_code} - {body_excerpt(response_try_register)}")
     except Exception as e:
         print(f"Login error: {e}")
     return None
 
-def run_all_tests(num_tests=1000):
+def load_cached_auth() -> Optional[Dict[str, str]]:
+    """Auth headers saved by a recent run against BASE_URL, if still fresh."""
+    try:
+        with open(TOKEN_CACHE_PATH, "rb") as f:
+            cached = json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("base_url") != BASE_URL:
+        return None
+    if cached.get("expires_at", 0) <= time.time():
+        return None
+    return cached.get("headers")
+
+
+def store_cached_auth(auth_headers: Dict[str, str]) -> None:
+    """
+    Save auth headers so the next run can skip the login round-trips.
+    
+    The file is owner-only (0600) and never written through a symlink.
+    """
+    try:
+        os.makedirs(TOKEN_CACHE_DIR, mode=0o700, exist_ok=True)
+        fd = os.open(
+            TOKEN_CACHE_PATH,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_NOFOLLOW", 0),
+            0o600
+        )
+        with os.fdopen(fd, "wb") as f:
+            if hasattr(os, "fchmod"):
+                # O_CREAT's mode only applies to new files
+                os.fchmod(fd, 0o600)
+            f.write(json_dumps({
+                "base_url": BASE_URL,
+                "expires_at": time.time() + TOKEN_CACHE_TTL,
+                "headers": auth_headers
+            }))
+    except OSError as e:
+        print(f"Could not cache auth token: {e}")
+
+
+def drop_cached_auth() -> None:
+    """Forget cached auth headers, e.g. after the server rejected them."""
+    try:
+        os.remove(TOKEN_CACHE_PATH)
+    except OSError:
+        pass
+
+
+async def register_fallback_user(client: httpx.AsyncClient) -> Optional[Dict[str, str]]:
+    """Register the dedicated fertirriego test user and log in with it."""
+    register_data = {
+        "email": "fertiirrigation_test@agridoser.com",
+        "password": "TestPassword123!",
+        "nombres": "Test",
+        "apellido_paterno": "User",
+        "apellido_materno": "Fertirriego",
+        "phone": "+525551234567",
+        "has_whatsapp": False
+    }
+    reg_response = await client.post("/api/auth/register", json=register_data)
+    print(f"Registration response: {reg_response.status_code}")
+    
+    login_data = {"email": register_data["email"], "password": register_data["password"]}
+    login_response = await client.post("/api/auth/login", json=login_data)
+    if login_response.status_code == 200:
+        token = login_response.json().get("access_token")
+        return {"Authorization": f"Bearer {token}"}
+    print(f"Still cannot login: {login_response.status_code}")
+    return None
+
+
+async def authenticate(client: httpx.AsyncClient) -> Optional[Dict[str, str]]:
+    """Cached auth headers if fresh, else log in (registering as needed) and cache them."""
+    auth_headers = load_cached_auth()
+    if auth_headers:
+        print("Using cached auth token.")
+        return auth_headers
+    return await login_and_cache(client)
+
+
+async def login_and_cache(client: httpx.AsyncClient) -> Optional[Dict[str, str]]:
+    """Log in (registering as needed), bypassing the cache, and cache the result."""
+    auth_headers = await login_test_user(client)
+    if not auth_headers:
+        print("ERROR: Could not authenticate. Creating test user...")
+        auth_headers = await register_fallback_user(client)
+    if auth_headers:
+        store_cached_auth(auth_headers)
+    return auth_headers
+
+
+def run_all_tests(num_tests=1000, concurrency=MAX_CONCURRENCY, max_rate=MAX_REQUESTS_PER_SECOND):
     """Run all tests and collect results."""
+    return asyncio.run(run_all_tests_async(num_tests, concurrency, max_rate))
+
+
+async def run_scenarios(
+    client: httpx.AsyncClient,
+    num_tests: int,
+    concurrency: int,
+    max_rate: Optional[float] = MAX_REQUESTS_PER_SECOND
+) -> Dict[str, Any]:
+    """
+    Run num_tests scenarios with at most `concurrency` requests in flight,
+    capped at `max_rate` requests per second (None for no ceiling).
+    """
+    sem = asyncio.Semaphore(concurrency)
+    limiter = TokenBucket(max_rate) if max_rate else None
+    reauth = ReAuthenticator(client)
+    deficits = generate_random_deficits(num_tests)
+    selections = generate_fertilizer_selections(num_tests)
+    configs = generate_scenario_configs(num_tests)
+    stats = {
+        "done": 0, "passed": 0, "failed": 0, "with_warnings": 0, "total_response_time": 0,
+        "error_types": Counter(), "warning_types": Counter()
+    }
+    
+    async def bounded(scenario_id: int) -> Dict[str, Any]:
+        async with sem:
+            result = await run_manual_optimization_test(
+                scenario_id, client, deficits[scenario_id - 1], selections[scenario_id - 1],
+                limiter, configs[scenario_id - 1], reauth
+            )
+        
+        stats["done"] += 1
+        stats["total_response_time"] += result.get("response_time_ms", 0)
+        stats["error_types"].update(map(issue_key, result["errors"]))
+        stats["warning_types"].update(map(issue_key, result["warnings"]))
+        if result["success"]:
+            stats["passed"] += 1
+            if result["warnings"]:
+                stats["with_warnings"] += 1
+        else:
+            stats["failed"] += 1
+        
+        done = stats["done"]
+        if done % 100 == 0:
+            avg_time = stats["total_response_time"] / done
+            print(f"Progress: {done}/{num_tests} tests ({stats['passed']} passed, {stats['failed']} failed, avg {avg_time:.0f}ms)")
+        return result
+    
+    # gather keeps results in scenario order regardless of completion order
+    stats["results"] = await asyncio.gather(*(bounded(i + 1) for i in range(num_tests)))
+    return stats
+
+
+async def run_all_tests_async(num_tests=1000, concurrency=MAX_CONCURRENCY, max_rate=MAX_REQUESTS_PER_SECOND):
+    """Async body of run_all_tests: scenarios run concurrently on one AsyncClient."""
     print(f"\n{'='*70}")
     print(f"FertiIrrigation Manual Mode - {num_tests} Scenario Test Suite")
     print(f"Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"{'='*70}\n")
     
-    with httpx.Client(timeout=30.0) as client:
+    limits = httpx.Limits(
+        max_connections=concurrency * 2,
+        max_keepalive_connections=concurrency * 2,
+        keepalive_expiry=60.0
+    )
+    async with httpx.AsyncClient(
+        base_url=BASE_URL,
+        timeout=httpx.Timeout(30.0),
+        limits=limits,
+        http2=HTTP2_AVAILABLE
+    ) as client:
         print("Logging in...")
-        auth_headers = login_test_user(client)
+        auth_headers = await authenticate(client)
         if not auth_headers:
-            print("ERROR: Could not authenticate. Creating test user...")
-            register_data = {
-                "email": "fertiirrigation_test@agridoser.com",
-                "password": "TestPassword123!",
-                "nombres": "Test",
-                "apellido_paterno": "User",
-                "apellido_materno": "Fertirriego",
-                "phone": "+525551234567",
-                "has_whatsapp": False
-            }
-            reg_response = client.post(f"{BASE_URL}/api/auth/register", json=register_data)
-            print(f"Registration response: {reg_response.status_code}")
-            
-            login_data = {"email": register_data["email"], "password": register_data["password"]}
-            login_response = client.post(f"{BASE_URL}/api/auth/login", json=login_data)
-            if login_response.status_code == 200:
-                token = login_response.json().get("access_token")
-                auth_headers = {"Authorization": f"Bearer {token}"}
-            else:
-                print(f"Still cannot login: {login_response.status_code}")
-                return {"total": 0, "passed": 0, "failed": 0, "with_warnings": 0, "pass_rate": 0, "results": []}
+            return {"total": 0, "passed": 0, "failed": 0, "with_warnings": 0, "pass_rate": 0, "results": []}
         
         print("Authentication successful. Starting tests...\n")
         
-        results = []
-        passed = 0
-        failed = 0
-        with_warnings = 0
-        total_response_time = 0
-        
-        for i in range(num_tests):
-            result = run_manual_optimization_test(i + 1, client, auth_headers)
-            results.append(result)
-            total_response_time += result.get("response_time_ms", 0)
-            
-            if result["success"]:
-                passed += 1
-                if result["warnings"]:
-                    with_warnings += 1
-            else:
-                failed += 1
-            
-            if (i + 1) % 100 == 0:
-                avg_time = total_response_time / (i + 1)
-                print(f"Progress: {i + 1}/{num_tests} tests ({passed} passed, {failed} failed, avg {avg_time:.0f}ms)")
-            
-            import time
-            time.sleep(0.35)
+        # Every scenario request reuses the client-level auth header
+        client.headers.update(auth_headers)
+        stats = await run_scenarios(client, num_tests, concurrency, max_rate)
+    
+    results = stats["results"]
+    passed = stats["passed"]
+    failed = stats["failed"]
+    with_warnings = stats["with_warnings"]
+    total_response_time = stats["total_response_time"]
+    error_types = stats["error_types"]
+    warning_types = stats["warning_types"]
+    
+    if error_types.get("HTTP 401"):
+        # Token expired or server secret changed: log in afresh next run
+        drop_cached_auth()
     
     avg_response_time = total_response_time / num_tests if num_tests > 0 else 0
     
@@ -381,13 +706,7 @@ def run_all_tests(num_tests=1000):
         print("ERROR ANALYSIS")
         print(f"{'='*70}")
         
-        error_types = {}
-        for r in results:
-            for err in r["errors"]:
-                err_key = err.split(":")[0] if ":" in err else err[:50]
-                error_types[err_key] = error_types.get(err_key, 0) + 1
-        
-        for err_type, count in sorted(error_types.items(), key=lambda x: -x[1])[:10]:
+        for err_type, count in error_types.most_common(10):
             print(f"  {count}x: {err_type}")
     
     if with_warnings > 0:
@@ -395,62 +714,51 @@ def run_all_tests(num_tests=1000):
         print("WARNING ANALYSIS")
         print(f"{'='*70}")
         
-        warning_types = {}
-        for r in results:
-            for warn in r["warnings"]:
-                warn_key = warn.split(":")[0] if ":" in warn else warn[:50]
-                warning_types[warn_key] = warning_types.get(warn_key, 0) + 1
-        
-        for warn_type, count in sorted(warning_types.items(), key=lambda x: -x[1])[:10]:
+        for warn_type, count in warning_types.most_common(10):
             print(f"  {count}x: {warn_type}")
     
     print(f"\n{'='*70}")
     print("STATISTICS BY CATEGORY")
     print(f"{'='*70}")
     
-    currency_stats = {}
+    # One pass: [total, passed] per currency and per fertilizer count,
+    # plus the first 5 failures in scenario order
+    currency_stats = defaultdict(lambda: [0, 0])
+    fert_count_stats = defaultdict(lambda: [0, 0])
+    sample_failures = []
     for r in results:
-        c = r["currency"]
-        if c not in currency_stats:
-            currency_stats[c] = {"total": 0, "passed": 0}
-        currency_stats[c]["total"] += 1
-        if r["success"]:
-            currency_stats[c]["passed"] += 1
+        ok = r["success"]
+        c_stats = currency_stats[r["currency"]]
+        fc_stats = fert_count_stats[r["num_fertilizers_selected"]]
+        c_stats[0] += 1
+        fc_stats[0] += 1
+        if ok:
+            c_stats[1] += 1
+            fc_stats[1] += 1
+        elif len(sample_failures) < 5:
+            sample_failures.append(r)
     
     print("\nBy Currency:")
-    for c, stats in sorted(currency_stats.items()):
-        pct = 100 * stats["passed"] / stats["total"]
-        print(f"  {c}: {stats['passed']}/{stats['total']} ({pct:.1f}%)")
-    
-    fert_count_stats = {}
-    for r in results:
-        fc = r["num_fertilizers_selected"]
-        if fc not in fert_count_stats:
-            fert_count_stats[fc] = {"total": 0, "passed": 0}
-        fert_count_stats[fc]["total"] += 1
-        if r["success"]:
-            fert_count_stats[fc]["passed"] += 1
+    for c, (total, ok_count) in sorted(currency_stats.items()):
+        pct = 100 * ok_count / total
+        print(f"  {c}: {ok_count}/{total} ({pct:.1f}%)")
     
     print("\nBy Fertilizer Count:")
-    for fc in sorted(fert_count_stats.keys()):
-        stats = fert_count_stats[fc]
-        pct = 100 * stats["passed"] / stats["total"]
-        print(f"  {fc} fertilizers: {stats['passed']}/{stats['total']} ({pct:.1f}%)")
+    for fc, (total, ok_count) in sorted(fert_count_stats.items()):
+        pct = 100 * ok_count / total
+        print(f"  {fc} fertilizers: {ok_count}/{total} ({pct:.1f}%)")
     
     if failed > 0:
         print(f"\n{'='*70}")
         print("SAMPLE FAILURES (first 5)")
         print(f"{'='*70}")
         
-        failure_count = 0
-        for r in results:
-            if not r["success"] and failure_count < 5:
-                print(f"\nScenario {r['scenario_id']}:")
-                print(f"  Crop: {r['crop']}, Stage: {r['stage']}")
-                print(f"  Currency: {r['currency']}, Fertilizers: {r['num_fertilizers_selected']}")
-                print(f"  Status: {r['status_code']}, Time: {r['response_time_ms']:.0f}ms")
-                print(f"  Errors: {r['errors'][:3]}")
-                failure_count += 1
+        for r in sample_failures:
+            print(f"\nScenario {r['scenario_id']}:")
+            print(f"  Crop: {r['crop']}, Stage: {r['stage']}")
+            print(f"  Currency: {r['currency']}, Fertilizers: {r['num_fertilizers_selected']}")
+            print(f"  Status: {r['status_code']}, Time: {r['response_time_ms']:.0f}ms")
+            print(f"  Errors: {r['errors'][:3]}")
     
     print(f"\n{'='*70}")
     print(f"Test completed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
@@ -466,23 +774,52 @@ def run_all_tests(num_tests=1000):
         "results": results
     }
 
+def write_results_file(path: str, summary: Dict[str, Any]) -> None:
+    """
+    Stream the summary plus failing/warning scenarios to `path` as JSON.
+    
+    Each scenario is encoded and written on its own, so no filtered copies
+    of the results list are built.
+    """
+    results = summary["results"]
+    header = {
+        "total": summary["total"],
+        "passed": summary["passed"],
+        "failed": summary["failed"],
+        "with_warnings": summary["with_warnings"],
+        "pass_rate": summary["pass_rate"],
+        "avg_response_time_ms": summary.get("avg_response_time_ms", 0)
+    }
+    
+    def write_section(f, name: bytes, keep) -> None:
+        f.write(b',\n  "' + name + b'": [')
+        sep = b"\n    "
+        for r in results:
+            if keep(r):
+                f.write(sep)
+                f.write(json_dumps(r))
+                sep = b",\n    "
+        f.write(b"\n  ]" if sep != b"\n    " else b"]")
+    
+    with open(path, "wb") as f:
+        f.write(b'{\n  "summary": ' + json_dumps(header))
+        write_section(f, b"failures", lambda r: not r["success"])
+        write_section(f, b"warnings", lambda r: r["warnings"])
+        f.write(b"\n}\n")
+
+
 if __name__ == "__main__":
+    try:
+        import uvloop
+    except ImportError:
+        pass  # optional: default asyncio loop
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    
     num_tests = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
     summary = run_all_tests(num_tests)
     
-    with open("/tmp/fertiirrigation_manual_test_results.json", "w") as f:
-        json.dump({
-            "summary": {
-                "total": summary["total"],
-                "passed": summary["passed"],
-                "failed": summary["failed"],
-                "with_warnings": summary["with_warnings"],
-                "pass_rate": summary["pass_rate"],
-                "avg_response_time_ms": summary.get("avg_response_time_ms", 0)
-            },
-            "failures": [r for r in summary["results"] if not r["success"]],
-            "warnings": [r for r in summary["results"] if r["warnings"]]
-        }, f, indent=2)
+    write_results_file("/tmp/fertiirrigation_manual_test_results.json", summary)
     
     print(f"Detailed results saved to /tmp/fertiirrigation_manual_test_results.json")
     
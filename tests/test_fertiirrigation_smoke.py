@@ -10,6 +10,12 @@ import pytest
 import time
 import json
 import os
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json fallback
+    orjson = None
+
 from app.services.fertiirrigation_ai_optimizer import (
     enforce_hard_constraints,
     cap_fertilizers_by_nutrient,
@@ -19,59 +25,90 @@ from app.services.fertiirrigation_ai_optimizer import (
 )
 
 
+# Smoke tests are independent (profiles are per-test, catalogs read-only);
+# grouping them keeps the session catalogs to one worker under --dist loadgroup
+pytestmark = pytest.mark.xdist_group("fertiirrigation_smoke")
+
+# Wall-clock limits (integer ns from time.monotonic_ns)
+SMOKE_LIMIT_NS = 200_000_000
+PASS_THROUGH_LIMIT_NS = 100_000_000
+
+MOCK_CATALOG = [
+    {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'n_pct': 21, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 24},
+    {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio', 'n_pct': 0, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 9.8, 's_pct': 13},
+    {'id': 'map', 'name': 'Fosfato Monoamónico (MAP)', 'n_pct': 12, 'p2o5_pct': 61, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
+    {'id': 'calcium_nitrate', 'name': 'Nitrato de Calcio', 'n_pct': 15.5, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 19, 'mg_pct': 0, 's_pct': 0},
+    {'id': 'urea', 'name': 'Urea', 'n_pct': 46, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
+]
+
+# Hydro catalog -> fertiirrigation conversions (% NO3 -> % N, % CaO -> % Ca, % MgO -> % Mg)
+NO3_TO_N_PCT = 14 / 62 * 100
+CAO_TO_CA = 0.714
+MGO_TO_MG = 0.603
+
+# S fraction (s_pct / 100) per mock catalog id, for S totals in assertions
+_S_FRAC = {c['id']: c['s_pct'] / 100.0 for c in MOCK_CATALOG}
+
+
+def _s_total(profile):
+    """kg/ha of S supplied by a profile's fertilizers (mock catalog S contents)."""
+    return sum(
+        fert.get('dose_kg_ha', 0) * _S_FRAC.get(fert.get('id', ''), 0.0)
+        for fert in profile['fertilizers']
+    )
+
+
 # =============================================================================
 # Test Fixtures - Simulated real data
 # =============================================================================
 
-@pytest.fixture
+# Catalog fixtures are read-only inputs to the pipeline, so they are built
+# once per session; profiles are mutated in place and stay function-scoped
+
+@pytest.fixture(scope="session")
 def real_catalog():
     """Load real fertilizer catalog or use mock equivalent."""
     catalog_path = os.path.join(os.path.dirname(__file__), '..', 'app', 'data', 'hydro_fertilizers.json')
     
-    if os.path.exists(catalog_path):
-        with open(catalog_path, 'r') as f:
-            data = json.load(f)
-        # Convert to format expected by optimizer
-        fertilizers = []
-        for fert in data.get('fertilizers', []):
-            # Map hydro format to fertiirrigation format
-            fertilizers.append({
-                'id': fert.get('id', ''),
-                'name': fert.get('name', ''),
-                'n_pct': fert.get('composition', {}).get('n_total_pct', 0) or fert.get('ion_contributions', {}).get('NO3', 0) * 14 / 62 * 100 if fert.get('ion_contributions') else 0,
-                'p2o5_pct': fert.get('composition', {}).get('p2o5_pct', 0) or 0,
-                'k2o_pct': fert.get('composition', {}).get('k2o_pct', 0) or 0,
-                'ca_pct': fert.get('composition', {}).get('cao_pct', 0) * 0.714 if fert.get('composition', {}).get('cao_pct') else 0,
-                'mg_pct': fert.get('composition', {}).get('mgo_pct', 0) * 0.603 if fert.get('composition', {}).get('mgo_pct') else 0,
-                's_pct': fert.get('composition', {}).get('s_pct', 0) or 0,
-            })
-        return fertilizers
-    
-    # Fallback mock catalog
-    return [
-        {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'n_pct': 21, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 24},
-        {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio', 'n_pct': 0, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 9.8, 's_pct': 13},
-        {'id': 'map', 'name': 'Fosfato Monoamónico (MAP)', 'n_pct': 12, 'p2o5_pct': 61, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
-        {'id': 'calcium_nitrate', 'name': 'Nitrato de Calcio', 'n_pct': 15.5, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 19, 'mg_pct': 0, 's_pct': 0},
-        {'id': 'urea', 'name': 'Urea', 'n_pct': 46, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
-        {'id': 'potassium_nitrate', 'name': 'Nitrato de Potasio', 'n_pct': 13, 'p2o5_pct': 0, 'k2o_pct': 46, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
-        {'id': 'potassium_sulfate', 'name': 'Sulfato de Potasio', 'n_pct': 0, 'p2o5_pct': 0, 'k2o_pct': 50, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 17},
-    ]
-
-
-@pytest.fixture
+    try:
+        f = open(catalog_path, 'rb')
+    except FileNotFoundError:
+        # Fallback: the mock catalog plus the potassium sources it lacks
+        return MOCK_CATALOG + [
+            {'id': 'potassium_nitrate', 'name': 'Nitrato de Potasio', 'n_pct': 13, 'p2o5_pct': 0, 'k2o_pct': 46, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
+            {'id': 'potassium_sulfate', 'name': 'Sulfato de Potasio', 'n_pct': 0, 'p2o5_pct': 0, 'k2o_pct': 50, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 17},
+        ]
+    with f:
+        raw = f.read()
+    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    # Convert to format expected by optimizer
+    fertilizers = []
+    for fert in data.get('fertilizers', []):
+        # Map hydro format to fertiirrigation format
+        comp = fert.get('composition', {})
+        ions = fert.get('ion_contributions')
+        cao = comp.get('cao_pct')
+        mgo = comp.get('mgo_pct')
+        fertilizers.append({
+            'id': fert.get('id', ''),
+            'name': fert.get('name', ''),
+            'n_pct': comp.get('n_total_pct', 0) or ions.get('NO3', 0) * NO3_TO_N_PCT if ions else 0,
+            'p2o5_pct': comp.get('p2o5_pct', 0) or 0,
+            'k2o_pct': comp.get('k2o_pct', 0) or 0,
+            'ca_pct': cao * CAO_TO_CA if cao else 0,
+            'mg_pct': mgo * MGO_TO_MG if mgo else 0,
+            's_pct': comp.get('s_pct', 0) or 0,
+        })
+    return fertilizers
+
+
+@pytest.fixture(scope="session")
 def mock_catalog():
     """Simplified mock catalog for deterministic tests."""
-    return [
-        {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'n_pct': 21, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 24},
-        {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio', 'n_pct': 0, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 9.8, 's_pct': 13},
-        {'id': 'map', 'name': 'Fosfato Monoamónico (MAP)', 'n_pct': 12, 'p2o5_pct': 61, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
-        {'id': 'calcium_nitrate', 'name': 'Nitrato de Calcio', 'n_pct': 15.5, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 19, 'mg_pct': 0, 's_pct': 0},
-        {'id': 'urea', 'name': 'Urea', 'n_pct': 46, 'p2o5_pct': 0, 'k2o_pct': 0, 'ca_pct': 0, 'mg_pct': 0, 's_pct': 0},
-    ]
+    return MOCK_CATALOG
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sulfate_only_catalog():
     """Catalog with ONLY sulfate N sources - will trigger error."""
     return [
@@ -120,116 +157,157 @@ def deficits_zero_s():
     }
 
 
+@pytest.fixture
+def two_sulfates_profile():
+    """Profile with two sulfate fertilizers and nothing else."""
+    return {
+        'fertilizers': [
+            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 10},
+            {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio', 'dose_kg_ha': 10},
+        ]
+    }
+
+
+@pytest.fixture
+def many_small_sulfates_profile():
+    """Four small sulfate doses, each under the S cap but over it in total (~3 kg S)."""
+    return {
+        'fertilizers': [
+            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 5},
+            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio 2', 'dose_kg_ha': 5},
+            {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio', 'dose_kg_ha': 5},
+            {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio 2', 'dose_kg_ha': 5},
+        ]
+    }
+
+
+@pytest.fixture
+def sulfate_free_profile():
+    """Profile without sulfates - nothing for the S cap to do."""
+    return {
+        'fertilizers': [
+            {'id': 'calcium_nitrate', 'name': 'Nitrato de Calcio', 'dose_kg_ha': 50},
+            {'id': 'map', 'name': 'MAP', 'dose_kg_ha': 20},
+        ]
+    }
+
+
+@pytest.fixture
+def deficits_sulfates_only():
+    """N/Mg/S-only deficits with S = 1.0 kg/ha, for the sulfate-only profiles."""
+    return {
+        'N': 5.0,
+        'P2O5': 0,
+        'K2O': 0,
+        'Ca': 0,
+        'Mg': 1.0,
+        'S': 1.0  # Low S deficit
+    }
+
+
+@pytest.fixture
+def deficits_s_sufficient():
+    """Deficits with S = 5 kg/ha - above the aggressive-cap range."""
+    return {
+        'N': 10.0,
+        'P2O5': 12.0,
+        'K2O': 0,
+        'Ca': 10.0,
+        'Mg': 0,
+        'S': 5.0  # Sufficient S deficit - no aggressive cap needed
+    }
+
+
 # =============================================================================
 # Smoke Tests - Must complete in < 0.2s
 # =============================================================================
 
-def run_pipeline(profile, deficits, catalog, water_analysis=None):
+def make_pipeline(catalog, water_analysis=None):
     """
-    Run the full post-processing pipeline:
+    Bind catalog and agronomic context once and return run(profile, deficits),
+    which runs the full post-processing pipeline:
     1. enforce_hard_constraints
     2. cap_fertilizers_by_nutrient (S cap)
     3. normalize_coverage
     
-    Returns (profile, elapsed_time)
+    and returns (profile, elapsed_ns).
     """
-    water = water_analysis or {'cl_meq_l': 0.5}
-    agronomic_context = {'water': water}
-    
-    start = time.perf_counter()
-    
-    # Phase 1: Hard constraints
-    # Signature: profile, deficits, agronomic_context, available_fertilizers, growth_stage
-    profile = enforce_hard_constraints(profile, deficits, agronomic_context, catalog)
+    agronomic_context = {'water': water_analysis or {'cl_meq_l': 0.5}}
     
-    # Phase 2: S Cap (only if S deficit > 0 and < 5 kg/ha)
-    s_deficit = deficits.get('S', 0)
-    if s_deficit > 0 and s_deficit < 5.0:
-        profile = cap_fertilizers_by_nutrient(
-            profile, deficits, catalog,
-            max_coverage_pct=110,
-            nutrient='S',
-            num_applications=10
-        )
-    elif s_deficit <= 0:
-        # Zero deficit - force zero sulfates
-        profile = cap_fertilizers_by_nutrient(
+    def run(profile, deficits):
+        start = time.monotonic_ns()
+        
+        # Phase 1: Hard constraints
+        # Signature: profile, deficits, agronomic_context, available_fertilizers, growth_stage
+        profile = enforce_hard_constraints(profile, deficits, agronomic_context, catalog)
+        
+        # Phase 2: S Cap (S deficit < 5 kg/ha; a zero deficit forces zero sulfates)
+        if deficits.get('S', 0) < 5.0:
+            profile = cap_fertilizers_by_nutrient(
+                profile, deficits, catalog,
+                max_coverage_pct=110,
+                nutrient='S',
+                num_applications=10
+            )
+        
+        # Phase 3: Normalize coverage
+        profile = normalize_coverage(
             profile, deficits, catalog,
             max_coverage_pct=110,
-            nutrient='S',
             num_applications=10
         )
+        
+        return profile, time.monotonic_ns() - start
     
-    # Phase 3: Normalize coverage
-    profile = normalize_coverage(
-        profile, deficits, catalog,
-        max_coverage_pct=110,
-        num_applications=10
-    )
-    
-    elapsed = time.perf_counter() - start
-    return profile, elapsed
+    return run
 
 
-def test_smoke_pipeline_low_s_deficit(profile_with_sulfates, deficits_low_s, mock_catalog):
-    """
-    SMOKE TEST: Pipeline with S=1.5 kg/ha must complete in < 0.2s
-    and produce valid output with S ≤ 110%.
-    """
-    profile, elapsed = run_pipeline(profile_with_sulfates, deficits_low_s, mock_catalog)
-    
-    # Must complete quickly
-    assert elapsed < 0.2, f"Pipeline took {elapsed:.3f}s - exceeds 0.2s limit (possible loop)"
-    
-    # Must return valid profile
-    assert profile is not None
-    assert 'fertilizers' in profile
-    
-    # Calculate S coverage
-    total_s = 0
-    for fert in profile['fertilizers']:
-        fert_id = fert.get('id', '')
-        dose = fert.get('dose_kg_ha', 0)
-        if fert_id == 'ammonium_sulfate':
-            total_s += dose * 0.24
-        elif fert_id == 'magnesium_sulfate':
-            total_s += dose * 0.13
-    
-    max_s_allowed = deficits_low_s['S'] * 1.10  # 1.65 kg
-    assert total_s <= max_s_allowed + 0.01, f"S must be ≤{max_s_allowed:.2f} kg, got {total_s:.2f} kg"
-    
-    print(f"\n[SMOKE] Pipeline completed in {elapsed*1000:.1f}ms")
-    print(f"[SMOKE] S coverage: {total_s:.2f} kg / {max_s_allowed:.2f} kg max ({total_s/deficits_low_s['S']*100:.0f}%)")
+@pytest.fixture(scope="module")
+def pipeline(mock_catalog):
+    """Pipeline bound to the mock catalog, built once per module."""
+    return make_pipeline(mock_catalog)
 
 
-def test_smoke_pipeline_zero_s_deficit(profile_with_sulfates, deficits_zero_s, mock_catalog):
+# (profile fixture, deficits fixture, time limit); ids name the scenario
+SMOKE_CASES = [
+    # S=1.5 kg/ha: aggressive capping, S must end ≤ 110%
+    pytest.param('profile_with_sulfates', 'deficits_low_s', SMOKE_LIMIT_NS, id='low_s_deficit'),
+    # S=0: all sulfate contributions removed
+    pytest.param('profile_with_sulfates', 'deficits_zero_s', SMOKE_LIMIT_NS, id='zero_s_deficit'),
+    # Multiple sulfates capped together without loops
+    pytest.param('two_sulfates_profile', 'deficits_sulfates_only', SMOKE_LIMIT_NS, id='multiple_sulfates'),
+    # S already within limits: pass-through must be near instant
+    pytest.param('sulfate_free_profile', 'deficits_s_sufficient', PASS_THROUGH_LIMIT_NS, id='no_capping_needed'),
+    # REGRESSION: individual S contributions under max but TOTAL over the cap;
+    # PRE-CAP must calculate N loss using total excess, not per-fertilizer excess
+    pytest.param('many_small_sulfates_profile', 'deficits_sulfates_only', SMOKE_LIMIT_NS, id='many_small_sulfates'),
+]
+
+
+@pytest.mark.parametrize('profile_fixture,deficits_fixture,limit_ns', SMOKE_CASES)
+def test_smoke_pipeline(request, profile_fixture, deficits_fixture, limit_ns, pipeline):
     """
-    SMOKE TEST: Pipeline with S=0 must complete in < 0.2s
-    and remove all sulfate contributions.
+    SMOKE TEST: the pipeline completes within limit_ns and leaves
+    S ≤ 110% of the S deficit (~0 when the deficit is 0).
     """
-    profile, elapsed = run_pipeline(profile_with_sulfates, deficits_zero_s, mock_catalog)
+    deficits = request.getfixturevalue(deficits_fixture)
+    profile, elapsed_ns = pipeline(request.getfixturevalue(profile_fixture), deficits)
     
     # Must complete quickly
-    assert elapsed < 0.2, f"Pipeline took {elapsed:.3f}s - exceeds 0.2s limit (possible loop)"
+    assert elapsed_ns < limit_ns, (
+        f"Pipeline took {elapsed_ns / 1e9:.3f}s - exceeds {limit_ns / 1e9:.1f}s limit (possible loop)"
+    )
     
     # Must return valid profile
     assert profile is not None
     assert 'fertilizers' in profile
     
-    # S must be 0 (all sulfates removed or zeroed)
-    total_s = 0
-    for fert in profile['fertilizers']:
-        fert_id = fert.get('id', '')
-        dose = fert.get('dose_kg_ha', 0)
-        if fert_id == 'ammonium_sulfate':
-            total_s += dose * 0.24
-        elif fert_id == 'magnesium_sulfate':
-            total_s += dose * 0.13
-    
-    assert total_s <= 0.01, f"S must be ~0 when deficit=0, got {total_s:.2f} kg"
+    total_s = _s_total(profile)
+    max_s_allowed = deficits['S'] * 1.10
+    assert total_s <= max_s_allowed + 0.01, f"S must be ≤{max_s_allowed:.2f} kg, got {total_s:.2f} kg"
     
-    print(f"\n[SMOKE] Pipeline completed in {elapsed*1000:.1f}ms")
-    print(f"[SMOKE] S contribution: {total_s:.4f} kg (should be ~0)")
+    print(f"\n[SMOKE] {request.node.callspec.id} completed in {elapsed_ns / 1e6:.1f}ms, "
+          f"S={total_s:.2f} kg / {max_s_allowed:.2f} kg max")
 
 
 def test_smoke_catalog_incompatible(deficits_low_s, sulfate_only_catalog):
@@ -243,7 +321,7 @@ def test_smoke_catalog_incompatible(deficits_low_s, sulfate_only_catalog):
         ]
     }
     
-    start = time.perf_counter()
+    start = time.monotonic_ns()
     
     try:
         result = cap_fertilizers_by_nutrient(
@@ -252,131 +330,26 @@ def test_smoke_catalog_incompatible(deficits_low_s, sulfate_only_catalog):
             nutrient='S',
             num_applications=10
         )
-        elapsed = time.perf_counter() - start
+        elapsed_ns = time.monotonic_ns() - start
         
         # Should have raised error, but if not, check for cap_error or optimization_failed
-        assert elapsed < 0.2, f"Took {elapsed:.3f}s - exceeds limit"
+        assert elapsed_ns < SMOKE_LIMIT_NS, f"Took {elapsed_ns / 1e9:.3f}s - exceeds limit"
         assert 'cap_error' in result or 'optimization_failed' in result, \
             "Should indicate failure when no S-free alternatives exist"
         
     except SulfurCapError as e:
-        elapsed = time.perf_counter() - start
-        assert elapsed < 0.2, f"Exception path took {elapsed:.3f}s - exceeds limit"
+        elapsed_ns = time.monotonic_ns() - start
+        assert elapsed_ns < SMOKE_LIMIT_NS, f"Exception path took {elapsed_ns / 1e9:.3f}s - exceeds limit"
         assert "S-free" in str(e) or "alternatives" in str(e) or "exceeds" in str(e), \
             "Error message should mention S-free alternatives"
-        print(f"\n[SMOKE] Correctly raised SulfurCapError in {elapsed*1000:.1f}ms")
+        print(f"\n[SMOKE] Correctly raised SulfurCapError in {elapsed_ns / 1e6:.1f}ms")
         print(f"[SMOKE] Error: {e}")
 
 
-def test_smoke_multiple_sulfates(mock_catalog):
-    """
-    SMOKE TEST: Profile with multiple sulfate fertilizers
-    must be capped correctly without loops.
-    """
-    profile = {
-        'fertilizers': [
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 10},
-            {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio', 'dose_kg_ha': 10},
-        ]
-    }
-    deficits = {
-        'N': 5.0,
-        'P2O5': 0,
-        'K2O': 0,
-        'Ca': 0,
-        'Mg': 1.0,
-        'S': 1.0  # Low S deficit
-    }
-    
-    profile, elapsed = run_pipeline(profile, deficits, mock_catalog)
-    
-    assert elapsed < 0.2, f"Pipeline took {elapsed:.3f}s - exceeds limit"
-    
-    # Calculate S
-    total_s = 0
-    for fert in profile['fertilizers']:
-        fert_id = fert.get('id', '')
-        dose = fert.get('dose_kg_ha', 0)
-        if fert_id == 'ammonium_sulfate':
-            total_s += dose * 0.24
-        elif fert_id == 'magnesium_sulfate':
-            total_s += dose * 0.13
-    
-    max_s = deficits['S'] * 1.10
-    assert total_s <= max_s + 0.01, f"S must be ≤{max_s:.2f} kg, got {total_s:.2f} kg"
-    
-    print(f"\n[SMOKE] Multi-sulfate completed in {elapsed*1000:.1f}ms, S={total_s:.2f} kg")
-
-
-def test_smoke_no_capping_needed(mock_catalog):
-    """
-    SMOKE TEST: When S is already within limits, pipeline should
-    pass through quickly without modifications.
-    """
-    profile = {
-        'fertilizers': [
-            {'id': 'calcium_nitrate', 'name': 'Nitrato de Calcio', 'dose_kg_ha': 50},
-            {'id': 'map', 'name': 'MAP', 'dose_kg_ha': 20},
-        ]
-    }
-    deficits = {
-        'N': 10.0,
-        'P2O5': 12.0,
-        'K2O': 0,
-        'Ca': 10.0,
-        'Mg': 0,
-        'S': 5.0  # Sufficient S deficit - no aggressive cap needed
-    }
-    
-    profile, elapsed = run_pipeline(profile, deficits, mock_catalog)
-    
-    assert elapsed < 0.1, f"No-cap pipeline took {elapsed:.3f}s - should be instant"
-    assert 'fertilizers' in profile
-    
-    print(f"\n[SMOKE] Pass-through completed in {elapsed*1000:.1f}ms")
-
-
-def test_smoke_many_small_sulfates(mock_catalog):
-    """
-    REGRESSION TEST: Many small sulfate doses where individual S contributions
-    are under max but TOTAL exceeds cap. PRE-CAP must calculate N loss using
-    total excess, not per-fertilizer excess.
-    """
-    profile = {
-        'fertilizers': [
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio', 'dose_kg_ha': 5},
-            {'id': 'ammonium_sulfate', 'name': 'Sulfato de Amonio 2', 'dose_kg_ha': 5},
-            {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio', 'dose_kg_ha': 5},
-            {'id': 'magnesium_sulfate', 'name': 'Sulfato de Magnesio 2', 'dose_kg_ha': 5},
-        ]
-    }
-    deficits = {
-        'N': 5.0,
-        'P2O5': 0,
-        'K2O': 0,
-        'Ca': 0,
-        'Mg': 1.0,
-        'S': 1.0  # Low S deficit, total S from 4 sulfates ~3 kg
-    }
-    
-    profile, elapsed = run_pipeline(profile, deficits, mock_catalog)
-    
-    assert elapsed < 0.2, f"Pipeline took {elapsed:.3f}s - exceeds limit"
-    
-    # Calculate S
-    total_s = 0
-    for fert in profile['fertilizers']:
-        fert_id = fert.get('id', '')
-        dose = fert.get('dose_kg_ha', 0)
-        if fert_id == 'ammonium_sulfate':
-            total_s += dose * 0.24
-        elif fert_id == 'magnesium_sulfate':
-            total_s += dose * 0.13
-    
-    max_s = deficits['S'] * 1.10
-    assert total_s <= max_s + 0.01, f"S must be ≤{max_s:.2f} kg, got {total_s:.2f} kg"
-    
-    print(f"\n[SMOKE] Many-small-sulfates completed in {elapsed*1000:.1f}ms, S={total_s:.2f} kg")
+def test_sulfate_set_is_hashed():
+    """SULFATE_FERTILIZERS is probed per fertilizer in the pipeline; keep it O(1)."""
+    assert isinstance(SULFATE_FERTILIZERS, frozenset)
+    assert 'ammonium_sulfate' in SULFATE_FERTILIZERS
 
 
 if __name__ == '__main__':
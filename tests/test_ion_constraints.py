@@ -13,7 +13,8 @@ from app.services.fertiirrigation_ai_optimizer import (
     build_ion_constraints,
     apply_ion_constraints,
     format_constraints_for_prompt,
-    normalize_stage
+    normalize_stage,
+    _ion_rule_chloride,
 )
 
 
@@ -189,6 +190,27 @@ class TestBuildIonConstraints:
         
         assert 'RULE_6_AB_COMPATIBILITY' in constraints['rules_applied']
         assert len(constraints['compatibility']['notes']) >= 2
+    
+    def test_rule_runs_standalone(self):
+        """Each rule can be exercised on its own against a constraints object."""
+        ctx = {'water': {'cl_meq_l': 3.5}, 'soil': {},
+               'normalized_stage': 'vegetative', 'max_coverage_pct': 110}
+        out = {'hard_bans': set(), 'caps_kg_ha': {}, 'nutrient_shares': {},
+               'warnings': [], 'rules_applied': []}
+        
+        _ion_rule_chloride(ctx, 'tomate', 'Vegetativo', {}, out)
+        
+        assert 'potassium_chloride' in out['hard_bans']
+        assert out['rules_applied'] == ['RULE_1_CL_HIGH']
+    
+    def test_missing_water_skips_water_rules(self):
+        """Without a water analysis only the crop/soil rules run."""
+        deficits = {'N': 10, 'P2O5': 5, 'K2O': 20, 'Ca': 0, 'Mg': 0, 'S': 5}
+        
+        constraints = build_ion_constraints(None, 'Tomate', 'Vegetativo', deficits)
+        
+        assert constraints['rules_applied'] == ['RULE_6_AB_COMPATIBILITY']
+        assert not constraints['hard_bans']
 
 
 class TestApplyIonConstraints:
@@ -350,6 +372,18 @@ class TestFormatConstraintsForPrompt:
         assert '30%' in result
         assert 'NO3' in result
         assert '70%' in result
+    
+    def test_cap_order_is_kept_across_cached_calls(self):
+        """Cached output must still follow each call's cap order."""
+        base = {'hard_bans': [], 'nutrient_shares': {}, 'warnings': []}
+        
+        first = format_constraints_for_prompt({**base, 'caps_kg_ha': {'S': 1.0, 'K2O': 5.0}})
+        again = format_constraints_for_prompt({**base, 'caps_kg_ha': {'S': 1.0, 'K2O': 5.0}})
+        swapped = format_constraints_for_prompt({**base, 'caps_kg_ha': {'K2O': 5.0, 'S': 1.0}})
+        
+        assert first == again
+        assert first.index('S: max') < first.index('K2O: max')
+        assert swapped.index('K2O: max') < swapped.index('S: max')
 
 
 class TestNormalizeStage: